@@ -0,0 +1,324 @@
+"""In-process inverted index for product search and typeahead.
+
+Products are tokenized from ``name``, ``category`` and ``description``. Each
+term maps to the products containing it, weighted by the fields it appears
+in, and a score is the sum over query words of field weight times inverse
+document frequency. The word still being typed is completed from the terms
+of product names and categories, most common first.
+
+Every term keeps its products ranked by weight (overall and per category),
+sorted on first use and then maintained on each change. A query walks the
+rankings of its rarest word from the top, looks the other words up, and stops
+as soon as no product further down could still make the results. When the
+words rarely occur together that walk would be long, so such queries (and
+walks that overrun their estimate) intersect the postings as sets instead and
+score only the products that match. A prefix typed after complete words runs
+as one such query per completion, the completion with the best possible score
+first, until no remaining completion could reach the results.
+"""
+import bisect
+import heapq
+import math
+import re
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+FIELD_WEIGHTS = {"name": 3.0, "category": 2.0, "description": 1.0}
+TOKEN_PATTERN = re.compile(r"\w+")
+
+def tokenize(text: Optional[str]) -> List[str]:
+    return TOKEN_PATTERN.findall(text.casefold()) if text else []
+
+class ProductSearchIndex:
+    def __init__(self, max_prefix_terms: int = 32, max_walk: int = 64):
+        self.max_prefix_terms = max_prefix_terms
+        self.max_walk = max_walk
+        self.postings: Dict[str, Dict[str, float]] = {}
+        # (term, category or None) -> product ids, best first
+        self.rankings: Dict[Tuple[str, Optional[str]], List[str]] = {}
+        # product id -> (name, category, indexed terms)
+        self.documents: Dict[str, tuple] = {}
+        self.categories: Dict[Optional[str], set] = {}
+        # Sorted name and category terms for prefix completion; None until next needed
+        self.title_terms: Optional[List[str]] = []
+        self.title_counts: Dict[str, int] = {}
+        self.completions: Dict[str, List[str]] = {}
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def add(self, product: dict):
+        """Index ``product``, replacing any earlier version of it."""
+        new_terms = self._index(product)
+        if self.title_terms is not None:
+            for term in new_terms:
+                bisect.insort(self.title_terms, term)
+        if new_terms:
+            self.completions.clear()
+
+    def add_many(self, products: Iterable[dict]):
+        # Sorting the vocabulary once on the next lookup beats an insort per new term
+        self.title_terms = None
+        self.completions.clear()
+        for product in products:
+            self._index(product)
+
+    def remove(self, product_id: str):
+        document = self.documents.get(product_id)
+        if document is None:
+            return
+        name, category, terms = document
+        for term in terms:
+            for key in self._ranking_keys(term, category):
+                ranked = self.rankings.get(key)
+                if ranked is not None:
+                    del ranked[self._rank_position(ranked, term, product_id)]
+                    if not ranked:
+                        del self.rankings[key]
+            postings = self.postings[term]
+            del postings[product_id]
+            if not postings:
+                del self.postings[term]
+        for term in set(tokenize(name) + tokenize(category)):
+            self.title_counts[term] -= 1
+            if not self.title_counts[term]:
+                del self.title_counts[term]
+                if self.title_terms is not None:
+                    del self.title_terms[bisect.bisect_left(self.title_terms, term)]
+                self.completions.clear()
+        members = self.categories[category]
+        members.discard(product_id)
+        if not members:
+            del self.categories[category]
+        del self.documents[product_id]
+
+    def _index(self, product: dict) -> List[str]:
+        """Add the postings of ``product`` and return the name terms new to the vocabulary."""
+        product_id = product["id"]
+        category = product.get("category")
+        self.remove(product_id)
+        weights: Dict[str, float] = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in set(tokenize(product.get(field))):
+                weights[term] = weights.get(term, 0.0) + weight
+        self.documents[product_id] = (product.get("name") or "", category, tuple(weights))
+        self.categories.setdefault(category, set()).add(product_id)
+        for term, weight in weights.items():
+            self.postings.setdefault(term, {})[product_id] = weight
+            for key in self._ranking_keys(term, category):
+                ranked = self.rankings.get(key)
+                if ranked is not None:
+                    ranked.insert(self._rank_position(ranked, term, product_id), product_id)
+        new_terms = []
+        for term in set(tokenize(product.get("name")) + tokenize(category)):
+            count = self.title_counts.get(term, 0)
+            if not count:
+                new_terms.append(term)
+            self.title_counts[term] = count + 1
+        return new_terms
+
+    @staticmethod
+    def _ranking_keys(term: str, category: Optional[str]) -> tuple:
+        return ((term, None), (term, category)) if category else ((term, None),)
+
+    def _rank_key(self, term: str):
+        # Ties go by id rather than name, which would correlate with the other words of a query
+        postings = self.postings[term]
+        return lambda product_id: (-postings[product_id], product_id)
+
+    def _rank_position(self, ranked: List[str], term: str, product_id: str) -> int:
+        key = self._rank_key(term)
+        return bisect.bisect_left(ranked, key(product_id), key=key)
+
+    def ranking(self, term: str, category: Optional[str] = None) -> List[str]:
+        """Products containing ``term``, highest weight first."""
+        ranked = self.rankings.get((term, category))
+        if ranked is None:
+            if category is None:
+                ranked = sorted(self.postings[term], key=self._rank_key(term))
+            else:
+                members = self.categories.get(category, ())
+                ranked = [product_id for product_id in self.ranking(term) if product_id in members]
+            self.rankings[(term, category)] = ranked
+        return ranked
+
+    def expand(self, prefix: str) -> List[str]:
+        """Name and category terms starting with ``prefix``, at most ``max_prefix_terms`` most common."""
+        if self.title_terms is None:
+            self.title_terms = sorted(self.title_counts)
+        start = bisect.bisect_left(self.title_terms, prefix)
+        end = bisect.bisect_left(self.title_terms, prefix + "\U0010ffff", start)
+        if end - start <= self.max_prefix_terms:
+            return self.title_terms[start:end]
+        # Short prefixes match many terms; keep the choice until the vocabulary changes
+        completions = self.completions.get(prefix)
+        if completions is None:
+            completions = self.completions[prefix] = heapq.nlargest(
+                self.max_prefix_terms, self.title_terms[start:end], key=lambda term: len(self.postings[term])
+            )
+        return completions
+
+    def idf(self, term: str) -> float:
+        return math.log(1 + len(self.documents) / len(self.postings[term]))
+
+    def _walk(self, terms: list, category: Optional[str]) -> Iterator[Tuple[float, str]]:
+        """``(score, product_id)`` for products matching any of ``terms``, best first, each once."""
+        if len(terms) == 1:
+            term, postings, idf = terms[0]
+            for product_id in self.ranking(term, category):
+                yield postings[product_id] * idf, product_id
+            return
+
+        def stream(term, postings, idf):
+            for product_id in self.ranking(term, category):
+                yield -postings[product_id] * idf, product_id
+
+        seen = set()
+        for score, product_id in heapq.merge(*(stream(*entry) for entry in terms)):
+            if product_id not in seen:
+                seen.add(product_id)
+                yield -score, product_id
+
+    def search(self, query: str, limit: int = 10, category: Optional[str] = None) -> List[str]:
+        """Ids of the best ``limit`` products matching every word of ``query``.
+
+        The last word matches as a prefix unless the query ends in whitespace.
+        """
+        tokens = tokenize(query)
+        if not tokens or (category and category not in self.categories):
+            return []
+        words = []
+        for i, token in enumerate(tokens):
+            if i == len(tokens) - 1 and not query[-1].isspace():
+                terms = self.expand(token)
+                if token in self.postings and token not in terms:
+                    # The word may already be complete, and descriptions are not completed
+                    terms = [token, *terms]
+            else:
+                terms = [token] if token in self.postings else []
+            if not terms:
+                return []
+            words.append([(term, self.postings[term], self.idf(term)) for term in terms])
+
+        exact = [terms for terms in words if len(terms) == 1]
+        if len(exact) == len(words) or not exact:
+            return self._best(self._top(words, limit, category), limit)
+
+        # Run one exact query per completion of the prefix, best possible score first
+        headroom = sum(self._max_score(*terms[0]) for terms in exact)
+        completions = sorted(
+            next(terms for terms in words if len(terms) > 1),
+            key=lambda entry: -self._max_score(*entry)
+        )
+        scores: Dict[str, float] = {}
+        for entry in completions:
+            if len(scores) >= limit and self._max_score(*entry) + headroom <= heapq.nlargest(limit, scores.values())[-1]:
+                break
+            term, postings, idf = entry
+            if len(postings) <= self.max_walk:
+                # Rare completions are cheaper to score outright than to plan a query for
+                members = self.categories[category] if category else None
+                found = {}
+                for product_id, weight in postings.items():
+                    if members is None or product_id in members:
+                        score = self._score(product_id, weight * idf, exact)
+                        if score is not None:
+                            found[product_id] = score
+            else:
+                found = self._top([[entry], *exact], limit, category)
+            for product_id, score in found.items():
+                if score > scores.get(product_id, 0.0):
+                    scores[product_id] = score
+        return self._best(scores, limit)
+
+    def _max_score(self, term: str, postings: Dict[str, float], idf: float) -> float:
+        return postings[self.ranking(term)[0]] * idf
+
+    def _top(self, words: list, limit: int, category: Optional[str]) -> Dict[str, float]:
+        """Scores of at least the best ``limit`` products matching all ``words``."""
+        # Walk the word with the fewest products and look the others up
+        sizes = sorted(
+            ((sum(len(postings) for _, postings, _ in terms), terms) for terms in words), key=lambda item: item[0]
+        )
+        driver, others = sizes[0][1], [terms for _, terms in sizes[1:]]
+        # Share of the driver's products expected to match the other words too
+        density = math.prod(min(1.0, size / len(self.documents)) for size, _ in sizes[1:])
+        expected_walk = limit / density
+        if category:
+            density *= len(self.categories[category]) / len(self.documents)
+        if others and expected_walk > sizes[0][0] * density:
+            # Scoring every match is cheaper than walking past the misses
+            return self._match_all(words, category)
+
+        # The most the other words can add to any product's score
+        headroom = sum(max(self._max_score(*entry) for entry in terms) for terms in others)
+        found = {}
+        top_scores = []
+        walk_budget = max(self.max_walk, 4 * limit, 4 * int(expected_walk))
+        for walked, (score, product_id) in enumerate(self._walk(driver, category)):
+            if len(top_scores) == limit and score + headroom <= top_scores[0]:
+                break
+            if walked == walk_budget:
+                return self._match_all(words, category)
+            score = self._score(product_id, score, others)
+            if score is not None:
+                found[product_id] = score
+                if len(top_scores) < limit:
+                    heapq.heappush(top_scores, score)
+                elif score > top_scores[0]:
+                    heapq.heapreplace(top_scores, score)
+        return found
+
+    def _best(self, scores: Dict[str, float], limit: int) -> List[str]:
+        best = heapq.nsmallest(
+            limit, scores.items(), key=lambda item: (-item[1], self.documents[item[0]][0], item[0])
+        )
+        return [product_id for product_id, _ in best]
+
+    @staticmethod
+    def _score(product_id: str, score: float, words: list) -> Optional[float]:
+        """Add the best term of each of ``words`` to ``score``; None if one of them is missing."""
+        for terms in words:
+            best = 0.0
+            for _, postings, idf in terms:
+                weight = postings.get(product_id)
+                if weight and weight * idf > best:
+                    best = weight * idf
+            if not best:
+                return None
+            score += best
+        return score
+
+    def _match_all(self, words: list, category: Optional[str]) -> Dict[str, float]:
+        """Score every product matching all ``words``, intersecting the smallest sets first."""
+        sets = [terms[0][1].keys() for terms in words if len(terms) == 1]
+        if category:
+            sets.append(self.categories[category])
+        candidates = None
+        for keys in sorted(sets, key=len):
+            candidates = keys if candidates is None else candidates & keys
+        for terms in words:
+            if len(terms) == 1:
+                continue
+            size = sum(len(postings) for _, postings, _ in terms)
+            # A union runs in C but touches every posting; probing touches only the candidates
+            if candidates is None or size < 4 * len(terms) * len(candidates):
+                union = set().union(*(postings.keys() for _, postings, _ in terms))
+                candidates = union if candidates is None else candidates & union
+            else:
+                candidates = {
+                    product_id for product_id in candidates
+                    if any(product_id in postings for _, postings, _ in terms)
+                }
+        scores = {}
+        for product_id in candidates:
+            score = self._score(product_id, 0.0, words)
+            if score is not None:
+                scores[product_id] = score
+        return scores
+
+    def stats(self) -> dict:
+        return {
+            "products": len(self.documents),
+            "terms": len(self.postings),
+            "ranked_terms": len(self.rankings)
+        }
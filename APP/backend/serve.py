@@ -0,0 +1,49 @@
+"""Run the API with one or more uvicorn worker processes.
+
+Each worker imports ``server`` and opens its own Mongo client in the app's
+lifespan handler. Catalog cache invalidation, idempotency keys, counters and
+running stats are coordinated through MongoDB, and ``/api/metrics`` sums the
+snapshots every worker publishes, so any worker can serve any request.
+
+    python serve.py --workers 4 --port 8001
+    WEB_CONCURRENCY=4 python serve.py
+
+gunicorn works the same way: ``gunicorn server:app -k uvicorn.workers.UvicornWorker -w 4``.
+"""
+import argparse
+import os
+from pathlib import Path
+
+import uvicorn
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).resolve().parent
+load_dotenv(ROOT_DIR / '.env')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument(
+        "--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", "1")),
+        help="worker processes (default: WEB_CONCURRENCY or 1)"
+    )
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    if args.workers > 1 and os.environ.get("STORAGE_BACKEND", "mongo") == "memory":
+        # Every worker would hold its own carts, orders and stock
+        raise SystemExit("The memory storage backend keeps data per process; run it with --workers 1")
+    uvicorn.run(
+        "server:app",
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        log_level=args.log_level,
+        app_dir=str(ROOT_DIR)
+    )
+
+
+if __name__ == "__main__":
+    main()
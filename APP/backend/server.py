@@ -1,27 +1,433 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Response, Query, Header, Depends
+from fastapi.responses import PlainTextResponse, JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from storage import Storage, MongoStorage, MemoryStorage
+from search import FIELD_WEIGHTS, ProductSearchIndex
+from pymongo import ReturnDocument, ReadPreference, ASCENDING, DESCENDING, monitoring
+from pymongo.errors import PyMongoError, DuplicateKeyError, OperationFailure
 import os
+import gc
+import re
+import socket
+import asyncio
 import logging
+import time
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional, Literal, Annotated
 import uuid
-from datetime import datetime, timezone
+import csv
+import io
+import json
+import hashlib
+import base64
+from datetime import datetime, timezone, timedelta
 import secrets
 
+try:
+    import orjson
+except ImportError:  # pragma: no cover - falls back to the stdlib encoder
+    orjson = None
+
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Instrumentation
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+LATENCY_BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
 
-# Create the main app without a prefix
-app = FastAPI()
+class RequestTimings:
+    """Mongo round-trips attributed to the request being served."""
+
+    __slots__ = ("mongo_commands", "mongo_ms")
+
+    def __init__(self):
+        self.mongo_commands = 0
+        self.mongo_ms = 0.0
+
+class RouteMetrics:
+    __slots__ = ("buckets", "count", "total_ms", "mongo_commands", "mongo_ms")
+
+    def __init__(self):
+        self.buckets = [0] * len(LATENCY_BUCKETS_MS)
+        self.count = 0
+        self.total_ms = 0.0
+        self.mongo_commands = 0
+        self.mongo_ms = 0.0
+
+    def observe(self, duration_ms: float, timings: RequestTimings):
+        for i, bound in enumerate(LATENCY_BUCKETS_MS):
+            if duration_ms <= bound:
+                self.buckets[i] += 1
+                break
+        self.count += 1
+        self.total_ms += duration_ms
+        self.mongo_commands += timings.mongo_commands
+        self.mongo_ms += timings.mongo_ms
+
+    def to_dict(self) -> dict:
+        return {field: getattr(self, field) for field in self.__slots__}
+
+    def add(self, other: dict):
+        self.buckets = [a + b for a, b in zip(self.buckets, other["buckets"])]
+        self.count += other["count"]
+        self.total_ms += other["total_ms"]
+        self.mongo_commands += other["mongo_commands"]
+        self.mongo_ms += other["mongo_ms"]
+
+request_timings: ContextVar[Optional[RequestTimings]] = ContextVar("request_timings", default=None)
+route_metrics = defaultdict(RouteMetrics)
+mongo_command_counts = defaultdict(int)
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Counts Mongo commands and charges their time to the current request.
+
+    Motor runs commands on an executor with a copy of the caller's context, so
+    ``request_timings`` resolves to the request that issued the command.
+    """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+    def _record(self, event):
+        mongo_command_counts[event.command_name] += 1
+        timings = request_timings.get()
+        if timings is not None:
+            timings.mongo_commands += 1
+            timings.mongo_ms += event.duration_micros / 1000
+
+class MetricsMiddleware:
+    """Records per-route latency and Mongo usage and sets ``Server-Timing``."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        
+        timings = RequestTimings()
+        token = request_timings.set(timings)
+        start = time.perf_counter()
+        
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                duration_ms = (time.perf_counter() - start) * 1000
+                route = scope.get("route")
+                route_metrics[(scope["method"], route.path if route else "unmatched")].observe(duration_ms, timings)
+                server_timing = (
+                    f'app;dur={duration_ms:.2f}, '
+                    f'mongo;dur={timings.mongo_ms:.2f};desc="{timings.mongo_commands} commands"'
+                )
+                message.setdefault("headers", []).append((b"server-timing", server_timing.encode()))
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            request_timings.reset(token)
+
+def worker_id() -> str:
+    # Evaluated per call: workers forked after import must not share the parent's id
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def metrics_snapshot() -> dict:
+    """This process's counters as a document that other workers can merge."""
+    return {
+        "routes": [
+            {"method": method, "route": route, **metrics.to_dict()}
+            for (method, route), metrics in route_metrics.items()
+        ],
+        "mongo_commands": dict(mongo_command_counts)
+    }
+
+def merge_metrics(snapshots: List[dict]) -> tuple:
+    """Sum per-worker snapshots into route metrics and Mongo command counts."""
+    routes = defaultdict(RouteMetrics)
+    commands = defaultdict(int)
+    for snapshot in snapshots:
+        for entry in snapshot["routes"]:
+            routes[(entry["method"], entry["route"])].add(entry)
+        for command, count in snapshot["mongo_commands"].items():
+            commands[command] += count
+    return routes, commands
+
+def render_metrics(routes: dict, commands: dict) -> str:
+    """Prometheus text exposition of the collected metrics."""
+    lines = ["# TYPE http_request_duration_ms histogram"]
+    for (method, route), metrics in sorted(routes.items()):
+        labels = f'method="{method}",route="{route}"'
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS_MS, metrics.buckets):
+            cumulative += count
+            lines.append(f'http_request_duration_ms_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'http_request_duration_ms_bucket{{{labels},le="+Inf"}} {metrics.count}')
+        lines.append(f"http_request_duration_ms_sum{{{labels}}} {metrics.total_ms:.3f}")
+        lines.append(f"http_request_duration_ms_count{{{labels}}} {metrics.count}")
+    lines.append("# TYPE http_request_mongo_commands_total counter")
+    for (method, route), metrics in sorted(routes.items()):
+        lines.append(f'http_request_mongo_commands_total{{method="{method}",route="{route}"}} {metrics.mongo_commands}')
+    lines.append("# TYPE http_request_mongo_duration_ms_total counter")
+    for (method, route), metrics in sorted(routes.items()):
+        lines.append(f'http_request_mongo_duration_ms_total{{method="{method}",route="{route}"}} {metrics.mongo_ms:.3f}')
+    lines.append("# TYPE mongo_commands_total counter")
+    for command, count in sorted(commands.items()):
+        lines.append(f'mongo_commands_total{{command="{command}"}} {count}')
+    return "\n".join(lines) + "\n"
+
+# Admission control
+# Route classes in priority order: a freed slot goes to the first class with a waiter
+ROUTE_CLASSES = ("checkout", "cart", "browse", "admin")
+
+def route_class_settings(name: str, default: str, cast) -> dict:
+    """Per-class values such as ``checkout=32,browse=48``; classes left out keep their default."""
+    settings = dict(item.split("=") for item in default.split(","))
+    settings.update(item.strip().split("=") for item in os.environ.get(name, "").split(",") if item.strip())
+    unknown = set(settings) - set(ROUTE_CLASSES)
+    if unknown:
+        raise ValueError(f"{name}: unknown route classes {sorted(unknown)}, expected {list(ROUTE_CLASSES)}")
+    return {route_class: cast(value) for route_class, value in settings.items()}
+
+ADMISSION_CONTROL = os.environ.get('ADMISSION_CONTROL', '').lower() in ('1', 'true', 'yes')
+ADMISSION_MAX_CONCURRENCY = int(os.environ.get('ADMISSION_MAX_CONCURRENCY', '64'))
+# Browse cannot take every slot, so checkouts and carts always find room
+ADMISSION_CONCURRENCY = route_class_settings(
+    'ADMISSION_CONCURRENCY', 'checkout=32,cart=32,browse=48,admin=4', int
+)
+ADMISSION_QUEUE = route_class_settings('ADMISSION_QUEUE', 'checkout=256,cart=128,browse=64,admin=8', int)
+# Seconds a request may wait for a slot; cheap reads give up first
+ADMISSION_QUEUE_TIMEOUT = route_class_settings(
+    'ADMISSION_QUEUE_TIMEOUT', 'checkout=5,cart=2,browse=0.5,admin=5', float
+)
+ADMISSION_RETRY_AFTER = int(os.environ.get('ADMISSION_RETRY_AFTER', '1'))
+
+def classify_request(path: str) -> Optional[str]:
+    """Route class of a request; None for requests that are never limited, such as metrics scrapes."""
+    if not path.startswith("/api/") or path == "/api/metrics":
+        return None
+    if path == "/api/checkout":
+        return "checkout"
+    if path.startswith("/api/cart"):
+        return "cart"
+    if path.startswith("/api/admin"):
+        return "admin"
+    return "browse"
+
+class AdmissionLane:
+    __slots__ = ("limit", "queue_size", "queue_timeout", "active", "waiters", "admitted", "shed_queue_full",
+                 "shed_timeout", "wait_ms")
+
+    def __init__(self, limit: int, queue_size: int, queue_timeout: float):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self.waiters = deque()
+        self.admitted = 0
+        self.shed_queue_full = 0
+        self.shed_timeout = 0
+        self.wait_ms = 0.0
+
+    def stats(self) -> dict:
+        return {
+            "active": self.active,
+            "queued": len(self.waiters),
+            "admitted": self.admitted,
+            "shed_queue_full": self.shed_queue_full,
+            "shed_timeout": self.shed_timeout,
+            "wait_ms": self.wait_ms
+        }
+
+class AdmissionController:
+    """Concurrency limits per route class with bounded FIFO queues in front of them.
+
+    A request runs when its class and the process both have a free slot, waits
+    in its class's queue otherwise, and is shed when that queue is full or its
+    wait runs out. Waiters are admitted in ``ROUTE_CLASSES`` order as slots
+    free up, so queued checkouts go ahead of queued browsing.
+    """
+
+    def __init__(self, capacity: int, limits: dict, queue_sizes: dict, queue_timeouts: dict):
+        self.capacity = capacity
+        self.active = 0
+        self.lanes = {
+            route_class: AdmissionLane(limits[route_class], queue_sizes[route_class], queue_timeouts[route_class])
+            for route_class in ROUTE_CLASSES
+        }
+
+    def _admit(self, lane: AdmissionLane):
+        lane.active += 1
+        lane.admitted += 1
+        self.active += 1
+
+    async def acquire(self, route_class: str) -> bool:
+        """Take a slot for ``route_class``; False if the request should be shed."""
+        lane = self.lanes[route_class]
+        if not lane.waiters and lane.active < lane.limit and self.active < self.capacity:
+            self._admit(lane)
+            return True
+        if len(lane.waiters) >= lane.queue_size:
+            lane.shed_queue_full += 1
+            return False
+        loop = asyncio.get_running_loop()
+        waiter = loop.create_future()
+        lane.waiters.append(waiter)
+        start = time.perf_counter()
+        timer = loop.call_later(lane.queue_timeout, self._expire, lane, waiter)
+        try:
+            admitted = await waiter
+        except asyncio.CancelledError:
+            # The client went away; hand back a slot granted just before, but
+            # not one the waiter was denied when its wait ran out
+            if waiter.done() and not waiter.cancelled():
+                if waiter.result():
+                    self.release(route_class)
+            elif waiter in lane.waiters:
+                lane.waiters.remove(waiter)
+            raise
+        finally:
+            timer.cancel()
+            lane.wait_ms += (time.perf_counter() - start) * 1000
+        return admitted
+
+    def _expire(self, lane: AdmissionLane, waiter: asyncio.Future):
+        if not waiter.done():
+            lane.waiters.remove(waiter)
+            lane.shed_timeout += 1
+            waiter.set_result(False)
+
+    def release(self, route_class: str):
+        self.lanes[route_class].active -= 1
+        self.active -= 1
+        for lane in self.lanes.values():
+            while lane.waiters and lane.active < lane.limit and self.active < self.capacity:
+                waiter = lane.waiters.popleft()
+                if not waiter.done():
+                    self._admit(lane)
+                    waiter.set_result(True)
+
+    def stats(self) -> dict:
+        return {route_class: lane.stats() for route_class, lane in self.lanes.items()}
+
+admission = AdmissionController(
+    ADMISSION_MAX_CONCURRENCY, ADMISSION_CONCURRENCY, ADMISSION_QUEUE, ADMISSION_QUEUE_TIMEOUT
+)
+
+class AdmissionMiddleware:
+    """Runs requests through ``admission`` and answers shed ones with ``503`` and ``Retry-After``."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        route_class = classify_request(scope["path"]) if scope["type"] == "http" else None
+        if route_class is None or not ADMISSION_CONTROL:
+            await self.app(scope, receive, send)
+            return
+        if not await admission.acquire(route_class):
+            response = JSONResponse(
+                {"detail": "Server is busy, please retry"},
+                status_code=503,
+                headers={"Retry-After": str(ADMISSION_RETRY_AFTER)}
+            )
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            admission.release(route_class)
+
+def render_admission_metrics(lanes: dict) -> str:
+    lines = ["# TYPE admission_active_requests gauge"]
+    for route_class, lane in lanes.items():
+        lines.append(f'admission_active_requests{{class="{route_class}"}} {lane["active"]:.0f}')
+    lines.append("# TYPE admission_queue_depth gauge")
+    for route_class, lane in lanes.items():
+        lines.append(f'admission_queue_depth{{class="{route_class}"}} {lane["queued"]:.0f}')
+    lines.append("# TYPE admission_admitted_total counter")
+    for route_class, lane in lanes.items():
+        lines.append(f'admission_admitted_total{{class="{route_class}"}} {lane["admitted"]:.0f}')
+    lines.append("# TYPE admission_shed_total counter")
+    for route_class, lane in lanes.items():
+        lines.append(f'admission_shed_total{{class="{route_class}",reason="queue_full"}} {lane["shed_queue_full"]:.0f}')
+        lines.append(f'admission_shed_total{{class="{route_class}",reason="timeout"}} {lane["shed_timeout"]:.0f}')
+    lines.append("# TYPE admission_queue_wait_ms_total counter")
+    for route_class, lane in lanes.items():
+        lines.append(f'admission_queue_wait_ms_total{{class="{route_class}"}} {lane["wait_ms"]:.3f}')
+    return "\n".join(lines) + "\n"
+
+# Storage backend: MongoDB, or process memory for tests and benchmarks
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'mongo')
+if STORAGE_BACKEND not in ('mongo', 'memory'):
+    raise RuntimeError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}', expected 'mongo' or 'memory'")
+
+# Motor connection pool and timeouts; options left unset keep the driver defaults
+MONGO_CLIENT_OPTIONS = {
+    option: int(os.environ[name])
+    for name, option in (
+        ('MONGO_MAX_POOL_SIZE', 'maxPoolSize'),
+        ('MONGO_MIN_POOL_SIZE', 'minPoolSize'),
+        ('MONGO_MAX_CONNECTING', 'maxConnecting'),
+        ('MONGO_MAX_IDLE_TIME_MS', 'maxIdleTimeMS'),
+        ('MONGO_WAIT_QUEUE_TIMEOUT_MS', 'waitQueueTimeoutMS'),
+        ('MONGO_CONNECT_TIMEOUT_MS', 'connectTimeoutMS'),
+        ('MONGO_SERVER_SELECTION_TIMEOUT_MS', 'serverSelectionTimeoutMS'),
+        ('MONGO_SOCKET_TIMEOUT_MS', 'socketTimeoutMS'),
+    )
+    if os.environ.get(name)
+}
+
+# Analytics and exports may read from secondaries; carts and checkout always read the primary
+mongo_read_preference = os.environ.get('MONGO_READ_PREFERENCE', 'primary')
+try:
+    REPORTING_READ_PREFERENCE = getattr(ReadPreference, re.sub(r'(?<!^)(?=[A-Z])', '_', mongo_read_preference).upper())
+except AttributeError:
+    raise RuntimeError(f"Unknown MONGO_READ_PREFERENCE '{mongo_read_preference}'") from None
+
+# Set per process by connect_storage(), so every worker owns its client and pool
+client: Optional[AsyncIOMotorClient] = None
+db = None
+reporting_db = None
+storage: Optional[Storage] = None
+
+def connect_storage():
+    """Create this process's storage backend; Motor clients must not be shared across a fork."""
+    global client, db, reporting_db, storage
+    if storage is not None:
+        return
+    if STORAGE_BACKEND == 'memory':
+        storage = MemoryStorage()
+        return
+    client = AsyncIOMotorClient(
+        os.environ['MONGO_URL'], tz_aware=True, event_listeners=[MongoCommandListener()], **MONGO_CLIENT_OPTIONS
+    )
+    db = client[os.environ['DB_NAME']]
+    reporting_db = db.with_options(read_preference=REPORTING_READ_PREFERENCE)
+    storage = MongoStorage(db, reporting_db)
+
+def disconnect_storage():
+    global client, db, reporting_db, storage
+    if client:
+        client.close()
+    client = db = reporting_db = storage = None
+
+def require_mongo():
+    """Reject endpoints built on MongoDB aggregations when running in memory."""
+    if STORAGE_BACKEND != 'mongo':
+        raise HTTPException(status_code=501, detail="Not available with the memory storage backend")
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -29,6 +435,42 @@ api_router = APIRouter(prefix="/api")
 # Constants
 NTH_ORDER_FOR_DISCOUNT = 10
 DISCOUNT_PERCENTAGE = 10
+ORDER_STATS_ID = "orders"
+ORDER_SEQUENCE_ID = "orders"
+CATALOG_VERSION_ID = "catalog"
+SAMPLE_PRODUCT_NAMESPACE = uuid.UUID("0f6b1c3e-4d2a-5e8f-9a7b-3c1d2e4f5a6b")
+CATALOG_CACHE_TTL = float(os.environ.get('CATALOG_CACHE_TTL', '300'))
+CATALOG_CACHE_SIZE = int(os.environ.get('CATALOG_CACHE_SIZE', '10000'))
+CATALOG_CACHE_PAGES = int(os.environ.get('CATALOG_CACHE_PAGES', '1024'))
+# Browsers revalidate every time; shared caches such as a CDN may serve a copy briefly
+CATALOG_CACHE_CONTROL = os.environ.get('CATALOG_CACHE_CONTROL', 'public, max-age=0, s-maxage=30, stale-while-revalidate=30')
+CART_CACHE_CONTROL = "private, no-cache"
+DEFAULT_PAGE_SIZE = 50
+DEFAULT_ORDER_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 200
+EXPORT_BATCH_SIZE = 1000
+DEFAULT_SEARCH_LIMIT = 10
+MAX_SEARCH_LIMIT = 50
+SEARCH_INDEX_BATCH_SIZE = 1000
+SALES_ROLLUP_ID = "sales_rollup"
+SALES_ROLLUP_INTERVAL = float(os.environ.get('SALES_ROLLUP_INTERVAL', '60'))
+SALES_ROLLUP_LAG_SECONDS = 60
+SALES_ROLLUP_LEASE_SECONDS = 300
+CART_TTL_SECONDS = int(os.environ.get('CART_TTL_SECONDS', str(30 * 24 * 3600)))
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get('IDEMPOTENCY_TTL_SECONDS', str(24 * 3600)))
+IDEMPOTENCY_LEASE_SECONDS = int(os.environ.get('IDEMPOTENCY_LEASE_SECONDS', '60'))
+IDEMPOTENCY_CACHE_SIZE = int(os.environ.get('IDEMPOTENCY_CACHE_SIZE', '10000'))
+STOCK_RESERVATION_SECONDS = int(os.environ.get('STOCK_RESERVATION_SECONDS', '0'))
+RESERVATION_SWEEP_INTERVAL = float(os.environ.get('RESERVATION_SWEEP_INTERVAL', '30'))
+FAST_JSON_RESPONSES = os.environ.get('FAST_JSON_RESPONSES', '').lower() in ('1', 'true', 'yes')
+CHECK_QUERY_PLANS = os.environ.get('CHECK_QUERY_PLANS', '').lower() in ('1', 'true', 'yes')
+CATALOG_VERSION_POLL_INTERVAL = float(os.environ.get('CATALOG_VERSION_POLL_INTERVAL', '5'))
+METRICS_PUBLISH_INTERVAL = float(os.environ.get('METRICS_PUBLISH_INTERVAL', '10'))
+OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', '100'))
+OUTBOX_POLL_INTERVAL = float(os.environ.get('OUTBOX_POLL_INTERVAL', '1'))
+OUTBOX_LEASE_SECONDS = 60
+OUTBOX_MAX_RETRY_SECONDS = 300
+WORKER_METRICS_TTL_SECONDS = 300
 
 # Define Models
 class Product(BaseModel):
@@ -62,6 +504,14 @@ class AddToCartRequest(BaseModel):
     product_id: str
     quantity: int = 1
 
+class CartOperation(BaseModel):
+    op: Literal["add", "update", "remove"]
+    product_id: str
+    quantity: int = 1
+
+class CartBatchRequest(BaseModel):
+    operations: List[CartOperation] = Field(min_length=1, max_length=200)
+
 class DiscountCode(BaseModel):
     model_config = ConfigDict(extra="ignore")
     
@@ -70,6 +520,7 @@ class DiscountCode(BaseModel):
     is_used: bool = False
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     used_at: Optional[datetime] = None
+    order_number: Optional[int] = None
 
 class Order(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -83,28 +534,140 @@ class Order(BaseModel):
     customer_name: str
     customer_email: str
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    order_number: Optional[int] = None
     generated_discount_code: Optional[str] = None
 
+class OrderSummary(BaseModel):
+    """An order as listed in a customer's history; ``items`` only when requested."""
+    model_config = ConfigDict(extra="ignore")
+    
+    id: str
+    order_number: Optional[int] = None
+    created_at: datetime
+    customer_name: str
+    customer_email: str
+    subtotal: float
+    discount_code: Optional[str] = None
+    discount_amount: float = 0.0
+    total: float
+    generated_discount_code: Optional[str] = None
+    items: Optional[List[CartItem]] = None
+
+class OrderHistoryPage(BaseModel):
+    orders: List[OrderSummary]
+    next_cursor: Optional[str] = None
+
 class CheckoutRequest(BaseModel):
     cart_id: str
     customer_name: str
     customer_email: str
     discount_code: Optional[str] = None
 
+class ProductPage(BaseModel):
+    products: List[Product]
+    next_cursor: Optional[str] = None
+
+class CacheStats(BaseModel):
+    hits: int
+    misses: int
+    size: int
+    pages: int
+    version: Optional[int] = None
+
+class DiscountCodePage(BaseModel):
+    codes: List[DiscountCode]
+    next_cursor: Optional[str] = None
+
 class AdminStats(BaseModel):
     total_orders: int
     total_items_purchased: int
     total_purchase_amount: float
-    discount_codes: List[dict]
+    discount_codes_issued: int
+    discount_codes_used: int
+    discount_codes_unused: int
     total_discount_amount: float
 
+class SalesBucket(BaseModel):
+    bucket: datetime
+    orders: int
+    revenue: float
+    items: int
+    discount: float
+
+class ProductSales(BaseModel):
+    product_id: str
+    name: str
+    units: int
+    revenue: float
+
+class CategorySales(BaseModel):
+    category: str
+    products: int
+    units: int
+    revenue: float
+
+# Timestamps
+def to_utc_iso(value: datetime) -> str:
+    """The one format stored timestamps are written in; they are compared as text."""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).isoformat()
+
+def order_document(order: Order) -> dict:
+    # Pydantic writes "Z" and drops zero microseconds, which sorts wrongly against "+00:00"
+    return {**order.model_dump(mode="json"), "created_at": to_utc_iso(order.created_at)}
+
+# Fast responses
+def json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+class FastJSONResponse(JSONResponse):
+    """Serializes content that was validated when it was written.
+
+    Models are dumped by pydantic-core and plain dicts by orjson (or the
+    stdlib encoder when orjson is not installed).
+    """
+
+    def render(self, content) -> bytes:
+        return render_json(content)
+
+def render_json(content) -> bytes:
+    if isinstance(content, BaseModel):
+        return content.model_dump_json().encode()
+    if orjson:
+        return orjson.dumps(content)
+    return json.dumps(content, separators=(",", ":"), default=json_default).encode()
+
+def respond(content):
+    """Bypass response_model re-validation when fast responses are enabled."""
+    return FastJSONResponse(content) if FAST_JSON_RESPONSES else content
+
+# Conditional requests
+IfNoneMatch = Annotated[Optional[str], Header()]
+
+def make_etag(data: bytes) -> str:
+    return f'"{hashlib.blake2b(data, digest_size=16).hexdigest()}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """``If-None-Match`` uses the weak comparison, so a ``W/`` prefix still matches."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+def conditional_response(body: bytes, etag: str, if_none_match: Optional[str], cache_control: str) -> Response:
+    """Send ``body``, or an empty 304 when the client already holds this ``etag``."""
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 # Initialize sample products
 async def init_sample_products():
-    existing_products = await db.products.count_documents({})
-    if existing_products == 0:
+    if await storage.products.count() == 0:
         sample_products = [
             {
-                "id": str(uuid.uuid4()),
                 "name": "Wireless Headphones",
                 "description": "Premium noise-cancelling wireless headphones with 30-hour battery life",
                 "price": 199.99,
@@ -113,7 +676,6 @@ async def init_sample_products():
                 "stock": 100
             },
             {
-                "id": str(uuid.uuid4()),
                 "name": "Smart Watch",
                 "description": "Fitness tracking smartwatch with heart rate monitor and GPS",
                 "price": 299.99,
@@ -122,7 +684,6 @@ async def init_sample_products():
                 "stock": 100
             },
             {
-                "id": str(uuid.uuid4()),
                 "name": "Laptop Stand",
                 "description": "Ergonomic aluminum laptop stand with adjustable height",
                 "price": 49.99,
@@ -131,7 +692,6 @@ async def init_sample_products():
                 "stock": 100
             },
             {
-                "id": str(uuid.uuid4()),
                 "name": "Mechanical Keyboard",
                 "description": "RGB backlit mechanical gaming keyboard with blue switches",
                 "price": 129.99,
@@ -140,7 +700,6 @@ async def init_sample_products():
                 "stock": 100
             },
             {
-                "id": str(uuid.uuid4()),
                 "name": "Wireless Mouse",
                 "description": "Ergonomic wireless mouse with precision tracking",
                 "price": 39.99,
@@ -149,7 +708,6 @@ async def init_sample_products():
                 "stock": 100
             },
             {
-                "id": str(uuid.uuid4()),
                 "name": "USB-C Hub",
                 "description": "7-in-1 USB-C hub with HDMI, USB 3.0, and SD card reader",
                 "price": 59.99,
@@ -158,7 +716,6 @@ async def init_sample_products():
                 "stock": 100
             },
             {
-                "id": str(uuid.uuid4()),
                 "name": "Phone Case",
                 "description": "Premium leather phone case with card holder",
                 "price": 29.99,
@@ -167,7 +724,6 @@ async def init_sample_products():
                 "stock": 100
             },
             {
-                "id": str(uuid.uuid4()),
                 "name": "Portable Charger",
                 "description": "20000mAh portable power bank with fast charging",
                 "price": 44.99,
@@ -176,46 +732,787 @@ async def init_sample_products():
                 "stock": 100
             }
         ]
-        await db.products.insert_many(sample_products)
-        logger.info(f"Initialized {len(sample_products)} sample products")
+        # Fixed ids make seeding idempotent: workers that start together, or a
+        # restart after one died mid-seed, insert only what is still missing
+        for product in sample_products:
+            product["id"] = str(uuid.uuid5(SAMPLE_PRODUCT_NAMESPACE, product["name"]))
+        inserted = await storage.products.insert_missing(sample_products)
+        if inserted:
+            await bump_catalog_version()
+            logger.info(f"Initialized {inserted} sample products")
+
+# Product catalog cache
+class CatalogCache:
+    """Products keyed by id plus pre-serialized listing pages.
+
+    Entries expire after ``ttl`` seconds; products and pages are LRU-bounded
+    to ``max_size`` and ``max_pages``. Everything is dropped when the catalog
+    version changes; a stock change drops only its products and the pages
+    listing them. Serialized bodies carry an ETag hashed from their bytes
+    when they are cached, so conditional requests that hit the cache are
+    answered without serializing or querying anything.
+    """
+
+    def __init__(self, ttl: float, max_size: int, max_pages: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.max_pages = max_pages
+        self.version: Optional[int] = None
+        self.products: "OrderedDict[str, tuple]" = OrderedDict()
+        self.pages: "OrderedDict[tuple, tuple]" = OrderedDict()
+        # product id -> keys of the cached pages listing it
+        self.page_keys: Dict[str, set] = {}
+        # Drops are numbered so a load that overlapped one does not cache what it read
+        self.drops = 0
+        self.dropped_at: Dict[str, int] = {}
+        self.invalidated_at = 0
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self):
+        self.products.clear()
+        self.pages.clear()
+        self.page_keys.clear()
+        self.dropped_at.clear()
+        self.drops += 1
+        self.invalidated_at = self.drops
+
+    def drop_products(self, product_ids: Iterable[str]):
+        """Forget products whose stock changed, and the pages listing them."""
+        self.drops += 1
+        for product_id in product_ids:
+            self.dropped_at[product_id] = self.drops
+            self.products.pop(product_id, None)
+            for key in self.page_keys.pop(product_id, ()):
+                self._drop_page(key)
+
+    def _drop_page(self, key: tuple):
+        entry = self.pages.pop(key, None)
+        if entry:
+            for product_id in entry[3]:
+                keys = self.page_keys.get(product_id)
+                if keys is not None:
+                    keys.discard(key)
+                    if not keys:
+                        del self.page_keys[product_id]
+
+    def _dropped_since(self, started: int, product_ids: Iterable[str]) -> bool:
+        return self.invalidated_at > started or any(
+            self.dropped_at.get(product_id, 0) > started for product_id in product_ids
+        )
+
+    def set_version(self, version: int):
+        if version != self.version:
+            self.invalidate()
+            self.version = version
+
+    def _store(self, product: dict, expires_at: float):
+        # The serialized product and its ETag are filled in on first request
+        self.products[product["id"]] = (expires_at, product, None)
+        self.products.move_to_end(product["id"])
+        while len(self.products) > self.max_size:
+            self.products.popitem(last=False)
+
+    async def get_product(self, product_id: str) -> Optional[dict]:
+        entry = self.products.get(product_id)
+        if entry and entry[0] > time.monotonic():
+            self.hits += 1
+            self.products.move_to_end(product_id)
+            return entry[1]
+        self.misses += 1
+        started = self.drops
+        product = await storage.products.get(product_id)
+        if product:
+            # Validate once on the way into the cache, not on every read
+            product = Product.model_validate(product).model_dump()
+            if not self._dropped_since(started, (product_id,)):
+                self._store(product, time.monotonic() + self.ttl)
+        return product
+
+    async def get_rendered_product(self, product_id: str) -> Optional[tuple]:
+        """Return the serialized product and its ETag, or None if it does not exist."""
+        product = await self.get_product(product_id)
+        if not product:
+            return None
+        entry = self.products.get(product_id)
+        if entry is None or entry[1] is not product:
+            # Evicted straight away by a zero-sized cache
+            body = render_json(product)
+            return body, make_etag(body)
+        if entry[2] is None:
+            body = render_json(product)
+            entry = self.products[product_id] = (entry[0], product, (body, make_etag(body)))
+        return entry[2]
+
+    async def get_page(self, key: tuple, load) -> tuple:
+        """Return the serialized ``ProductPage`` for ``key`` and its ETag, calling ``load`` on a miss."""
+        entry = self.pages.get(key)
+        if entry and entry[0] > time.monotonic():
+            self.hits += 1
+            self.pages.move_to_end(key)
+            return entry[1], entry[2]
+        self.misses += 1
+        started = self.drops
+        page = await load()
+        expires_at = time.monotonic() + self.ttl
+        body = page.model_dump_json().encode()
+        etag = make_etag(body)
+        product_ids = tuple(product.id for product in page.products)
+        if self._dropped_since(started, product_ids):
+            return body, etag
+        self._drop_page(key)
+        self.pages[key] = (expires_at, body, etag, product_ids)
+        for product_id in product_ids:
+            self.page_keys.setdefault(product_id, set()).add(key)
+        while len(self.pages) > self.max_pages:
+            self._drop_page(next(iter(self.pages)))
+        for product in page.products:
+            self._store(product.model_dump(), expires_at)
+        return body, etag
+
+    async def get_products(self, product_ids: List[str]) -> dict:
+        """Resolve many products at once, fetching all misses with one ``$in`` query."""
+        now = time.monotonic()
+        products, missing = {}, []
+        for product_id in set(product_ids):
+            entry = self.products.get(product_id)
+            if entry and entry[0] > now:
+                self.hits += 1
+                self.products.move_to_end(product_id)
+                products[product_id] = entry[1]
+            else:
+                missing.append(product_id)
+        if missing:
+            self.misses += len(missing)
+            expires_at = now + self.ttl
+            started = self.drops
+            for product in await storage.products.get_many(missing):
+                product = Product.model_validate(product).model_dump()
+                if not self._dropped_since(started, (product["id"],)):
+                    self._store(product, expires_at)
+                products[product["id"]] = product
+        return products
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "size": len(self.products),
+            "pages": len(self.pages),
+            "version": self.version
+        }
+
+catalog_cache = CatalogCache(CATALOG_CACHE_TTL, CATALOG_CACHE_SIZE, CATALOG_CACHE_PAGES)
+
+async def bump_catalog_version():
+    """Record a catalog change so every process drops its cached products."""
+    version = await next_sequence(CATALOG_VERSION_ID)
+    catalog_cache.set_version(version)
+    return version
+
+# Product search
+search_index = ProductSearchIndex()
+
+async def rebuild_search_index():
+    """Index the whole catalog into a fresh index, then swap it in."""
+    global search_index
+    index = ProductSearchIndex()
+    batch = []
+    async for product in storage.products.find_all(SEARCH_INDEX_BATCH_SIZE):
+        batch.append(product)
+        if len(batch) == SEARCH_INDEX_BATCH_SIZE:
+            index.add_many(batch)
+            batch = []
+            # Let requests run between batches of a large catalog
+            await asyncio.sleep(0)
+    index.add_many(batch)
+    search_index = index
+    logger.info(f"Indexed {len(index)} products for search")
+
+STOCK_FIELDS = {"stock", "stock_updated_at"}
+
+def is_stock_change(change: dict) -> bool:
+    """Whether a change stream event only moved a product's stock, as checkouts do."""
+    return change["operationType"] == "update" and not (
+        change["updateDescription"]["updatedFields"].keys() - STOCK_FIELDS
+        or change["updateDescription"].get("removedFields")
+    )
+
+async def apply_catalog_change(change: dict):
+    """Bring the search index up to date with one change stream event."""
+    operation = change["operationType"]
+    if operation in ("insert", "replace"):
+        search_index.add(change["fullDocument"])
+    elif operation == "update":
+        # Stock updates are most of the traffic and leave the index alone
+        if FIELD_WEIGHTS.keys() & change["updateDescription"]["updatedFields"].keys():
+            product = change.get("fullDocument")
+            if product:
+                search_index.add(product)
+    else:
+        # Deletes only carry the _id, and drops or renames replace the catalog
+        await rebuild_search_index()
+
+async def sync_catalog_version():
+    version = await current_sequence(CATALOG_VERSION_ID)
+    if version != catalog_cache.version:
+        catalog_cache.set_version(version)
+        await rebuild_search_index()
+
+async def sync_stock_changes(since: Optional[datetime]) -> datetime:
+    """Drop cached products whose stock changed after ``since``; returns the next ``since``.
+
+    ``stock_updated_at`` is server time at the write, and writes can commit out
+    of that order, so each poll looks one interval further back than the last.
+    """
+    if since is None:
+        latest = await db.products.find_one(
+            {"stock_updated_at": {"$exists": True}}, {"_id": 0, "stock_updated_at": 1},
+            sort=[("stock_updated_at", DESCENDING)]
+        )
+        return latest["stock_updated_at"] if latest else datetime.fromtimestamp(0, timezone.utc)
+    changed = await db.products.find(
+        {"stock_updated_at": {"$gt": since - timedelta(seconds=CATALOG_VERSION_POLL_INTERVAL)}},
+        {"_id": 0, "id": 1, "stock_updated_at": 1}
+    ).to_list(None)
+    if changed:
+        catalog_cache.drop_products(product["id"] for product in changed)
+        since = max(since, *(product["stock_updated_at"] for product in changed))
+    return since
+
+async def watch_catalog():
+    # Prefer a change stream; standalone servers fall back to version polling
+    try:
+        async with db.products.watch(full_document="updateLookup") as stream:
+            logger.info("Watching product catalog via change stream")
+            async for change in stream:
+                if is_stock_change(change):
+                    # Checkouts would otherwise empty the cache many times a second
+                    if change.get("fullDocument"):
+                        catalog_cache.drop_products((change["fullDocument"]["id"],))
+                    continue
+                catalog_cache.invalidate()
+                await apply_catalog_change(change)
+    except PyMongoError:
+        logger.info("Change streams unavailable, polling catalog version")
+    stock_synced_until = None
+    while True:
+        try:
+            await sync_catalog_version()
+            stock_synced_until = await sync_stock_changes(stock_synced_until)
+        except PyMongoError as e:
+            logger.warning(f"Catalog version poll failed: {e}")
+        await asyncio.sleep(CATALOG_VERSION_POLL_INTERVAL)
+
+# Indexes
+INDEXES = {
+    "products": [
+        ([("id", ASCENDING)], {"unique": True}),
+        # Listing filters and keyset sorts
+        ([("price", ASCENDING), ("id", ASCENDING)], {}),
+        ([("name", ASCENDING), ("id", ASCENDING)], {}),
+        ([("category", ASCENDING), ("price", ASCENDING), ("id", ASCENDING)], {}),
+        ([("category", ASCENDING), ("name", ASCENDING), ("id", ASCENDING)], {}),
+        # Workers without a change stream poll for stock changes
+        ([("stock_updated_at", ASCENDING)], {"sparse": True}),
+    ],
+    "carts": [
+        ([("id", ASCENDING)], {"unique": True}),
+        # Expires carts left idle for CART_TTL_SECONDS
+        ([("updated_at", ASCENDING)], {"expireAfterSeconds": CART_TTL_SECONDS}),
+    ],
+    "orders": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("order_number", ASCENDING)], {
+            "unique": True,
+            "partialFilterExpression": {"order_number": {"$exists": True}}
+        }),
+        ([("created_at", ASCENDING)], {}),
+        # Customer order history, newest first
+        ([("customer_email", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)], {}),
+    ],
+    "discount_codes": [
+        ([("code", ASCENDING)], {"unique": True}),
+        # Serves the listing, merging both statuses for "all", and covers the status counts
+        ([("is_used", ASCENDING), ("created_at", DESCENDING), ("code", DESCENDING)], {}),
+    ],
+    "sales_rollups": [
+        ([("bucket", ASCENDING)], {"unique": True}),
+    ],
+    "idempotency_keys": [
+        ([("key", ASCENDING)], {"unique": True}),
+        ([("created_at", ASCENDING)], {"expireAfterSeconds": IDEMPOTENCY_TTL_SECONDS}),
+    ],
+    "reservations": [
+        ([("cart_id", ASCENDING), ("product_id", ASCENDING)], {"unique": True}),
+        ([("expires_at", ASCENDING)], {}),
+    ],
+    "counters": [
+        ([("id", ASCENDING)], {"unique": True}),
+    ],
+    "stats": [
+        ([("id", ASCENDING)], {"unique": True}),
+    ],
+    "outbox": [
+        ([("id", ASCENDING)], {"unique": True}),
+        ([("available_at", ASCENDING)], {}),
+        ([("created_at", ASCENDING)], {}),
+    ],
+    "worker_metrics": [
+        ([("id", ASCENDING)], {"unique": True}),
+        # Drops snapshots of workers that stopped publishing
+        ([("updated_at", ASCENDING)], {"expireAfterSeconds": WORKER_METRICS_TTL_SECONDS}),
+    ],
+}
+
+# Representative filters/sorts for every lookup the handlers issue
+HANDLER_QUERIES = [
+    ("products", {"id": "x"}, None),
+    ("products", {}, [("name", ASCENDING), ("id", ASCENDING)]),
+    ("products", {}, [("price", DESCENDING), ("id", DESCENDING)]),
+    ("products", {"$and": [{"category": "x"}, {"price": {"$gte": 0, "$lte": 1}}]}, [("price", ASCENDING), ("id", ASCENDING)]),
+    ("products", {"category": "x"}, [("name", ASCENDING), ("id", ASCENDING)]),
+    ("products", {"stock_updated_at": {"$gt": "x"}}, None),
+    ("carts", {"id": "x"}, None),
+    ("carts", {"id": "x", "items.product_id": "x"}, None),
+    ("carts", {}, [("updated_at", ASCENDING)]),
+    ("orders", {"id": "x"}, None),
+    ("orders", {"order_number": 1}, None),
+    ("orders", {"created_at": {"$gte": "x", "$lt": "y"}}, [("created_at", ASCENDING)]),
+    ("orders", {"customer_email": "x"}, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("orders", {
+        "customer_email": "x",
+        "$or": [{"created_at": {"$lt": "x"}}, {"created_at": "x", "id": {"$lt": "x"}}]
+    }, [("created_at", DESCENDING), ("id", DESCENDING)]),
+    ("reservations", {"cart_id": "x"}, None),
+    ("reservations", {"expires_at": {"$lt": datetime(2000, 1, 1)}}, None),
+    ("discount_codes", {"code": "x", "is_used": False}, None),
+    ("discount_codes", {"code": "x"}, None),
+    ("discount_codes", {"is_used": False}, [("created_at", DESCENDING), ("code", DESCENDING)]),
+    ("discount_codes", {"is_used": {"$in": [False, True]}}, [("created_at", DESCENDING), ("code", DESCENDING)]),
+    ("discount_codes", {"is_used": {"$in": [False, True]}, "code": {"$regex": "^X"}}, [("created_at", DESCENDING), ("code", DESCENDING)]),
+    ("idempotency_keys", {"key": "x"}, None),
+    ("counters", {"id": "x"}, None),
+    ("stats", {"id": "x"}, None),
+    ("outbox", {"available_at": {"$lte": datetime(2000, 1, 1)}}, [("available_at", ASCENDING)]),
+    ("outbox", {"id": "x"}, None),
+    ("outbox", {}, [("created_at", ASCENDING)]),
+    ("worker_metrics", {"updated_at": {"$gte": datetime(2000, 1, 1)}}, None),
+]
+
+async def init_indexes():
+    for collection, indexes in INDEXES.items():
+        for keys, options in indexes:
+            try:
+                await db[collection].create_index(keys, **options)
+            except OperationFailure as e:
+                # IndexOptionsConflict: the TTL window changed since the index was built
+                if e.code != 85 or "expireAfterSeconds" not in options:
+                    raise
+                await db.command("collMod", collection, index={
+                    "keyPattern": dict(keys),
+                    "expireAfterSeconds": options["expireAfterSeconds"]
+                })
+
+async def migrate_cart_dates():
+    """Convert ISO-string cart timestamps to BSON dates so the TTL index applies."""
+    result = await db.carts.update_many(
+        {"$or": [{"created_at": {"$type": "string"}}, {"updated_at": {"$type": "string"}}]},
+        [{"$set": {
+            "created_at": {"$toDate": "$created_at"},
+            "updated_at": {"$toDate": "$updated_at"}
+        }}]
+    )
+    if result.modified_count:
+        logger.info(f"Converted timestamps of {result.modified_count} carts to dates")
+
+async def migrate_utc_suffixes():
+    """Rewrite "Z"-suffixed order and code timestamps as ``to_utc_iso`` writes them."""
+    for collection in ("orders", "discount_codes"):
+        result = await db[collection].update_many(
+            {"created_at": {"$regex": "Z$"}},
+            [{"$set": {"created_at": {"$replaceOne": {"input": "$created_at", "find": "Z", "replacement": "+00:00"}}}}]
+        )
+        if result.modified_count:
+            logger.info(f"Rewrote created_at of {result.modified_count} {collection} to +00:00")
+
+def plan_stages(plan) -> List[str]:
+    """Collect every ``stage`` name in an explain() plan tree."""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for value in plan:
+            stages.extend(plan_stages(value))
+    return stages
+
+async def check_query_plans() -> List[str]:
+    """Explain every handler query and return the ones that scan a collection."""
+    collection_scans = []
+    for collection, query, sort in HANDLER_QUERIES:
+        cursor = db[collection].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        explain = await cursor.explain()
+        if "COLLSCAN" in plan_stages(explain["queryPlanner"]["winningPlan"]):
+            collection_scans.append(f"{collection}: {query} sort={sort}")
+    return collection_scans
+
+# Transactions
+transactions_supported = False
+
+async def detect_transaction_support() -> bool:
+    # Multi-document transactions need a replica set or a mongos
+    hello = await client.admin.command("hello")
+    return "setName" in hello or hello.get("msg") == "isdbgrid"
+
+async def run_in_transaction(callback):
+    """Run ``callback(session)`` in one transaction.
+
+    Standalone servers have no transactions, so the callback runs with
+    ``session=None`` and its writes are applied individually.
+    """
+    if not transactions_supported:
+        return await callback(None)
+    async with await client.start_session() as session:
+        return await session.with_transaction(callback)
+
+# Sequence counters
+async def next_sequence(name: str) -> int:
+    """Atomically allocate the next value of a named counter."""
+    return await storage.counters.next(name)
+
+async def current_sequence(name: str) -> int:
+    return await storage.counters.current(name)
+
+async def give_back_order_number(order_number: int):
+    """Let a later checkout reuse the number of an order that was never written.
+
+    Otherwise a failed checkout on an nth number would skip that block's reward code.
+    """
+    try:
+        # A write whose outcome is unknown may have kept the number after all
+        if not await storage.orders.has_number(order_number):
+            await storage.counters.give_back(ORDER_SEQUENCE_ID, order_number)
+    except PyMongoError as e:
+        logger.error(f"Could not give back order number {order_number}: {e}")
+
+async def init_order_sequence():
+    # Seed the counter from orders placed before sequencing existed
+    await storage.counters.raise_to(ORDER_SEQUENCE_ID, await storage.orders.count())
+
+# Running order aggregates
+def order_stats_amounts(order: dict) -> dict:
+    """What a newly placed order adds to the running stats document."""
+    return {
+        "total_orders": 1,
+        "total_items_purchased": sum(item["quantity"] for item in order["items"]),
+        "total_purchase_amount": order["total"],
+        "total_discount_amount": order.get("discount_amount", 0)
+    }
+
+async def rebuild_order_stats():
+    """Recompute the running stats document from the orders collection.
+
+    Every queued ``order_placed`` event already has its order written, so the
+    totals below count it; marking their stats step first stops the outbox
+    worker adding those orders again. Only a checkout that lands while the
+    rebuild runs can still be counted twice.
+    """
+    await storage.outbox.mark_pending_step("order_placed", "stats")
+    totals = await storage.orders.totals()
+    stats = {
+        "total_orders": 0,
+        "total_items_purchased": 0,
+        "total_purchase_amount": 0.0,
+        "total_discount_amount": 0.0
+    }
+    if totals:
+        stats.update({key: totals[key] for key in stats})
+    await storage.stats.replace(ORDER_STATS_ID, stats)
+    return stats
+
+async def init_order_stats():
+    existing_stats = await storage.stats.get(ORDER_STATS_ID)
+    if not existing_stats:
+        stats = await rebuild_order_stats()
+        logger.info(f"Initialized order stats from {stats['total_orders']} orders")
+
+# Inventory
+async def reserve_stock(cart_id: str, product_id: str, quantity: int) -> bool:
+    """Hold ``quantity`` more units of a product for a cart until the reservation expires."""
+    if quantity <= 0:
+        return True
+    if not await storage.products.take_stock({product_id: quantity}):
+        return False
+    catalog_cache.drop_products((product_id,))
+    await db.reservations.update_one(
+        {"cart_id": cart_id, "product_id": product_id},
+        {
+            "$inc": {"quantity": quantity},
+            "$set": {"expires_at": datetime.now(timezone.utc) + timedelta(seconds=STOCK_RESERVATION_SECONDS)}
+        },
+        upsert=True
+    )
+    return True
+
+async def release_reservation(cart_id: str, product_id: str, quantity: Optional[int] = None):
+    """Return reserved units to stock; the whole reservation when ``quantity`` is None."""
+    if quantity is None:
+        reservation = await db.reservations.find_one_and_delete(
+            {"cart_id": cart_id, "product_id": product_id}
+        )
+        quantity = reservation["quantity"] if reservation else 0
+    else:
+        reservation = await db.reservations.find_one_and_update(
+            {"cart_id": cart_id, "product_id": product_id, "quantity": {"$gte": quantity}},
+            {"$inc": {"quantity": -quantity}}
+        )
+        quantity = quantity if reservation else 0
+    if quantity:
+        await storage.products.restock({product_id: quantity})
+        catalog_cache.drop_products((product_id,))
+
+async def set_reservation(cart_id: str, product_id: str, quantity: int) -> bool:
+    reservation = await db.reservations.find_one(
+        {"cart_id": cart_id, "product_id": product_id}, {"_id": 0}
+    )
+    delta = quantity - (reservation["quantity"] if reservation else 0)
+    if delta > 0:
+        return await reserve_stock(cart_id, product_id, delta)
+    if delta < 0:
+        await release_reservation(cart_id, product_id, -delta)
+    return True
+
+async def claim_reservations(cart_id: str, session=None) -> List[dict]:
+    # Delete one at a time so a reservation is owned by either checkout or the sweeper
+    reservations = []
+    while True:
+        reservation = await db.reservations.find_one_and_delete({"cart_id": cart_id}, session=session)
+        if not reservation:
+            return reservations
+        reservations.append(reservation)
+
+async def commit_stock(cart_id: str, items: List[dict], session=None) -> bool:
+    """Take a cart's items out of stock, crediting whatever the cart already reserved."""
+    lines = {}
+    for item in items:
+        lines[item["product_id"]] = lines.get(item["product_id"], 0) + item["quantity"]
+    
+    reservations = await claim_reservations(cart_id, session) if STOCK_RESERVATION_SECONDS else []
+    reserved = {reservation["product_id"]: reservation["quantity"] for reservation in reservations}
+    needed = {
+        product_id: quantity - reserved.get(product_id, 0)
+        for product_id, quantity in lines.items()
+        if quantity > reserved.get(product_id, 0)
+    }
+    surplus = {
+        product_id: quantity - lines.get(product_id, 0)
+        for product_id, quantity in reserved.items()
+        if quantity > lines.get(product_id, 0)
+    }
+    
+    if not await storage.products.take_stock(needed, session):
+        if session is None and reservations:
+            await db.reservations.insert_many(reservations)
+        return False
+    await storage.products.restock(surplus, session)
+    return True
+
+async def sweep_reservations() -> int:
+    released = 0
+    while True:
+        reservation = await db.reservations.find_one_and_delete(
+            {"expires_at": {"$lt": datetime.now(timezone.utc)}}
+        )
+        if not reservation:
+            return released
+        if reservation["quantity"]:
+            await storage.products.restock({reservation["product_id"]: reservation["quantity"]})
+            catalog_cache.drop_products((reservation["product_id"],))
+        released += 1
+
+async def reservation_sweeper():
+    while True:
+        try:
+            released = await sweep_reservations()
+            if released:
+                logger.info(f"Released {released} expired stock reservations")
+        except PyMongoError as e:
+            logger.warning(f"Reservation sweep failed: {e}")
+        await asyncio.sleep(RESERVATION_SWEEP_INTERVAL)
 
 # Products API
-@api_router.get("/products", response_model=List[Product])
-async def get_products():
-    products = await db.products.find({}, {"_id": 0}).to_list(1000)
-    return products
+def encode_cursor(sort_value, key: str, ordering: Optional[str] = None) -> str:
+    """Opaque keyset position; ``ordering`` ties it to the sort it was issued for."""
+    position = [sort_value, key] if ordering is None else [sort_value, key, ordering]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+def decode_cursor(cursor: str, ordering: Optional[str] = None) -> tuple:
+    try:
+        sort_value, key, *issued_for = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # A position in one ordering means nothing in another
+    if issued_for != ([] if ordering is None else [ordering]):
+        raise HTTPException(status_code=400, detail="Cursor does not match the requested sort and order")
+    return sort_value, key
+
+async def load_product_page(
+    category: Optional[str],
+    min_price: Optional[float],
+    max_price: Optional[float],
+    sort: str,
+    order: str,
+    cursor: Optional[str],
+    limit: int
+) -> ProductPage:
+    # Keyset pagination on (sort field, id)
+    ordering = f"{sort}:{order}"
+    products = await storage.products.list_page(
+        category, min_price, max_price, sort, order == "desc",
+        decode_cursor(cursor, ordering) if cursor else None, limit + 1
+    )
+    
+    next_cursor = None
+    if len(products) > limit:
+        products = products[:limit]
+        next_cursor = encode_cursor(products[-1][sort], products[-1]["id"], ordering)
+    
+    return ProductPage(products=products, next_cursor=next_cursor)
+
+@api_router.get("/products", response_model=ProductPage)
+async def get_products(
+    category: Optional[str] = None,
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    sort: Literal["name", "price"] = "name",
+    order: Literal["asc", "desc"] = "asc",
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    if_none_match: IfNoneMatch = None
+):
+    params = (category, min_price, max_price, sort, order, cursor, limit)
+    body, etag = await catalog_cache.get_page(params, lambda: load_product_page(*params))
+    return conditional_response(body, etag, if_none_match, CATALOG_CACHE_CONTROL)
+
+@api_router.get("/products/search", response_model=List[Product])
+async def search_products(
+    q: str = Query(..., min_length=1, max_length=200),
+    category: Optional[str] = None,
+    limit: int = Query(DEFAULT_SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT)
+):
+    product_ids = search_index.search(q, limit, category)
+    products = await catalog_cache.get_products(product_ids)
+    return respond([products[product_id] for product_id in product_ids if product_id in products])
 
 @api_router.get("/products/{product_id}", response_model=Product)
-async def get_product(product_id: str):
-    product = await db.products.find_one({"id": product_id}, {"_id": 0})
-    if not product:
+async def get_product(product_id: str, if_none_match: IfNoneMatch = None):
+    rendered = await catalog_cache.get_rendered_product(product_id)
+    if not rendered:
         raise HTTPException(status_code=404, detail="Product not found")
-    return product
+    return conditional_response(*rendered, if_none_match, CATALOG_CACHE_CONTROL)
+
+# Idempotency
+IdempotencyKey = Annotated[Optional[str], Header(max_length=255)]
+
+class IdempotencyStore:
+    """Stored responses of mutating requests, keyed by ``Idempotency-Key``.
+
+    A key is claimed in storage (expired by a TTL index on Mongo) before
+    the handler runs, so concurrent retries cannot both execute it. The claim
+    is leased for ``IDEMPOTENCY_LEASE_SECONDS``: if its owner dies, a retry
+    takes it over once the lease has run out instead of getting 409. Completed
+    responses are replayed from an LRU bounded to ``max_size``, falling back
+    to the collection.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.responses: "OrderedDict[str, dict]" = OrderedDict()
+        self.replays = 0
+
+    def _remember(self, record: dict):
+        self.responses[record["key"]] = record
+        self.responses.move_to_end(record["key"])
+        while len(self.responses) > self.max_size:
+            self.responses.popitem(last=False)
+
+    def _replay(self, record: dict, fingerprint: str) -> Response:
+        if record["fingerprint"] != fingerprint:
+            raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+        self.replays += 1
+        return Response(
+            content=record["body"],
+            status_code=record["status_code"],
+            media_type="application/json",
+            headers={"Idempotent-Replayed": "true"}
+        )
+
+    async def run(self, key: Optional[str], scope: str, payload: str, handler):
+        """Run ``handler`` once per key; later calls replay its response.
+
+        ``scope`` and ``payload`` identify the request, so reusing a key for a
+        different one is rejected instead of replaying an unrelated response.
+        """
+        if key is None:
+            return await handler()
+        fingerprint = hashlib.sha256(f"{scope}\n{payload}".encode()).hexdigest()
+        record = self.responses.get(key)
+        if record:
+            self.responses.move_to_end(key)
+            return self._replay(record, fingerprint)
+        
+        now = datetime.now(timezone.utc)
+        record = await storage.idempotency_keys.claim(
+            key, fingerprint, now, now + timedelta(seconds=IDEMPOTENCY_LEASE_SECONDS)
+        )
+        if record:
+            if "body" in record:
+                self._remember(record)
+                return self._replay(record, fingerprint)
+            if record["fingerprint"] != fingerprint:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+            raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is in progress")
+        
+        try:
+            content = await handler()
+        except Exception:
+            # Handlers undo their writes on failure, so a retry may run again
+            await storage.idempotency_keys.release(key)
+            raise
+        
+        response = content if isinstance(content, Response) else FastJSONResponse(content)
+        record = {
+            "key": key,
+            "fingerprint": fingerprint,
+            "status_code": response.status_code,
+            "body": response.body.decode()
+        }
+        self._remember(record)
+        try:
+            await storage.idempotency_keys.complete(key, record["status_code"], record["body"])
+        except PyMongoError as e:
+            # The writes are done; answer the client. Retries here replay from
+            # the LRU, elsewhere they take over the claim once its lease ends.
+            logger.error(f"Could not store the response for Idempotency-Key {key}: {e}")
+        return response
+
+idempotency_store = IdempotencyStore(IDEMPOTENCY_CACHE_SIZE)
 
 # Cart APIs
-@api_router.post("/cart/add")
-async def add_to_cart(request: AddToCartRequest):
+async def add_cart_item(request: AddToCartRequest):
+    if request.quantity < 1:
+        raise HTTPException(status_code=400, detail="Add quantity must be at least 1")
+    
     # Get product
-    product = await db.products.find_one({"id": request.product_id}, {"_id": 0})
+    product = await catalog_cache.get_product(request.product_id)
     if not product:
         raise HTTPException(status_code=404, detail="Product not found")
     
-    # Get or create cart
-    cart_id = request.cart_id
-    if cart_id:
-        cart = await db.carts.find_one({"id": cart_id}, {"_id": 0})
-        if not cart:
-            raise HTTPException(status_code=404, detail="Cart not found")
-    else:
-        cart_id = str(uuid.uuid4())
-        cart = {
-            "id": cart_id,
-            "items": [],
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "updated_at": datetime.now(timezone.utc).isoformat()
-        }
-    
-    # Add or update item in cart
     cart_item = {
         "product_id": request.product_id,
         "quantity": request.quantity,
@@ -224,155 +1521,397 @@ async def add_to_cart(request: AddToCartRequest):
         "image": product["image"]
     }
     
-    # Check if item already exists in cart
-    item_exists = False
-    for i, item in enumerate(cart["items"]):
-        if item["product_id"] == request.product_id:
-            cart["items"][i]["quantity"] += request.quantity
-            item_exists = True
-            break
+    cart_id = request.cart_id or str(uuid.uuid4())
+    if STOCK_RESERVATION_SECONDS and not await reserve_stock(cart_id, request.product_id, request.quantity):
+        raise HTTPException(status_code=409, detail="Insufficient stock")
     
-    if not item_exists:
-        cart["items"].append(cart_item)
+    # Create a new cart in a single upsert
+    if not request.cart_id:
+        cart = await storage.carts.create(cart_id, cart_item, datetime.now(timezone.utc))
+        return respond({"cart_id": cart_id, "cart": cart})
     
-    cart["updated_at"] = datetime.now(timezone.utc).isoformat()
+    # Increment an existing line, or push a new one. If a concurrent request
+    # pushes the same product between the two updates, the increment is retried.
+    for _ in range(2):
+        now = datetime.now(timezone.utc)
+        cart = await storage.carts.increment_item(cart_id, request.product_id, request.quantity, now)
+        if not cart:
+            cart = await storage.carts.push_item(cart_id, cart_item, now)
+        if cart:
+            return respond({"cart_id": cart_id, "cart": cart})
     
-    # Save cart
-    await db.carts.update_one(
-        {"id": cart_id},
-        {"$set": cart},
-        upsert=True
+    if STOCK_RESERVATION_SECONDS:
+        await release_reservation(cart_id, request.product_id, request.quantity)
+    raise HTTPException(status_code=404, detail="Cart not found")
+
+@api_router.post("/cart/add")
+async def add_to_cart(request: AddToCartRequest, idempotency_key: IdempotencyKey = None):
+    return await idempotency_store.run(
+        idempotency_key, "POST /cart/add", request.model_dump_json(),
+        lambda: add_cart_item(request)
     )
+
+def fold_cart_operations(operations: List[CartOperation]) -> dict:
+    """Collapse a batch into one net change per product.
+
+    Operations on different products commute, so each product's sequence
+    reduces to what happens if the line is present (``("absent",)``,
+    ``("rel", k)`` for quantity + k, or ``("abs", n)``) and what happens if it
+    is absent (``("absent",)`` or ``("abs", n)``).
+    """
+    changes = {}
+    for operation in operations:
+        present, absent = changes.get(operation.product_id, (("rel", 0), ("absent",)))
+        if operation.op == "add":
+            present = ("rel", present[1] + operation.quantity) if present[0] == "rel" else (
+                ("abs", present[1] + operation.quantity) if present[0] == "abs" else ("abs", operation.quantity)
+            )
+            absent = ("abs", absent[1] + operation.quantity) if absent[0] == "abs" else ("abs", operation.quantity)
+        elif operation.op == "update" and operation.quantity > 0:
+            present = ("abs", operation.quantity) if present[0] != "absent" else present
+            absent = ("abs", operation.quantity) if absent[0] == "abs" else absent
+        else:
+            present, absent = ("absent",), ("absent",)
+        changes[operation.product_id] = (present, absent)
+    return changes
+
+async def apply_cart_operations(cart_id: str, request: CartBatchRequest):
+    if any(operation.op == "add" and operation.quantity < 1 for operation in request.operations):
+        raise HTTPException(status_code=400, detail="Add quantity must be at least 1")
+    
+    # Resolve every added product with one lookup
+    added_ids = [operation.product_id for operation in request.operations if operation.op == "add"]
+    products = await catalog_cache.get_products(added_ids)
+    missing = sorted(set(added_ids) - set(products))
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Products not found: {', '.join(missing)}")
+    cart_items = {
+        product_id: {
+            "product_id": product_id,
+            "quantity": 0,
+            "name": product["name"],
+            "price": product["price"],
+            "image": product["image"]
+        }
+        for product_id, product in products.items()
+    }
+    
+    # Apply the whole batch as one update, creating the cart if needed
+    changes = fold_cart_operations(request.operations)
+    cart = await storage.carts.apply_changes(cart_id, changes, cart_items, datetime.now(timezone.utc))
     
-    return {"cart_id": cart_id, "cart": cart}
+    response = {"cart_id": cart_id, "cart": cart}
+    if STOCK_RESERVATION_SECONDS:
+        quantities = {item["product_id"]: item["quantity"] for item in cart["items"]}
+        reserved = await asyncio.gather(*[
+            set_reservation(cart_id, product_id, quantities.get(product_id, 0))
+            for product_id in changes
+        ])
+        response["insufficient_stock"] = [
+            product_id for product_id, ok in zip(changes, reserved) if not ok
+        ]
+    return respond(response)
+
+@api_router.post("/cart/{cart_id}/items:batch")
+async def batch_update_cart(cart_id: str, request: CartBatchRequest, idempotency_key: IdempotencyKey = None):
+    return await idempotency_store.run(
+        idempotency_key, f"POST /cart/{cart_id}/items:batch", request.model_dump_json(),
+        lambda: apply_cart_operations(cart_id, request)
+    )
 
 @api_router.get("/cart/{cart_id}")
-async def get_cart(cart_id: str):
-    cart = await db.carts.find_one({"id": cart_id}, {"_id": 0})
+async def get_cart(cart_id: str, if_none_match: IfNoneMatch = None):
+    # Any worker may have changed the cart, so it is always read; a match skips serializing it
+    cart = await storage.carts.get(cart_id)
     if not cart:
         raise HTTPException(status_code=404, detail="Cart not found")
-    return cart
+    etag = make_etag(f"{cart['id']}:{cart['updated_at'].isoformat()}".encode())
+    headers = {"ETag": etag, "Cache-Control": CART_CACHE_CONTROL}
+    if etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=render_json(cart), media_type="application/json", headers=headers)
 
-@api_router.delete("/cart/{cart_id}/item/{product_id}")
-async def remove_from_cart(cart_id: str, product_id: str):
-    cart = await db.carts.find_one({"id": cart_id}, {"_id": 0})
+async def remove_cart_item(cart_id: str, product_id: str):
+    cart = await storage.carts.remove_item(cart_id, product_id, datetime.now(timezone.utc))
     if not cart:
         raise HTTPException(status_code=404, detail="Cart not found")
     
-    cart["items"] = [item for item in cart["items"] if item["product_id"] != product_id]
-    cart["updated_at"] = datetime.now(timezone.utc).isoformat()
+    if STOCK_RESERVATION_SECONDS:
+        await release_reservation(cart_id, product_id)
     
-    await db.carts.update_one(
-        {"id": cart_id},
-        {"$set": cart}
+    return respond({"message": "Item removed", "cart": cart})
+
+@api_router.delete("/cart/{cart_id}/item/{product_id}")
+async def remove_from_cart(cart_id: str, product_id: str, idempotency_key: IdempotencyKey = None):
+    return await idempotency_store.run(
+        idempotency_key, f"DELETE /cart/{cart_id}/item/{product_id}", "",
+        lambda: remove_cart_item(cart_id, product_id)
     )
-    
-    return {"message": "Item removed", "cart": cart}
 
-@api_router.put("/cart/{cart_id}/item/{product_id}")
-async def update_cart_item(cart_id: str, product_id: str, quantity: int):
-    cart = await db.carts.find_one({"id": cart_id}, {"_id": 0})
+async def set_cart_item_quantity(cart_id: str, product_id: str, quantity: int):
+    # Only hold stock for a line the update will actually change
+    cart = await storage.carts.get(cart_id)
     if not cart:
         raise HTTPException(status_code=404, detail="Cart not found")
+    if quantity > 0 and not any(item["product_id"] == product_id for item in cart["items"]):
+        raise HTTPException(status_code=404, detail="Item not found in cart")
     
-    for i, item in enumerate(cart["items"]):
-        if item["product_id"] == product_id:
-            if quantity <= 0:
-                cart["items"].pop(i)
-            else:
-                cart["items"][i]["quantity"] = quantity
-            break
+    if STOCK_RESERVATION_SECONDS and not await set_reservation(cart_id, product_id, max(quantity, 0)):
+        raise HTTPException(status_code=409, detail="Insufficient stock")
     
-    cart["updated_at"] = datetime.now(timezone.utc).isoformat()
+    cart = await storage.carts.set_item_quantity(cart_id, product_id, quantity, datetime.now(timezone.utc))
+    if not cart:
+        # Removed, or its line was, since the read above
+        if STOCK_RESERVATION_SECONDS:
+            await release_reservation(cart_id, product_id)
+        raise HTTPException(status_code=404, detail="Cart not found")
     
-    await db.carts.update_one(
-        {"id": cart_id},
-        {"$set": cart}
+    return respond({"message": "Cart updated", "cart": cart})
+
+@api_router.put("/cart/{cart_id}/item/{product_id}")
+async def update_cart_item(cart_id: str, product_id: str, quantity: int, idempotency_key: IdempotencyKey = None):
+    return await idempotency_store.run(
+        idempotency_key, f"PUT /cart/{cart_id}/item/{product_id}", str(quantity),
+        lambda: set_cart_item_quantity(cart_id, product_id, quantity)
     )
-    
-    return {"message": "Cart updated", "cart": cart}
+
+# Outbox
+outbox_wakeup = asyncio.Event()
+
+def reward_code_document(order: Order) -> dict:
+    return {
+        "code": order.generated_discount_code,
+        "percentage": DISCOUNT_PERCENTAGE,
+        "is_used": False,
+        "created_at": to_utc_iso(order.created_at),
+        "used_at": None,
+        "order_number": order.order_number
+    }
+
+def order_placed_event(order: Order, cart_id: str) -> dict:
+    now = datetime.now(timezone.utc)
+    placed = order_document(order)
+    return {
+        "id": str(uuid.uuid4()),
+        "type": "order_placed",
+        "payload": {
+            "order_id": order.id,
+            "order_number": order.order_number,
+            "cart_id": cart_id,
+            "created_at": placed["created_at"],
+            "stats": order_stats_amounts(placed)
+        },
+        "created_at": now,
+        "available_at": now,
+        "attempts": 0
+    }
+
+async def handle_order_placed(event: dict):
+    """Clear the cart and count the order; every step is safe to repeat."""
+    payload = event["payload"]
+    await storage.carts.delete(payload["cart_id"])
+    # Checkout now issues the reward code with the order; only older events still carry one
+    if payload.get("reward_code"):
+        try:
+            await storage.discount_codes.insert({
+                "code": payload["reward_code"],
+                "percentage": DISCOUNT_PERCENTAGE,
+                "is_used": False,
+                "created_at": payload["created_at"],
+                "used_at": None,
+                "order_number": payload["order_number"]
+            })
+        except DuplicateKeyError:
+            pass  # Issued by an earlier delivery
+    # Increments are not idempotent, so the event records that its own ran. Only a
+    # crash between the two writes loses the increment; POST /admin/stats/rebuild recomputes.
+    if await storage.outbox.mark_step(event["id"], "stats"):
+        try:
+            await storage.stats.increment(ORDER_STATS_ID, payload["stats"])
+        except Exception:
+            await storage.outbox.clear_step(event["id"], "stats")
+            raise
+
+OUTBOX_HANDLERS = {
+    "order_placed": handle_order_placed
+}
+
+async def drain_outbox() -> int:
+    """Handle due outbox events in batches until none are left; returns how many succeeded."""
+    handled = 0
+    while True:
+        now = datetime.now(timezone.utc)
+        events = await storage.outbox.claim(OUTBOX_BATCH_SIZE, now, now + timedelta(seconds=OUTBOX_LEASE_SECONDS))
+        if not events:
+            return handled
+        results = await asyncio.gather(
+            *(OUTBOX_HANDLERS[event["type"]](event) for event in events), return_exceptions=True
+        )
+        done = []
+        for event, result in zip(events, results):
+            if isinstance(result, Exception):
+                delay = min(2 ** event["attempts"], OUTBOX_MAX_RETRY_SECONDS)
+                logger.warning(f"Outbox event {event['id']} ({event['type']}) failed on attempt {event['attempts']}: {result}")
+                await storage.outbox.retry(event["id"], str(result), now + timedelta(seconds=delay))
+            else:
+                done.append(event["id"])
+        if done:
+            await storage.outbox.delete(done)
+        handled += len(done)
+
+async def outbox_worker():
+    # Checkouts in this process wake the worker; events from other workers are polled
+    while True:
+        outbox_wakeup.clear()
+        try:
+            await drain_outbox()
+        except PyMongoError as e:
+            logger.warning(f"Outbox drain failed: {e}")
+        try:
+            await asyncio.wait_for(outbox_wakeup.wait(), OUTBOX_POLL_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
 
 # Checkout API
-@api_router.post("/checkout", response_model=Order)
-async def checkout(request: CheckoutRequest):
+async def redeem_discount_code(code: str, session=None) -> Optional[dict]:
+    """Flip an unused code to used in one conditional update; None if unavailable."""
+    return await storage.discount_codes.redeem(code, to_utc_iso(datetime.now(timezone.utc)), session)
+
+async def release_discount_code(code: str, session=None):
+    """Undo a redemption whose order was never written."""
+    await storage.discount_codes.release(code, session)
+
+async def checkout_cart(request: CheckoutRequest):
     # Get cart
-    cart = await db.carts.find_one({"id": request.cart_id}, {"_id": 0})
+    cart = await storage.carts.get(request.cart_id)
     if not cart:
         raise HTTPException(status_code=404, detail="Cart not found")
     
     if not cart["items"]:
         raise HTTPException(status_code=400, detail="Cart is empty")
     
-    # Calculate subtotal
     subtotal = sum(item["price"] * item["quantity"] for item in cart["items"])
+    order_number = None
     
-    # Validate discount code if provided
-    discount_amount = 0.0
-    discount_code_str = None
-    if request.discount_code:
-        discount_code = await db.discount_codes.find_one(
-            {"code": request.discount_code, "is_used": False},
-            {"_id": 0}
-        )
-        if not discount_code:
-            raise HTTPException(status_code=400, detail="Invalid or already used discount code")
+    async def place_order(session):
+        nonlocal order_number
+        now = to_utc_iso(datetime.now(timezone.utc))
         
-        # Apply discount
-        discount_amount = subtotal * (discount_code["percentage"] / 100)
-        discount_code_str = request.discount_code
+        # Redeem discount code
+        discount_code = None
+        if request.discount_code:
+            discount_code = await redeem_discount_code(request.discount_code, session)
+            if not discount_code:
+                raise HTTPException(status_code=400, detail="Invalid or already used discount code")
+        discount_amount = subtotal * (discount_code["percentage"] / 100) if discount_code else 0.0
         
-        # Mark discount code as used
-        await db.discount_codes.update_one(
-            {"code": request.discount_code},
-            {"$set": {"is_used": True, "used_at": datetime.now(timezone.utc).isoformat()}}
-        )
+        checked_out = stock_taken = order_inserted = code_issued = False
+        try:
+            # Claim the cart in the same write set as the order, so a second
+            # checkout of it cannot place another order before the outbox deletes it
+            if not await storage.carts.check_out(request.cart_id, session):
+                raise HTTPException(status_code=409, detail="Cart was already checked out")
+            checked_out = True
+            
+            # Take items out of stock
+            if not await commit_stock(request.cart_id, cart["items"], session):
+                raise HTTPException(status_code=409, detail="Insufficient stock for one or more items")
+            stock_taken = True
+            
+            # Allocate order sequence number once, outside any transaction retries
+            if order_number is None:
+                order_number = await next_sequence(ORDER_SEQUENCE_ID)
+            
+            # Generate a discount code if this is the nth order
+            code = None
+            if order_number % NTH_ORDER_FOR_DISCOUNT == 0:
+                code = f"DISCOUNT{secrets.token_hex(4).upper()}"
+            
+            # Create order, validated once here rather than again on response
+            order = Order(
+                items=cart["items"],
+                subtotal=subtotal,
+                discount_code=request.discount_code if discount_code else None,
+                discount_amount=discount_amount,
+                total=subtotal - discount_amount,
+                customer_name=request.customer_name,
+                customer_email=request.customer_email,
+                created_at=now,
+                order_number=order_number,
+                generated_discount_code=code
+            )
+            await storage.orders.insert(order_document(order), session=session)
+            order_inserted = True
+            
+            # Issue the reward code with the order, so the code in the response can be redeemed at once
+            if code:
+                await storage.discount_codes.insert(reward_code_document(order), session=session)
+                code_issued = True
+            
+            # Clearing the cart and counting the order happen in the background
+            await storage.outbox.insert(order_placed_event(order, request.cart_id), session=session)
+        except Exception:
+            # A transaction abort undoes these writes; without one, undo them here
+            if session is None:
+                if code_issued:
+                    await storage.discount_codes.delete(code)
+                if order_inserted:
+                    await storage.orders.delete(order.id)
+                if checked_out:
+                    await storage.carts.reopen(request.cart_id)
+                if stock_taken:
+                    await storage.products.restock({item["product_id"]: item["quantity"] for item in cart["items"]})
+                if discount_code:
+                    await release_discount_code(request.discount_code)
+            raise
+        
+        return order
     
-    total = subtotal - discount_amount
+    try:
+        order = await run_in_transaction(place_order)
+    except Exception:
+        if order_number is not None:
+            await give_back_order_number(order_number)
+        raise
+    finally:
+        # Stock was taken, or taken and put back, after the cache may have read it
+        catalog_cache.drop_products({item["product_id"] for item in cart["items"]})
+    outbox_wakeup.set()
     
-    # Count total items
-    total_items = sum(item["quantity"] for item in cart["items"])
+    return respond(order)
+
+@api_router.post("/checkout", response_model=Order)
+async def checkout(request: CheckoutRequest, idempotency_key: IdempotencyKey = None):
+    return await idempotency_store.run(
+        idempotency_key, "POST /checkout", request.model_dump_json(),
+        lambda: checkout_cart(request)
+    )
+
+# Order history
+@api_router.get("/orders", response_model=OrderHistoryPage)
+async def list_customer_orders(
+    customer_email: str = Query(..., min_length=1, max_length=254),
+    include_items: bool = False,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_ORDER_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+):
+    # Keyset pagination on (created_at, id), newest first
+    orders = await storage.orders.list_by_customer(
+        customer_email, decode_cursor(cursor) if cursor else None, limit + 1, include_items
+    )
     
-    # Create order
-    order = {
-        "id": str(uuid.uuid4()),
-        "items": cart["items"],
-        "subtotal": subtotal,
-        "discount_code": discount_code_str,
-        "discount_amount": discount_amount,
-        "total": total,
-        "customer_name": request.customer_name,
-        "customer_email": request.customer_email,
-        "created_at": datetime.now(timezone.utc).isoformat()
-    }
+    next_cursor = None
+    if len(orders) > limit:
+        orders = orders[:limit]
+        next_cursor = encode_cursor(orders[-1]["created_at"], orders[-1]["id"])
     
-    await db.orders.insert_one(order)
-    
-    # Clear cart
-    await db.carts.delete_one({"id": request.cart_id})
-    
-    # Check if this is the nth order and generate discount code
-    total_orders = await db.orders.count_documents({})
-    new_discount_code = None
-    if total_orders % NTH_ORDER_FOR_DISCOUNT == 0:
-        # Generate new discount code
-        code = f"DISCOUNT{secrets.token_hex(4).upper()}"
-        new_discount_code = {
-            "code": code,
-            "percentage": DISCOUNT_PERCENTAGE,
-            "is_used": False,
-            "created_at": datetime.now(timezone.utc).isoformat(),
-            "used_at": None
-        }
-        await db.discount_codes.insert_one(new_discount_code)
-        order["generated_discount_code"] = code
-    
-    return order
+    return respond(OrderHistoryPage(orders=orders, next_cursor=next_cursor))
 
 # Admin APIs
 @api_router.post("/admin/generate-discount")
 async def generate_discount_code():
     # Check if current order count satisfies nth order condition
-    total_orders = await db.orders.count_documents({})
+    total_orders = await current_sequence(ORDER_SEQUENCE_ID)
     
     if total_orders % NTH_ORDER_FOR_DISCOUNT != 0:
         raise HTTPException(
@@ -386,49 +1925,369 @@ async def generate_discount_code():
         "code": code,
         "percentage": DISCOUNT_PERCENTAGE,
         "is_used": False,
-        "created_at": datetime.now(timezone.utc).isoformat(),
-        "used_at": None
+        "created_at": to_utc_iso(datetime.now(timezone.utc)),
+        "used_at": None,
+        "order_number": total_orders
     }
     
-    await db.discount_codes.insert_one(discount_code)
+    await storage.discount_codes.insert(discount_code)
     
     return {"message": "Discount code generated", "code": code, "percentage": DISCOUNT_PERCENTAGE}
 
 @api_router.get("/admin/stats", response_model=AdminStats)
 async def get_admin_stats():
-    # Get all orders
-    orders = await db.orders.find({}, {"_id": 0}).to_list(10000)
-    
-    # Calculate stats
-    total_orders = len(orders)
-    total_items_purchased = sum(
-        sum(item["quantity"] for item in order["items"])
-        for order in orders
+    # Read running order aggregates
+    stats = await storage.stats.get(ORDER_STATS_ID)
+    if not stats:
+        stats = await rebuild_order_stats()
+    
+    # Counts only, so the payload stays constant-size however many codes exist
+    code_counts = await storage.discount_codes.count_by_status()
+    
+    return respond({
+        "total_orders": stats.get("total_orders", 0),
+        "total_items_purchased": stats.get("total_items_purchased", 0),
+        "total_purchase_amount": stats.get("total_purchase_amount", 0.0),
+        "discount_codes_issued": code_counts[True] + code_counts[False],
+        "discount_codes_used": code_counts[True],
+        "discount_codes_unused": code_counts[False],
+        "total_discount_amount": stats.get("total_discount_amount", 0.0)
+    })
+
+@api_router.get("/admin/discount-codes", response_model=DiscountCodePage)
+async def list_discount_codes(
+    status: Literal["all", "used", "unused"] = "all",
+    code: Optional[str] = Query(None, min_length=1, description="Code prefix"),
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+):
+    # Keyset pagination on (created_at, code), newest first
+    codes = await storage.discount_codes.list_page(
+        None if status == "all" else status == "used",
+        code.upper() if code else None,
+        decode_cursor(cursor) if cursor else None,
+        limit + 1
     )
-    total_purchase_amount = sum(order["total"] for order in orders)
     
-    # Get discount codes
-    discount_codes = await db.discount_codes.find({}, {"_id": 0}).to_list(10000)
-    total_discount_amount = sum(order.get("discount_amount", 0) for order in orders)
+    next_cursor = None
+    if len(codes) > limit:
+        codes = codes[:limit]
+        next_cursor = encode_cursor(codes[-1]["created_at"], codes[-1]["code"])
+    
+    return respond(DiscountCodePage(codes=codes, next_cursor=next_cursor))
+
+def created_at_range(start: Optional[datetime], end: Optional[datetime]) -> dict:
+    """Order filter for ``start <= created_at < end``.
+
+    created_at is stored as an ISO-8601 UTC string, which sorts chronologically.
+    """
+    created_at = {}
+    if start:
+        created_at["$gte"] = to_utc_iso(start)
+    if end:
+        created_at["$lt"] = to_utc_iso(end)
+    return {"created_at": created_at} if created_at else {}
+
+ORDER_EXPORT_COLUMNS = [
+    "id", "order_number", "created_at", "customer_name", "customer_email",
+    "items", "subtotal", "discount_code", "discount_amount", "total", "generated_discount_code"
+]
+
+def encode_ndjson(order: dict) -> bytes:
+    return (orjson.dumps(order) if orjson else json.dumps(order, default=str).encode()) + b"\n"
+
+async def stream_orders(start: Optional[str], end: Optional[str], export_format: str, batch_size: int):
+    """Yield the export one cursor batch at a time so memory stays constant."""
+    cursor = storage.orders.find_range(start, end, batch_size)
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=ORDER_EXPORT_COLUMNS, extrasaction="ignore")
+    if export_format == "csv":
+        writer.writeheader()
     
+    chunk, pending = [], 0
+    async for order in cursor:
+        if export_format == "csv":
+            writer.writerow({**order, "items": json.dumps(order.get("items", []))})
+        else:
+            chunk.append(encode_ndjson(order))
+        pending += 1
+        if pending >= batch_size:
+            yield buffer.getvalue().encode() if export_format == "csv" else b"".join(chunk)
+            buffer.seek(0)
+            buffer.truncate()
+            chunk, pending = [], 0
+    
+    remainder = buffer.getvalue().encode() if export_format == "csv" else b"".join(chunk)
+    if remainder:
+        yield remainder
+
+@api_router.get("/admin/orders/export")
+async def export_orders(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    batch_size: int = Query(EXPORT_BATCH_SIZE, ge=1, le=10000)
+):
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    filename = f"orders.{'csv' if format == 'csv' else 'ndjson'}"
+    return StreamingResponse(
+        stream_orders(to_utc_iso(start) if start else None, to_utc_iso(end) if end else None, format, batch_size),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@api_router.get("/admin/cache-stats", response_model=CacheStats)
+async def get_cache_stats():
+    return catalog_cache.stats()
+
+async def cart_metrics() -> str:
+    """Gauges for the size of the carts working set and how far expiry lags."""
+    stats = await storage.carts.stats()
+    # Age of the oldest idle cart; should stay near CART_TTL_SECONDS
+    oldest_idle = 0.0
+    if isinstance(stats["oldest_updated_at"], datetime):
+        oldest_idle = (datetime.now(timezone.utc) - stats["oldest_updated_at"]).total_seconds()
+    return (
+        "# TYPE carts_documents gauge\n"
+        f"carts_documents {stats['count']}\n"
+        "# TYPE carts_data_bytes gauge\n"
+        f"carts_data_bytes {stats['size']}\n"
+        "# TYPE carts_storage_bytes gauge\n"
+        f"carts_storage_bytes {stats['storage_size']}\n"
+        "# TYPE carts_oldest_idle_seconds gauge\n"
+        f"carts_oldest_idle_seconds {oldest_idle:.0f}\n"
+    )
+
+async def outbox_metrics() -> str:
+    """Gauges for the outbox backlog; a growing age means the worker is falling behind."""
+    stats = await storage.outbox.stats()
+    oldest_age = 0.0
+    if isinstance(stats["oldest_created_at"], datetime):
+        oldest_age = (datetime.now(timezone.utc) - stats["oldest_created_at"]).total_seconds()
+    return (
+        "# TYPE outbox_pending_events gauge\n"
+        f"outbox_pending_events {stats['pending']}\n"
+        "# TYPE outbox_oldest_event_age_seconds gauge\n"
+        f"outbox_oldest_event_age_seconds {oldest_age:.1f}\n"
+    )
+
+def worker_metrics_snapshot() -> dict:
+    cache_stats = catalog_cache.stats()
     return {
-        "total_orders": total_orders,
-        "total_items_purchased": total_items_purchased,
-        "total_purchase_amount": total_purchase_amount,
-        "discount_codes": discount_codes,
-        "total_discount_amount": total_discount_amount
+        **metrics_snapshot(),
+        "catalog_cache": {"hits": cache_stats["hits"], "misses": cache_stats["misses"]},
+        "admission": admission.stats()
     }
 
-# Include the router in the main app
-app.include_router(api_router)
+async def publish_worker_metrics():
+    await db.worker_metrics.replace_one(
+        {"id": worker_id()},
+        {"id": worker_id(), "updated_at": datetime.now(timezone.utc), **worker_metrics_snapshot()},
+        upsert=True
+    )
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+async def metrics_publisher():
+    while True:
+        try:
+            await publish_worker_metrics()
+        except PyMongoError as e:
+            logger.warning(f"Publishing worker metrics failed: {e}")
+        await asyncio.sleep(METRICS_PUBLISH_INTERVAL)
+
+@api_router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    # Counters live in each worker process; add the snapshots the other workers published
+    snapshots = [worker_metrics_snapshot()]
+    if STORAGE_BACKEND == 'mongo' and METRICS_PUBLISH_INTERVAL:
+        since = datetime.now(timezone.utc) - timedelta(seconds=3 * METRICS_PUBLISH_INTERVAL)
+        async for snapshot in db.worker_metrics.find({"updated_at": {"$gte": since}}, {"_id": 0}):
+            if snapshot["id"] != worker_id():
+                snapshots.append(snapshot)
+    routes, commands = merge_metrics(snapshots)
+    lanes = {route_class: defaultdict(float) for route_class in ROUTE_CLASSES}
+    for snapshot in snapshots:
+        for route_class, lane in snapshot.get("admission", {}).items():
+            for name, value in lane.items():
+                lanes[route_class][name] += value
+    return render_metrics(routes, commands) + render_admission_metrics(lanes) + (
+        "# TYPE app_workers gauge\n"
+        f"app_workers {len(snapshots)}\n"
+        "# TYPE catalog_cache_hits_total counter\n"
+        f"catalog_cache_hits_total {sum(snapshot['catalog_cache']['hits'] for snapshot in snapshots)}\n"
+        "# TYPE catalog_cache_misses_total counter\n"
+        f"catalog_cache_misses_total {sum(snapshot['catalog_cache']['misses'] for snapshot in snapshots)}\n"
+    ) + await cart_metrics() + await outbox_metrics()
+
+@api_router.post("/admin/stats/rebuild", response_model=AdminStats)
+async def rebuild_admin_stats():
+    # Reconcile running aggregates against the orders collection
+    await rebuild_order_stats()
+    return await get_admin_stats()
+
+# Sales analytics
+SALES_TOTALS = {
+    "orders": {"$sum": 1},
+    "revenue": {"$sum": "$total"},
+    "items": {"$sum": {"$sum": "$items.quantity"}},
+    "discount": {"$sum": {"$ifNull": ["$discount_amount", 0]}}
+}
+SALES_PROJECTION = {"_id": 0, "bucket": "$_id", "orders": 1, "revenue": 1, "items": 1, "discount": 1}
+
+def bucket_expression(date, interval: str) -> dict:
+    trunc = {"date": date, "unit": interval, "timezone": "UTC"}
+    if interval == "week":
+        trunc["startOfWeek"] = "monday"
+    return {"$dateTrunc": trunc}
+
+async def sales_from_orders(interval: str, start: Optional[datetime], end: Optional[datetime]) -> List[dict]:
+    pipeline = [
+        {"$match": created_at_range(start, end)},
+        {"$group": {"_id": bucket_expression({"$toDate": "$created_at"}, interval), **SALES_TOTALS}},
+        {"$sort": {"_id": 1}},
+        {"$project": SALES_PROJECTION}
+    ]
+    return await reporting_db.orders.aggregate(pipeline).to_list(None)
+
+async def sales_from_rollups(interval: str, start: Optional[datetime], end: Optional[datetime]) -> List[dict]:
+    bucket = {}
+    if start:
+        bucket["$gte"] = start
+    if end:
+        bucket["$lt"] = end
+    pipeline = [
+        {"$match": {"bucket": bucket} if bucket else {}},
+        {"$group": {
+            "_id": bucket_expression("$bucket", interval),
+            **{field: {"$sum": f"${field}"} for field in SALES_TOTALS}
+        }},
+        {"$sort": {"_id": 1}},
+        {"$project": SALES_PROJECTION}
+    ]
+    return await reporting_db.sales_rollups.aggregate(pipeline).to_list(None)
+
+async def refresh_sales_rollups() -> bool:
+    """Recompute the hourly rollups of orders placed since the last refresh.
+
+    Whole hours are recomputed from the orders and overwrite their rollups, so a
+    refresh that failed part way is simply run again; the watermark moves only
+    once the rollups are written. A lease on the rollup state keeps workers from
+    refreshing at the same time. Orders newer than ``SALES_ROLLUP_LAG_SECONDS``
+    wait for the next refresh to let in-flight checkouts land.
+    """
+    now = datetime.now(timezone.utc)
+    lease_id = str(uuid.uuid4())
+    try:
+        state = await db.stats.find_one_and_update(
+            {"id": SALES_ROLLUP_ID, "$or": [{"lease_until": {"$exists": False}}, {"lease_until": {"$lte": now}}]},
+            {"$set": {"lease_id": lease_id, "lease_until": now + timedelta(seconds=SALES_ROLLUP_LEASE_SECONDS)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Another worker holds the lease
+        return False
+    lease = {"id": SALES_ROLLUP_ID, "lease_id": lease_id}
+    
+    cutoff = to_utc_iso(now - timedelta(seconds=SALES_ROLLUP_LAG_SECONDS))
+    created_at = {"$lt": cutoff}
+    if state.get("last_created_at"):
+        # Back to the top of the hour, so its bucket is recomputed whole
+        hour = datetime.fromisoformat(state["last_created_at"]).replace(minute=0, second=0, microsecond=0)
+        created_at["$gte"] = to_utc_iso(hour)
+    try:
+        await db.orders.aggregate([
+            {"$match": {"created_at": created_at}},
+            {"$group": {"_id": bucket_expression({"$toDate": "$created_at"}, "hour"), **SALES_TOTALS}},
+            {"$project": SALES_PROJECTION},
+            {"$merge": {
+                "into": "sales_rollups",
+                "on": "bucket",
+                "whenMatched": [{"$set": {field: f"$$new.{field}" for field in SALES_TOTALS}}],
+                "whenNotMatched": "insert"
+            }}
+        ]).to_list(None)
+    except Exception:
+        await db.stats.update_one(lease, {"$unset": {"lease_id": "", "lease_until": ""}})
+        raise
+    await db.stats.update_one(
+        lease, {"$set": {"last_created_at": cutoff}, "$unset": {"lease_id": "", "lease_until": ""}}
+    )
+    return True
+
+async def sales_rollup_refresher():
+    while True:
+        try:
+            await refresh_sales_rollups()
+        except PyMongoError as e:
+            logger.warning(f"Sales rollup refresh failed: {e}")
+        await asyncio.sleep(SALES_ROLLUP_INTERVAL)
+
+@api_router.get("/admin/analytics/sales", response_model=List[SalesBucket], dependencies=[Depends(require_mongo)])
+async def get_sales_analytics(
+    interval: Literal["hour", "day", "week"] = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    source: Literal["rollup", "orders"] = "rollup"
+):
+    # Rollups are hourly and may trail live orders by up to a refresh interval
+    if source == "rollup":
+        return await sales_from_rollups(interval, start, end)
+    return await sales_from_orders(interval, start, end)
+
+@api_router.get("/admin/analytics/top-products", response_model=List[ProductSales], dependencies=[Depends(require_mongo)])
+async def get_top_products(
+    by: Literal["units", "revenue"] = "revenue",
+    limit: int = Query(10, ge=1, le=100),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+):
+    # Revenue is line value (price x quantity) before order-level discounts
+    pipeline = [
+        {"$match": created_at_range(start, end)},
+        {"$unwind": "$items"},
+        {"$group": {
+            "_id": "$items.product_id",
+            "name": {"$last": "$items.name"},
+            "units": {"$sum": "$items.quantity"},
+            "revenue": {"$sum": {"$multiply": ["$items.price", "$items.quantity"]}}
+        }},
+        {"$sort": {by: -1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "product_id": "$_id", "name": 1, "units": 1, "revenue": 1}}
+    ]
+    return await reporting_db.orders.aggregate(pipeline).to_list(None)
+
+@api_router.get("/admin/analytics/categories", response_model=List[CategorySales], dependencies=[Depends(require_mongo)])
+async def get_category_analytics(start: Optional[datetime] = None, end: Optional[datetime] = None):
+    # Group per product first so the category lookup runs once per product
+    pipeline = [
+        {"$match": created_at_range(start, end)},
+        {"$unwind": "$items"},
+        {"$group": {
+            "_id": "$items.product_id",
+            "units": {"$sum": "$items.quantity"},
+            "revenue": {"$sum": {"$multiply": ["$items.price", "$items.quantity"]}}
+        }},
+        {"$lookup": {"from": "products", "localField": "_id", "foreignField": "id", "as": "product"}},
+        {"$group": {
+            "_id": {"$ifNull": [{"$arrayElemAt": ["$product.category", 0]}, "Uncategorized"]},
+            "products": {"$sum": 1},
+            "units": {"$sum": "$units"},
+            "revenue": {"$sum": "$revenue"}
+        }},
+        {"$sort": {"revenue": -1}},
+        {"$project": {"_id": 0, "category": "$_id", "products": 1, "units": 1, "revenue": 1}}
+    ]
+    return await reporting_db.orders.aggregate(pipeline).to_list(None)
+
+@api_router.post("/admin/analytics/rollups/rebuild", dependencies=[Depends(require_mongo)])
+async def rebuild_sales_rollups():
+    # Recompute the hourly rollups from scratch
+    await db.sales_rollups.delete_many({})
+    await db.stats.delete_one({"id": SALES_ROLLUP_ID})
+    await refresh_sales_rollups()
+    buckets = await db.sales_rollups.count_documents({})
+    return {"message": "Sales rollups rebuilt", "buckets": buckets}
 
 # Configure logging
 logging.basicConfig(
@@ -437,12 +2296,64 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("startup")
-async def startup_event():
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Runs in every worker process, after any fork, so each worker opens its own client."""
+    global transactions_supported
+    connect_storage()
+    background_tasks = []
+    if STORAGE_BACKEND == 'mongo':
+        transactions_supported = await detect_transaction_support()
+        logger.info(f"Multi-document transactions {'enabled' if transactions_supported else 'unavailable'}")
+        await init_indexes()
+        await migrate_cart_dates()
+        await migrate_utc_suffixes()
+        if CHECK_QUERY_PLANS:
+            collection_scans = await check_query_plans()
+            if collection_scans:
+                raise RuntimeError(f"Queries without index support: {collection_scans}")
+            logger.info(f"Verified index-backed plans for {len(HANDLER_QUERIES)} queries")
+    elif STOCK_RESERVATION_SECONDS:
+        raise RuntimeError("Stock reservations need the mongo storage backend")
     await init_sample_products()
-    logger.info("Application started")
+    await init_order_sequence()
+    await init_order_stats()
+    catalog_cache.set_version(await current_sequence(CATALOG_VERSION_ID))
+    await rebuild_search_index()
+    # Keep the long-lived startup heap, search index included, out of full collections
+    gc.collect()
+    gc.freeze()
+    background_tasks.append(asyncio.create_task(outbox_worker()))
+    if STORAGE_BACKEND == 'mongo':
+        # A single in-memory process sees every catalog change itself
+        background_tasks.append(asyncio.create_task(watch_catalog()))
+        if SALES_ROLLUP_INTERVAL:
+            background_tasks.append(asyncio.create_task(sales_rollup_refresher()))
+        if STOCK_RESERVATION_SECONDS:
+            background_tasks.append(asyncio.create_task(reservation_sweeper()))
+        if METRICS_PUBLISH_INTERVAL:
+            background_tasks.append(asyncio.create_task(metrics_publisher()))
+    logger.info(f"Worker {worker_id()} started with {STORAGE_BACKEND} storage")
+    yield
+    for task in background_tasks:
+        task.cancel()
+    disconnect_storage()
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
+# Create the main app without a prefix
+app = FastAPI(lifespan=lifespan)
 
+# Include the router in the main app
+app.include_router(api_router)
+
+# Innermost, so shed requests still get CORS headers and show up in the latency metrics
+app.add_middleware(AdmissionMiddleware)
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_credentials=True,
+    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+    allow_methods=["*"],
+    allow_headers=["*"],
+    expose_headers=["Server-Timing", "Idempotent-Replayed", "ETag", "Retry-After"],
+)
+app.add_middleware(MetricsMiddleware)
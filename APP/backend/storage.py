@@ -0,0 +1,1119 @@
+"""Storage backends for the shop API.
+
+Handlers reach the database through the repositories on a ``Storage``
+rather than through collections, so the same code runs on MongoDB
+(``MongoStorage``) or entirely in process (``MemoryStorage``).
+
+Every repository call is atomic on its own, like a single-document MongoDB
+update. The memory repositories get this by never awaiting between reading
+and writing their state, so no other request can interleave on the event
+loop. ``session`` arguments are only meaningful to the Mongo implementation.
+"""
+import asyncio
+import copy
+import re
+import uuid
+from abc import ABC, abstractmethod
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional
+
+from pymongo import ASCENDING, DESCENDING, ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+class ProductRepository(ABC):
+    @abstractmethod
+    async def count(self) -> int: ...
+
+    @abstractmethod
+    async def insert_many(self, products: List[dict]): ...
+
+    @abstractmethod
+    async def insert_missing(self, products: List[dict]) -> int:
+        """Insert the ``products`` whose ids are not stored yet; returns how many were."""
+
+    @abstractmethod
+    async def get(self, product_id: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def get_many(self, product_ids: List[str]) -> List[dict]: ...
+
+    @abstractmethod
+    async def list_page(
+        self,
+        category: Optional[str],
+        min_price: Optional[float],
+        max_price: Optional[float],
+        sort: str,
+        descending: bool,
+        after: Optional[tuple],
+        limit: int
+    ) -> List[dict]:
+        """Products ordered by ``(sort, id)``, starting after the ``after`` key."""
+
+    @abstractmethod
+    async def take_stock(self, lines: Dict[str, int], session=None) -> bool:
+        """Decrement stock by ``lines`` ({product_id: quantity}), all or nothing."""
+
+    @abstractmethod
+    async def restock(self, lines: Dict[str, int], session=None): ...
+
+    @abstractmethod
+    async def set_stock(self, stock: int, product_ids: Optional[List[str]] = None): ...
+
+    @abstractmethod
+    def find_all(self, batch_size: int) -> AsyncIterator[dict]:
+        """Every product, in no particular order."""
+
+class CartRepository(ABC):
+    @abstractmethod
+    async def get(self, cart_id: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def create(self, cart_id: str, item: dict, now: datetime) -> dict:
+        """Start the cart with ``item`` as its only line, creating it if needed."""
+
+    @abstractmethod
+    async def increment_item(self, cart_id: str, product_id: str, quantity: int, now: datetime) -> Optional[dict]:
+        """Bump the quantity of a line already in the cart, if there is one."""
+
+    @abstractmethod
+    async def push_item(self, cart_id: str, item: dict, now: datetime) -> Optional[dict]:
+        """Append a line to the cart unless one for the same product exists."""
+
+    @abstractmethod
+    async def apply_changes(self, cart_id: str, changes: dict, cart_items: dict, now: datetime) -> dict:
+        """Apply folded batch changes (see ``fold_cart_operations``), creating the cart if needed."""
+
+    @abstractmethod
+    async def remove_item(self, cart_id: str, product_id: str, now: datetime) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def set_item_quantity(self, cart_id: str, product_id: str, quantity: int, now: datetime) -> Optional[dict]:
+        """Set the quantity of a line, removing it at zero; None if the cart or line is gone."""
+
+    @abstractmethod
+    async def delete(self, cart_id: str, session=None): ...
+
+    @abstractmethod
+    async def check_out(self, cart_id: str, session=None) -> bool:
+        """Mark the cart checked out; False if it is gone or already was."""
+
+    @abstractmethod
+    async def reopen(self, cart_id: str):
+        """Undo ``check_out`` for an order that was never written."""
+
+    @abstractmethod
+    async def stats(self) -> dict:
+        """``count``, ``size`` and ``storage_size`` bytes, and ``oldest_updated_at``."""
+
+class OrderRepository(ABC):
+    @abstractmethod
+    async def insert(self, order: dict, session=None): ...
+
+    @abstractmethod
+    async def delete(self, order_id: str):
+        """Undo ``insert`` outside a transaction."""
+
+    @abstractmethod
+    async def count(self) -> int: ...
+
+    @abstractmethod
+    async def has_number(self, order_number: int) -> bool: ...
+
+    @abstractmethod
+    async def totals(self) -> Optional[dict]:
+        """Order count, items, purchase and discount sums; None without orders."""
+
+    @abstractmethod
+    def find_range(self, start: Optional[str], end: Optional[str], batch_size: int) -> AsyncIterator[dict]:
+        """Orders with ``start <= created_at < end`` (ISO strings), oldest first."""
+
+    @abstractmethod
+    async def list_by_customer(
+        self,
+        customer_email: str,
+        after: Optional[tuple],
+        limit: int,
+        include_items: bool
+    ) -> List[dict]:
+        """A customer's orders ordered by ``(created_at, id)`` newest first, starting after the ``after`` key."""
+
+class DiscountCodeRepository(ABC):
+    @abstractmethod
+    async def insert(self, discount_code: dict, session=None): ...
+
+    @abstractmethod
+    async def redeem(self, code: str, used_at: str, session=None) -> Optional[dict]:
+        """Flip an unused code to used; None if unavailable."""
+
+    @abstractmethod
+    async def release(self, code: str, session=None):
+        """Undo a redemption whose order was never written."""
+
+    @abstractmethod
+    async def delete(self, code: str):
+        """Undo ``insert`` of a reward code whose order was never written."""
+
+    @abstractmethod
+    async def count_by_status(self) -> Dict[bool, int]: ...
+
+    @abstractmethod
+    async def list_page(
+        self,
+        is_used: Optional[bool],
+        prefix: Optional[str],
+        after: Optional[tuple],
+        limit: int
+    ) -> List[dict]:
+        """Codes newest first by ``(created_at, code)``, starting after the ``after`` key."""
+
+class CounterRepository(ABC):
+    @abstractmethod
+    async def next(self, name: str) -> int:
+        """Atomically allocate the next value of a named counter, reusing given-back values first."""
+
+    @abstractmethod
+    async def give_back(self, name: str, value: int):
+        """Return an allocated value that was never used, for a later ``next`` to hand out."""
+
+    @abstractmethod
+    async def current(self, name: str) -> int: ...
+
+    @abstractmethod
+    async def raise_to(self, name: str, value: int): ...
+
+class StatsRepository(ABC):
+    @abstractmethod
+    async def get(self, stats_id: str) -> Optional[dict]: ...
+
+    @abstractmethod
+    async def increment(self, stats_id: str, amounts: dict): ...
+
+    @abstractmethod
+    async def replace(self, stats_id: str, values: dict): ...
+
+class IdempotencyKeyRepository(ABC):
+    @abstractmethod
+    async def claim(self, key: str, fingerprint: str, now: datetime, locked_until: datetime) -> Optional[dict]:
+        """Claim ``key`` until ``locked_until``; None if claimed now, otherwise the existing record.
+
+        A record without a ``body`` belongs to a request still in progress. Once
+        its lock has passed the owner is presumed dead, and the same request may
+        take the claim over.
+        """
+
+    @abstractmethod
+    async def complete(self, key: str, status_code: int, body: str): ...
+
+    @abstractmethod
+    async def release(self, key: str):
+        """Drop an unfinished claim so the request may run again."""
+
+class OutboxRepository(ABC):
+    """Events recorded with the write that caused them, for a background worker to act on.
+
+    Events are due from their ``available_at``. Claiming one pushes that to the
+    end of a lease, so an event whose worker died is claimed again once the
+    lease runs out: delivery is at least once.
+    """
+
+    @abstractmethod
+    async def insert(self, event: dict, session=None): ...
+
+    @abstractmethod
+    async def claim(self, limit: int, now: datetime, lease_until: datetime) -> List[dict]:
+        """Lease up to ``limit`` due events, oldest due first, counting the attempt."""
+
+    @abstractmethod
+    async def mark_step(self, event_id: str, step: str) -> bool:
+        """Record that ``step`` of an event ran; False if it already had."""
+
+    @abstractmethod
+    async def clear_step(self, event_id: str, step: str):
+        """Undo ``mark_step`` for a step that failed."""
+
+    @abstractmethod
+    async def mark_pending_step(self, event_type: str, step: str) -> int:
+        """``mark_step`` every queued event of ``event_type`` that has not run ``step``; returns how many."""
+
+    @abstractmethod
+    async def retry(self, event_id: str, error: str, available_at: datetime):
+        """Give up the lease and make the event due again at ``available_at``."""
+
+    @abstractmethod
+    async def delete(self, event_ids: List[str]): ...
+
+    @abstractmethod
+    async def stats(self) -> dict:
+        """``pending`` event count and ``oldest_created_at`` (None when empty)."""
+
+class Storage:
+    products: ProductRepository
+    carts: CartRepository
+    orders: OrderRepository
+    discount_codes: DiscountCodeRepository
+    counters: CounterRepository
+    stats: StatsRepository
+    idempotency_keys: IdempotencyKeyRepository
+    outbox: OutboxRepository
+
+# MongoDB
+def cart_line_with_quantity(quantity) -> dict:
+    return {
+        "product_id": "$$this.product_id",
+        "quantity": quantity,
+        "name": "$$this.name",
+        "price": "$$this.price",
+        "image": "$$this.image"
+    }
+
+def cart_items_update(changes: dict, cart_items: dict) -> dict:
+    """Aggregation expression applying folded changes to ``$items`` in one update."""
+    branches = []
+    for product_id, (present, _) in changes.items():
+        if present[0] == "absent":
+            then = None
+        elif present[0] == "rel":
+            then = cart_line_with_quantity({"$add": ["$$this.quantity", present[1]]})
+        else:
+            then = cart_line_with_quantity({"$literal": present[1]})
+        branches.append({"case": {"$eq": ["$$this.product_id", {"$literal": product_id}]}, "then": then})
+
+    appended = [
+        {"$cond": [
+            {"$in": [{"$literal": product_id}, "$$items.product_id"]},
+            [],
+            {"$literal": [{**cart_items[product_id], "quantity": absent[1]}]}
+        ]}
+        for product_id, (_, absent) in changes.items()
+        if absent[0] == "abs"
+    ]
+
+    return {"$let": {
+        "vars": {"items": {"$ifNull": ["$items", []]}},
+        "in": {"$concatArrays": [
+            {"$filter": {
+                "input": {"$map": {
+                    "input": "$$items",
+                    "in": {"$switch": {"branches": branches, "default": "$$this"}}
+                }},
+                "cond": {"$ne": ["$$this", None]}
+            }},
+            *appended
+        ]}
+    }}
+
+# Lets workers without a change stream find products whose stock moved
+STOCK_UPDATED = {"$currentDate": {"stock_updated_at": True}}
+
+class MongoProductRepository(ProductRepository):
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def count(self) -> int:
+        return await self.collection.count_documents({})
+
+    async def insert_many(self, products: List[dict]):
+        await self.collection.insert_many(products)
+
+    async def insert_missing(self, products: List[dict]) -> int:
+        result = await self.collection.bulk_write(
+            [UpdateOne({"id": product["id"]}, {"$setOnInsert": product}, upsert=True) for product in products],
+            ordered=False
+        )
+        return result.upserted_count
+
+    async def get(self, product_id: str) -> Optional[dict]:
+        return await self.collection.find_one({"id": product_id}, {"_id": 0})
+
+    async def get_many(self, product_ids: List[str]) -> List[dict]:
+        return await self.collection.find({"id": {"$in": product_ids}}, {"_id": 0}).to_list(None)
+
+    async def list_page(self, category, min_price, max_price, sort, descending, after, limit) -> List[dict]:
+        conditions = []
+        if category:
+            conditions.append({"category": category})
+        price_range = {}
+        if min_price is not None:
+            price_range["$gte"] = min_price
+        if max_price is not None:
+            price_range["$lte"] = max_price
+        if price_range:
+            conditions.append({"price": price_range})
+
+        # Keyset pagination on (sort field, id)
+        direction = DESCENDING if descending else ASCENDING
+        if after:
+            sort_value, product_id = after
+            op = "$lt" if descending else "$gt"
+            conditions.append({"$or": [
+                {sort: {op: sort_value}},
+                {sort: sort_value, "id": {op: product_id}}
+            ]})
+
+        query = {"$and": conditions} if conditions else {}
+        return await self.collection.find(query, {"_id": 0}).sort(
+            [(sort, direction), ("id", direction)]
+        ).limit(limit).to_list(limit)
+
+    async def take_stock(self, lines: Dict[str, int], session=None) -> bool:
+        """Each decrement is conditional on ``stock >= quantity``.
+
+        Inside a transaction the decrements go out as one bulk write and the
+        caller aborts on shortfall; without one they run concurrently and any
+        that succeeded are put back.
+        """
+        if not lines:
+            return True
+        decrements = [
+            ({"id": product_id, "stock": {"$gte": quantity}}, {"$inc": {"stock": -quantity}, **STOCK_UPDATED})
+            for product_id, quantity in lines.items()
+        ]
+        if session is not None:
+            result = await self.collection.bulk_write(
+                [UpdateOne(query, update) for query, update in decrements],
+                ordered=False,
+                session=session
+            )
+            return result.modified_count == len(decrements)
+
+        results = await asyncio.gather(*[
+            self.collection.update_one(query, update) for query, update in decrements
+        ])
+        taken = {
+            product_id: quantity
+            for (product_id, quantity), result in zip(lines.items(), results)
+            if result.modified_count
+        }
+        if len(taken) == len(lines):
+            return True
+        await self.restock(taken)
+        return False
+
+    async def restock(self, lines: Dict[str, int], session=None):
+        if lines:
+            await self.collection.bulk_write([
+                UpdateOne({"id": product_id}, {"$inc": {"stock": quantity}, **STOCK_UPDATED})
+                for product_id, quantity in lines.items()
+            ], ordered=False, session=session)
+
+    async def set_stock(self, stock: int, product_ids: Optional[List[str]] = None):
+        query = {"id": {"$in": product_ids}} if product_ids is not None else {}
+        await self.collection.update_many(query, {"$set": {"stock": stock}, **STOCK_UPDATED})
+
+    async def find_all(self, batch_size: int) -> AsyncIterator[dict]:
+        async for product in self.collection.find({}, {"_id": 0}).batch_size(batch_size):
+            yield product
+
+class MongoCartRepository(CartRepository):
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def _update(self, query: dict, update, **kwargs) -> Optional[dict]:
+        return await self.collection.find_one_and_update(
+            query, update, projection={"_id": 0}, return_document=ReturnDocument.AFTER, **kwargs
+        )
+
+    async def get(self, cart_id: str) -> Optional[dict]:
+        return await self.collection.find_one({"id": cart_id}, {"_id": 0})
+
+    async def create(self, cart_id: str, item: dict, now: datetime) -> dict:
+        return await self._update(
+            {"id": cart_id},
+            {"$setOnInsert": {"created_at": now}, "$set": {"items": [item], "updated_at": now}},
+            upsert=True
+        )
+
+    async def increment_item(self, cart_id: str, product_id: str, quantity: int, now: datetime) -> Optional[dict]:
+        return await self._update(
+            {"id": cart_id, "items.product_id": product_id},
+            {"$inc": {"items.$.quantity": quantity}, "$set": {"updated_at": now}}
+        )
+
+    async def push_item(self, cart_id: str, item: dict, now: datetime) -> Optional[dict]:
+        return await self._update(
+            {"id": cart_id, "items.product_id": {"$ne": item["product_id"]}},
+            {"$push": {"items": item}, "$set": {"updated_at": now}}
+        )
+
+    async def apply_changes(self, cart_id: str, changes: dict, cart_items: dict, now: datetime) -> dict:
+        # One pipeline update applies the whole batch
+        return await self._update(
+            {"id": cart_id},
+            [{"$set": {
+                "items": cart_items_update(changes, cart_items),
+                "created_at": {"$ifNull": ["$created_at", now]},
+                "updated_at": now
+            }}],
+            upsert=True
+        )
+
+    async def remove_item(self, cart_id: str, product_id: str, now: datetime) -> Optional[dict]:
+        return await self._update(
+            {"id": cart_id},
+            {"$pull": {"items": {"product_id": product_id}}, "$set": {"updated_at": now}}
+        )
+
+    async def set_item_quantity(self, cart_id: str, product_id: str, quantity: int, now: datetime) -> Optional[dict]:
+        if quantity <= 0:
+            return await self.remove_item(cart_id, product_id, now)
+        return await self._update(
+            {"id": cart_id, "items.product_id": product_id},
+            {"$set": {"items.$.quantity": quantity, "updated_at": now}}
+        )
+
+    async def delete(self, cart_id: str, session=None):
+        await self.collection.delete_one({"id": cart_id}, session=session)
+
+    async def check_out(self, cart_id: str, session=None) -> bool:
+        result = await self.collection.update_one(
+            {"id": cart_id, "checked_out": {"$ne": True}}, {"$set": {"checked_out": True}}, session=session
+        )
+        return result.modified_count == 1
+
+    async def reopen(self, cart_id: str):
+        await self.collection.update_one({"id": cart_id}, {"$unset": {"checked_out": ""}})
+
+    async def stats(self) -> dict:
+        storage = {}
+        async for row in self.collection.aggregate([{"$collStats": {"storageStats": {}}}]):
+            storage = row["storageStats"]
+        # Oldest idle cart, read off the TTL index
+        oldest = await self.collection.find_one(
+            {}, {"_id": 0, "updated_at": 1}, sort=[("updated_at", ASCENDING)]
+        )
+        return {
+            "count": storage.get("count", 0),
+            "size": storage.get("size", 0),
+            "storage_size": storage.get("storageSize", 0),
+            "oldest_updated_at": oldest.get("updated_at") if oldest else None
+        }
+
+class MongoOrderRepository(OrderRepository):
+    def __init__(self, collection, reporting_collection=None):
+        self.collection = collection
+        # Exports may read from secondaries; everything else stays on the primary
+        self.reporting_collection = reporting_collection if reporting_collection is not None else collection
+
+    async def insert(self, order: dict, session=None):
+        # insert_one adds _id to the document it is given
+        await self.collection.insert_one(dict(order), session=session)
+
+    async def delete(self, order_id: str):
+        await self.collection.delete_one({"id": order_id})
+
+    async def count(self) -> int:
+        return await self.collection.count_documents({})
+
+    async def has_number(self, order_number: int) -> bool:
+        return await self.collection.find_one({"order_number": order_number}, {"_id": 0, "id": 1}) is not None
+
+    async def totals(self) -> Optional[dict]:
+        pipeline = [
+            {"$group": {
+                "_id": None,
+                "total_orders": {"$sum": 1},
+                "total_items_purchased": {"$sum": {"$sum": "$items.quantity"}},
+                "total_purchase_amount": {"$sum": "$total"},
+                "total_discount_amount": {"$sum": {"$ifNull": ["$discount_amount", 0]}}
+            }}
+        ]
+        results = await self.collection.aggregate(pipeline).to_list(1)
+        return results[0] if results else None
+
+    async def find_range(self, start: Optional[str], end: Optional[str], batch_size: int) -> AsyncIterator[dict]:
+        created_at = {}
+        if start:
+            created_at["$gte"] = start
+        if end:
+            created_at["$lt"] = end
+        query = {"created_at": created_at} if created_at else {}
+        cursor = self.reporting_collection.find(query, {"_id": 0}).sort("created_at", ASCENDING).batch_size(batch_size)
+        async for order in cursor:
+            yield order
+
+    async def list_by_customer(self, customer_email, after, limit, include_items) -> List[dict]:
+        # Read from the primary so a customer sees the order they just placed
+        query = {"customer_email": customer_email}
+        if after:
+            created_at, order_id = after
+            query["$or"] = [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "id": {"$lt": order_id}}
+            ]
+        projection = {"_id": 0} if include_items else {"_id": 0, "items": 0}
+        return await self.collection.find(query, projection).sort(
+            [("created_at", DESCENDING), ("id", DESCENDING)]
+        ).limit(limit).to_list(limit)
+
+class MongoDiscountCodeRepository(DiscountCodeRepository):
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def insert(self, discount_code: dict, session=None):
+        await self.collection.insert_one(dict(discount_code), session=session)
+
+    async def redeem(self, code: str, used_at: str, session=None) -> Optional[dict]:
+        return await self.collection.find_one_and_update(
+            {"code": code, "is_used": False},
+            {"$set": {"is_used": True, "used_at": used_at}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+            session=session
+        )
+
+    async def release(self, code: str, session=None):
+        await self.collection.update_one(
+            {"code": code, "is_used": True},
+            {"$set": {"is_used": False, "used_at": None}},
+            session=session
+        )
+
+    async def delete(self, code: str):
+        await self.collection.delete_one({"code": code, "is_used": False})
+
+    async def count_by_status(self) -> Dict[bool, int]:
+        # Matching and grouping on is_used alone keeps this a covered index scan
+        counts = {True: 0, False: 0}
+        pipeline = [
+            {"$match": {"is_used": {"$in": [True, False]}}},
+            {"$group": {"_id": "$is_used", "count": {"$sum": 1}}}
+        ]
+        async for row in self.collection.aggregate(pipeline):
+            counts[row["_id"]] = row["count"]
+        return counts
+
+    async def list_page(self, is_used, prefix, after, limit) -> List[dict]:
+        # Both statuses for "all", so the planner merges the two ranges of the
+        # (is_used, created_at, code) index instead of sorting the collection
+        conditions = [{"is_used": {"$in": [False, True]} if is_used is None else is_used}]
+        if prefix:
+            conditions.append({"code": {"$regex": f"^{re.escape(prefix)}"}})
+        if after:
+            created_at, code = after
+            conditions.append({"$or": [
+                {"created_at": {"$lt": created_at}},
+                {"created_at": created_at, "code": {"$lt": code}}
+            ]})
+        return await self.collection.find({"$and": conditions}, {"_id": 0}).sort(
+            [("created_at", DESCENDING), ("code", DESCENDING)]
+        ).limit(limit).to_list(limit)
+
+class MongoCounterRepository(CounterRepository):
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def next(self, name: str) -> int:
+        # One pipeline update takes the oldest given-back value, or else increments
+        returned = {"$ifNull": ["$returned", []]}
+        has_returned = {"$gt": [{"$size": returned}, 0]}
+        incremented = {"$add": [{"$ifNull": ["$seq", 0]}, 1]}
+        counter = await self.collection.find_one_and_update(
+            {"id": name},
+            [{"$set": {
+                "last": {"$cond": [has_returned, {"$arrayElemAt": [returned, 0]}, incremented]},
+                "seq": {"$cond": [has_returned, "$seq", incremented]},
+                "returned": {"$slice": [returned, 1, 1000000]}
+            }}],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return counter["last"]
+
+    async def give_back(self, name: str, value: int):
+        await self.collection.update_one({"id": name}, {"$push": {"returned": value}})
+
+    async def current(self, name: str) -> int:
+        counter = await self.collection.find_one({"id": name}, {"_id": 0})
+        return counter["seq"] if counter else 0
+
+    async def raise_to(self, name: str, value: int):
+        await self.collection.update_one({"id": name}, {"$max": {"seq": value}}, upsert=True)
+
+class MongoStatsRepository(StatsRepository):
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def get(self, stats_id: str) -> Optional[dict]:
+        return await self.collection.find_one({"id": stats_id}, {"_id": 0})
+
+    async def increment(self, stats_id: str, amounts: dict):
+        await self.collection.update_one({"id": stats_id}, {"$inc": amounts}, upsert=True)
+
+    async def replace(self, stats_id: str, values: dict):
+        await self.collection.update_one({"id": stats_id}, {"$set": values}, upsert=True)
+
+class MongoIdempotencyKeyRepository(IdempotencyKeyRepository):
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def claim(self, key: str, fingerprint: str, now: datetime, locked_until: datetime) -> Optional[dict]:
+        try:
+            await self.collection.insert_one(
+                {"key": key, "fingerprint": fingerprint, "created_at": now, "locked_until": locked_until}
+            )
+            return None
+        except DuplicateKeyError:
+            pass
+        # Take over an unfinished claim whose lock ran out
+        taken = await self.collection.find_one_and_update(
+            {
+                "key": key,
+                "fingerprint": fingerprint,
+                "body": {"$exists": False},
+                "locked_until": {"$not": {"$gt": now}}
+            },
+            {"$set": {"locked_until": locked_until}},
+            projection={"_id": 1}
+        )
+        if taken:
+            return None
+        record = await self.collection.find_one({"key": key}, {"_id": 0})
+        # Released or expired since the insert failed: still treat as in progress
+        return record or {"key": key, "fingerprint": fingerprint}
+
+    async def complete(self, key: str, status_code: int, body: str):
+        # The first completion wins if a taken-over claim finishes twice
+        await self.collection.update_one(
+            {"key": key, "body": {"$exists": False}},
+            {"$set": {"status_code": status_code, "body": body}, "$unset": {"locked_until": ""}}
+        )
+
+    async def release(self, key: str):
+        await self.collection.delete_one({"key": key, "body": {"$exists": False}})
+
+class MongoOutboxRepository(OutboxRepository):
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def insert(self, event: dict, session=None):
+        await self.collection.insert_one(dict(event), session=session)
+
+    async def claim(self, limit: int, now: datetime, lease_until: datetime) -> List[dict]:
+        due = await self.collection.find(
+            {"available_at": {"$lte": now}}, {"_id": 0, "id": 1}
+        ).sort("available_at", ASCENDING).limit(limit).to_list(limit)
+        if not due:
+            return []
+        # Workers racing for the same events each get only those their update took
+        claim_id = str(uuid.uuid4())
+        event_ids = [event["id"] for event in due]
+        await self.collection.update_many(
+            {"id": {"$in": event_ids}, "available_at": {"$lte": now}},
+            {"$set": {"available_at": lease_until, "claim_id": claim_id}, "$inc": {"attempts": 1}}
+        )
+        return await self.collection.find(
+            {"id": {"$in": event_ids}, "claim_id": claim_id}, {"_id": 0}
+        ).sort("available_at", ASCENDING).to_list(None)
+
+    async def mark_step(self, event_id: str, step: str) -> bool:
+        result = await self.collection.update_one(
+            {"id": event_id, f"steps.{step}": {"$ne": True}}, {"$set": {f"steps.{step}": True}}
+        )
+        return result.modified_count == 1
+
+    async def clear_step(self, event_id: str, step: str):
+        await self.collection.update_one({"id": event_id}, {"$unset": {f"steps.{step}": ""}})
+
+    async def mark_pending_step(self, event_type: str, step: str) -> int:
+        result = await self.collection.update_many(
+            {"type": event_type, f"steps.{step}": {"$ne": True}}, {"$set": {f"steps.{step}": True}}
+        )
+        return result.modified_count
+
+    async def retry(self, event_id: str, error: str, available_at: datetime):
+        await self.collection.update_one(
+            {"id": event_id}, {"$set": {"available_at": available_at, "last_error": error}}
+        )
+
+    async def delete(self, event_ids: List[str]):
+        await self.collection.delete_many({"id": {"$in": event_ids}})
+
+    async def stats(self) -> dict:
+        oldest = await self.collection.find({}, {"_id": 0, "created_at": 1}).sort("created_at", ASCENDING).to_list(1)
+        return {
+            "pending": await self.collection.count_documents({}),
+            "oldest_created_at": oldest[0]["created_at"] if oldest else None
+        }
+
+class MongoStorage(Storage):
+    def __init__(self, db, reporting_db=None):
+        self.products = MongoProductRepository(db.products)
+        self.carts = MongoCartRepository(db.carts)
+        self.orders = MongoOrderRepository(db.orders, reporting_db.orders if reporting_db is not None else None)
+        self.discount_codes = MongoDiscountCodeRepository(db.discount_codes)
+        self.counters = MongoCounterRepository(db.counters)
+        self.stats = MongoStatsRepository(db.stats)
+        self.idempotency_keys = MongoIdempotencyKeyRepository(db.idempotency_keys)
+        self.outbox = MongoOutboxRepository(db.outbox)
+
+# In-memory
+def sort_key(document: dict, field: str, key_field: str) -> tuple:
+    return (document[field], document[key_field])
+
+class MemoryProductRepository(ProductRepository):
+    def __init__(self):
+        self.products: Dict[str, dict] = {}
+
+    async def count(self) -> int:
+        return len(self.products)
+
+    async def insert_many(self, products: List[dict]):
+        for product in products:
+            self.products[product["id"]] = copy.deepcopy(product)
+
+    async def insert_missing(self, products: List[dict]) -> int:
+        missing = [product for product in products if product["id"] not in self.products]
+        await self.insert_many(missing)
+        return len(missing)
+
+    async def get(self, product_id: str) -> Optional[dict]:
+        product = self.products.get(product_id)
+        return copy.deepcopy(product) if product else None
+
+    async def get_many(self, product_ids: List[str]) -> List[dict]:
+        return [copy.deepcopy(self.products[product_id]) for product_id in product_ids if product_id in self.products]
+
+    async def list_page(self, category, min_price, max_price, sort, descending, after, limit) -> List[dict]:
+        products = [
+            product for product in self.products.values()
+            if (not category or product["category"] == category)
+            and (min_price is None or product["price"] >= min_price)
+            and (max_price is None or product["price"] <= max_price)
+        ]
+        if after:
+            after = tuple(after)
+            products = [
+                product for product in products
+                if (sort_key(product, sort, "id") < after if descending else sort_key(product, sort, "id") > after)
+            ]
+        products.sort(key=lambda product: sort_key(product, sort, "id"), reverse=descending)
+        return copy.deepcopy(products[:limit])
+
+    async def take_stock(self, lines: Dict[str, int], session=None) -> bool:
+        if any(
+            product_id not in self.products or self.products[product_id]["stock"] < quantity
+            for product_id, quantity in lines.items()
+        ):
+            return False
+        for product_id, quantity in lines.items():
+            self.products[product_id]["stock"] -= quantity
+        return True
+
+    async def restock(self, lines: Dict[str, int], session=None):
+        for product_id, quantity in lines.items():
+            if product_id in self.products:
+                self.products[product_id]["stock"] += quantity
+
+    async def set_stock(self, stock: int, product_ids: Optional[List[str]] = None):
+        for product_id, product in self.products.items():
+            if product_ids is None or product_id in product_ids:
+                product["stock"] = stock
+
+    async def find_all(self, batch_size: int) -> AsyncIterator[dict]:
+        for product in list(self.products.values()):
+            yield copy.deepcopy(product)
+
+class MemoryCartRepository(CartRepository):
+    def __init__(self):
+        self.carts: Dict[str, dict] = {}
+
+    def _line(self, cart: dict, product_id: str) -> Optional[dict]:
+        return next((item for item in cart["items"] if item["product_id"] == product_id), None)
+
+    def _touch(self, cart: dict, now: datetime) -> dict:
+        cart["updated_at"] = now
+        return copy.deepcopy(cart)
+
+    async def get(self, cart_id: str) -> Optional[dict]:
+        cart = self.carts.get(cart_id)
+        return copy.deepcopy(cart) if cart else None
+
+    async def create(self, cart_id: str, item: dict, now: datetime) -> dict:
+        cart = self.carts.setdefault(cart_id, {"id": cart_id, "created_at": now})
+        cart["items"] = [dict(item)]
+        return self._touch(cart, now)
+
+    async def increment_item(self, cart_id: str, product_id: str, quantity: int, now: datetime) -> Optional[dict]:
+        cart = self.carts.get(cart_id)
+        line = self._line(cart, product_id) if cart else None
+        if not line:
+            return None
+        line["quantity"] += quantity
+        return self._touch(cart, now)
+
+    async def push_item(self, cart_id: str, item: dict, now: datetime) -> Optional[dict]:
+        cart = self.carts.get(cart_id)
+        if not cart or self._line(cart, item["product_id"]):
+            return None
+        cart["items"].append(dict(item))
+        return self._touch(cart, now)
+
+    async def apply_changes(self, cart_id: str, changes: dict, cart_items: dict, now: datetime) -> dict:
+        cart = self.carts.setdefault(cart_id, {"id": cart_id, "created_at": now, "items": []})
+        present_ids = {item["product_id"] for item in cart["items"]}
+        items = []
+        for item in cart["items"]:
+            present, _ = changes.get(item["product_id"], (("rel", 0), None))
+            if present[0] == "rel":
+                items.append({**item, "quantity": item["quantity"] + present[1]})
+            elif present[0] == "abs":
+                items.append({**item, "quantity": present[1]})
+        for product_id, (_, absent) in changes.items():
+            if absent[0] == "abs" and product_id not in present_ids:
+                items.append({**cart_items[product_id], "quantity": absent[1]})
+        cart["items"] = items
+        return self._touch(cart, now)
+
+    async def remove_item(self, cart_id: str, product_id: str, now: datetime) -> Optional[dict]:
+        cart = self.carts.get(cart_id)
+        if not cart:
+            return None
+        cart["items"] = [item for item in cart["items"] if item["product_id"] != product_id]
+        return self._touch(cart, now)
+
+    async def set_item_quantity(self, cart_id: str, product_id: str, quantity: int, now: datetime) -> Optional[dict]:
+        if quantity <= 0:
+            return await self.remove_item(cart_id, product_id, now)
+        cart = self.carts.get(cart_id)
+        if not cart:
+            return None
+        line = self._line(cart, product_id)
+        if not line:
+            return None
+        line["quantity"] = quantity
+        return self._touch(cart, now)
+
+    async def delete(self, cart_id: str, session=None):
+        self.carts.pop(cart_id, None)
+
+    async def check_out(self, cart_id: str, session=None) -> bool:
+        cart = self.carts.get(cart_id)
+        if cart is None or cart.get("checked_out"):
+            return False
+        cart["checked_out"] = True
+        return True
+
+    async def reopen(self, cart_id: str):
+        if cart_id in self.carts:
+            self.carts[cart_id].pop("checked_out", None)
+
+    async def stats(self) -> dict:
+        return {
+            "count": len(self.carts),
+            "size": 0,
+            "storage_size": 0,
+            "oldest_updated_at": min((cart["updated_at"] for cart in self.carts.values()), default=None)
+        }
+
+class MemoryOrderRepository(OrderRepository):
+    def __init__(self):
+        self.orders: List[dict] = []
+
+    async def insert(self, order: dict, session=None):
+        self.orders.append(copy.deepcopy(order))
+
+    async def delete(self, order_id: str):
+        self.orders = [order for order in self.orders if order["id"] != order_id]
+
+    async def count(self) -> int:
+        return len(self.orders)
+
+    async def has_number(self, order_number: int) -> bool:
+        return any(order.get("order_number") == order_number for order in self.orders)
+
+    async def totals(self) -> Optional[dict]:
+        if not self.orders:
+            return None
+        return {
+            "total_orders": len(self.orders),
+            "total_items_purchased": sum(item["quantity"] for order in self.orders for item in order["items"]),
+            "total_purchase_amount": sum(order["total"] for order in self.orders),
+            "total_discount_amount": sum(order.get("discount_amount") or 0 for order in self.orders)
+        }
+
+    async def find_range(self, start: Optional[str], end: Optional[str], batch_size: int) -> AsyncIterator[dict]:
+        orders = sorted(
+            (
+                order for order in self.orders
+                if (not start or order["created_at"] >= start) and (not end or order["created_at"] < end)
+            ),
+            key=lambda order: order["created_at"]
+        )
+        for order in orders:
+            yield copy.deepcopy(order)
+
+    async def list_by_customer(self, customer_email, after, limit, include_items) -> List[dict]:
+        orders = [
+            order for order in self.orders
+            if order["customer_email"] == customer_email
+            and (not after or sort_key(order, "created_at", "id") < tuple(after))
+        ]
+        orders.sort(key=lambda order: sort_key(order, "created_at", "id"), reverse=True)
+        if not include_items:
+            return [{key: value for key, value in copy.deepcopy(order).items() if key != "items"} for order in orders[:limit]]
+        return copy.deepcopy(orders[:limit])
+
+class MemoryDiscountCodeRepository(DiscountCodeRepository):
+    def __init__(self):
+        self.codes: Dict[str, dict] = {}
+
+    async def insert(self, discount_code: dict, session=None):
+        if discount_code["code"] in self.codes:
+            raise DuplicateKeyError(f"Duplicate discount code {discount_code['code']}")
+        self.codes[discount_code["code"]] = copy.deepcopy(discount_code)
+
+    async def redeem(self, code: str, used_at: str, session=None) -> Optional[dict]:
+        discount_code = self.codes.get(code)
+        if not discount_code or discount_code["is_used"]:
+            return None
+        discount_code.update(is_used=True, used_at=used_at)
+        return copy.deepcopy(discount_code)
+
+    async def release(self, code: str, session=None):
+        discount_code = self.codes.get(code)
+        if discount_code and discount_code["is_used"]:
+            discount_code.update(is_used=False, used_at=None)
+
+    async def delete(self, code: str):
+        if code in self.codes and not self.codes[code]["is_used"]:
+            del self.codes[code]
+
+    async def count_by_status(self) -> Dict[bool, int]:
+        used = sum(1 for discount_code in self.codes.values() if discount_code["is_used"])
+        return {True: used, False: len(self.codes) - used}
+
+    async def list_page(self, is_used, prefix, after, limit) -> List[dict]:
+        codes = [
+            discount_code for discount_code in self.codes.values()
+            if (is_used is None or discount_code["is_used"] == is_used)
+            and (not prefix or discount_code["code"].startswith(prefix))
+            and (not after or sort_key(discount_code, "created_at", "code") < tuple(after))
+        ]
+        codes.sort(key=lambda discount_code: sort_key(discount_code, "created_at", "code"), reverse=True)
+        return copy.deepcopy(codes[:limit])
+
+class MemoryCounterRepository(CounterRepository):
+    def __init__(self):
+        self.counters: Dict[str, int] = {}
+        self.returned: Dict[str, List[int]] = {}
+
+    async def next(self, name: str) -> int:
+        returned = self.returned.get(name)
+        if returned:
+            return returned.pop(0)
+        self.counters[name] = self.counters.get(name, 0) + 1
+        return self.counters[name]
+
+    async def give_back(self, name: str, value: int):
+        self.returned.setdefault(name, []).append(value)
+
+    async def current(self, name: str) -> int:
+        return self.counters.get(name, 0)
+
+    async def raise_to(self, name: str, value: int):
+        self.counters[name] = max(self.counters.get(name, 0), value)
+
+class MemoryStatsRepository(StatsRepository):
+    def __init__(self):
+        self.stats: Dict[str, dict] = {}
+
+    async def get(self, stats_id: str) -> Optional[dict]:
+        stats = self.stats.get(stats_id)
+        return dict(stats) if stats else None
+
+    async def increment(self, stats_id: str, amounts: dict):
+        stats = self.stats.setdefault(stats_id, {"id": stats_id})
+        for field, amount in amounts.items():
+            stats[field] = stats.get(field, 0) + amount
+
+    async def replace(self, stats_id: str, values: dict):
+        self.stats.setdefault(stats_id, {"id": stats_id}).update(values)
+
+class MemoryIdempotencyKeyRepository(IdempotencyKeyRepository):
+    """Records are kept for the life of the process; there is no TTL."""
+
+    def __init__(self):
+        self.records: Dict[str, dict] = {}
+
+    async def claim(self, key: str, fingerprint: str, now: datetime, locked_until: datetime) -> Optional[dict]:
+        record = self.records.get(key)
+        if record is None:
+            self.records[key] = {"key": key, "fingerprint": fingerprint, "created_at": now, "locked_until": locked_until}
+            return None
+        if record["fingerprint"] == fingerprint and "body" not in record and record["locked_until"] <= now:
+            record["locked_until"] = locked_until
+            return None
+        return dict(record)
+
+    async def complete(self, key: str, status_code: int, body: str):
+        record = self.records.get(key)
+        if record is not None and "body" not in record:
+            record.update(status_code=status_code, body=body)
+            record.pop("locked_until", None)
+
+    async def release(self, key: str):
+        if key in self.records and "body" not in self.records[key]:
+            del self.records[key]
+
+class MemoryOutboxRepository(OutboxRepository):
+    def __init__(self):
+        self.events: Dict[str, dict] = {}
+
+    async def insert(self, event: dict, session=None):
+        self.events[event["id"]] = copy.deepcopy(event)
+
+    async def claim(self, limit: int, now: datetime, lease_until: datetime) -> List[dict]:
+        due = sorted(
+            (event for event in self.events.values() if event["available_at"] <= now),
+            key=lambda event: event["available_at"]
+        )[:limit]
+        for event in due:
+            event["available_at"] = lease_until
+            event["attempts"] = event.get("attempts", 0) + 1
+        return copy.deepcopy(due)
+
+    async def mark_step(self, event_id: str, step: str) -> bool:
+        steps = self.events[event_id].setdefault("steps", {}) if event_id in self.events else {}
+        if steps.get(step):
+            return False
+        steps[step] = True
+        return True
+
+    async def clear_step(self, event_id: str, step: str):
+        if event_id in self.events:
+            self.events[event_id].get("steps", {}).pop(step, None)
+
+    async def mark_pending_step(self, event_type: str, step: str) -> int:
+        marked = 0
+        for event in self.events.values():
+            steps = event.setdefault("steps", {})
+            if event["type"] == event_type and not steps.get(step):
+                steps[step] = True
+                marked += 1
+        return marked
+
+    async def retry(self, event_id: str, error: str, available_at: datetime):
+        if event_id in self.events:
+            self.events[event_id].update(available_at=available_at, last_error=error)
+
+    async def delete(self, event_ids: List[str]):
+        for event_id in event_ids:
+            self.events.pop(event_id, None)
+
+    async def stats(self) -> dict:
+        return {
+            "pending": len(self.events),
+            "oldest_created_at": min((event["created_at"] for event in self.events.values()), default=None)
+        }
+
+class MemoryStorage(Storage):
+    def __init__(self):
+        self.products = MemoryProductRepository()
+        self.carts = MemoryCartRepository()
+        self.orders = MemoryOrderRepository()
+        self.discount_codes = MemoryDiscountCodeRepository()
+        self.counters = MemoryCounterRepository()
+        self.stats = MemoryStatsRepository()
+        self.idempotency_keys = MemoryIdempotencyKeyRepository()
+        self.outbox = MemoryOutboxRepository()
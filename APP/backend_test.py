@@ -1,17 +1,24 @@
 import requests
 import sys
+import os
 import json
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+NTH_ORDER_FOR_DISCOUNT = 10
+
 class EcommerceAPITester:
-    def __init__(self, base_url="https://orderzen-1.preview.emergentagent.com"):
+    def __init__(self, base_url=os.environ.get("BACKEND_URL", "https://orderzen-1.preview.emergentagent.com")):
         self.base_url = base_url
         self.api_url = f"{base_url}/api"
         self.tests_run = 0
         self.tests_passed = 0
         self.cart_id = None
         self.product_ids = []
+        self.product_names = []
         self.discount_code = None
+        self.race_discount_code = None
 
     def run_test(self, name, method, endpoint, expected_status, data=None, params=None):
         """Run a single API test"""
@@ -61,8 +68,10 @@ class EcommerceAPITester:
             200
         )
         if success and response:
-            self.product_ids = [product['id'] for product in response[:3]]  # Store first 3 product IDs
-            print(f"Found {len(response)} products")
+            products = response.get('products', [])
+            self.product_ids = [product['id'] for product in products[:3]]  # Store first 3 product IDs
+            self.product_names = [product['name'] for product in products[:3]]
+            print(f"Found {len(products)} products (next cursor: {response.get('next_cursor')})")
         return success
 
     def test_get_single_product(self):
@@ -79,6 +88,52 @@ class EcommerceAPITester:
         )
         return success
 
+    def test_search_products(self):
+        """Test the start of a product name finds that product"""
+        if not self.product_names:
+            print("❌ No product names available for search test")
+            return False
+
+        self.tests_run += 1
+        prefix = self.product_names[0][:4]
+        print(f"\n🔍 Testing Search Products ('{prefix}')...")
+
+        response = requests.get(f"{self.api_url}/products/search", params={"q": prefix})
+        if response.status_code != 200:
+            print(f"❌ Failed - Expected 200, got {response.status_code}")
+            return False
+        names = [product['name'] for product in response.json()]
+        if self.product_names[0] not in names:
+            print(f"❌ Failed - {self.product_names[0]} not in {names}")
+            return False
+
+        self.tests_passed += 1
+        print(f"✅ Passed - Matched {names}")
+        return True
+
+    def test_conditional_get_product(self):
+        """Test a product revalidated with its ETag comes back 304 without a body"""
+        if not self.product_ids:
+            print("❌ No product IDs available for conditional GET test")
+            return False
+
+        self.tests_run += 1
+        print("\n🔍 Testing Conditional GET Product...")
+
+        url = f"{self.api_url}/products/{self.product_ids[0]}"
+        etag = requests.get(url).headers.get("ETag")
+        if not etag:
+            print("❌ Failed - No ETag header")
+            return False
+        response = requests.get(url, headers={"If-None-Match": etag})
+        if response.status_code != 304 or response.content:
+            print(f"❌ Failed - Expected an empty 304, got {response.status_code} with {len(response.content)} bytes")
+            return False
+
+        self.tests_passed += 1
+        print(f"✅ Passed - 304 for ETag {etag}")
+        return True
+
     def test_add_to_cart(self):
         """Test adding items to cart"""
         if not self.product_ids:
@@ -164,6 +219,29 @@ class EcommerceAPITester:
         )
         return success
 
+    def test_batch_cart_operations(self):
+        """Test applying several cart operations in one request"""
+        if not self.cart_id or len(self.product_ids) < 3:
+            print("❌ No cart ID or insufficient products for batch cart test")
+            return False
+
+        success, response = self.run_test(
+            "Batch Cart Operations",
+            "POST",
+            f"cart/{self.cart_id}/items:batch",
+            200,
+            data={
+                "operations": [
+                    {"op": "add", "product_id": self.product_ids[1], "quantity": 2},
+                    {"op": "add", "product_id": self.product_ids[2], "quantity": 1},
+                    {"op": "remove", "product_id": self.product_ids[2]}
+                ]
+            }
+        )
+        if success and response:
+            print(f"Cart has {len(response['cart']['items'])} items after batch")
+        return success
+
     def test_checkout_without_discount(self):
         """Test checkout without discount code"""
         if not self.cart_id:
@@ -265,6 +343,26 @@ class EcommerceAPITester:
             print(f"Discount applied: ${response.get('discount_amount', 0)}")
         return success
 
+    def test_customer_order_history(self):
+        """Test paging through a customer's orders, newest first"""
+        success, response = self.run_test(
+            "Customer Order History",
+            "GET",
+            "orders",
+            200,
+            params={"customer_email": "test@example.com", "limit": 1}
+        )
+        if success and response:
+            orders = response.get('orders', [])
+            if not orders or any(order['customer_email'] != "test@example.com" for order in orders):
+                print("❌ Failed - Expected only orders of test@example.com")
+                return False
+            if orders[0].get('items') is not None:
+                print("❌ Failed - Items returned without include_items")
+                return False
+            print(f"Latest order: {orders[0]['id']}, more: {bool(response.get('next_cursor'))}")
+        return success
+
     def test_admin_stats(self):
         """Test admin statistics endpoint"""
         success, response = self.run_test(
@@ -276,7 +374,25 @@ class EcommerceAPITester:
         if success and response:
             print(f"Total orders: {response.get('total_orders', 0)}")
             print(f"Total revenue: ${response.get('total_purchase_amount', 0)}")
-            print(f"Discount codes: {len(response.get('discount_codes', []))}")
+            print(f"Discount codes: {response.get('discount_codes_issued', 0)} issued, "
+                  f"{response.get('discount_codes_used', 0)} used")
+        return success
+
+    def test_list_discount_codes(self):
+        """Test paging through discount codes by status"""
+        success, response = self.run_test(
+            "List Unused Discount Codes",
+            "GET",
+            "admin/discount-codes",
+            200,
+            params={"status": "unused", "limit": 1}
+        )
+        if success and response:
+            codes = response.get('codes', [])
+            if any(code['is_used'] for code in codes):
+                print("❌ Failed - Used code returned for status=unused")
+                return False
+            print(f"Codes on first page: {len(codes)}, more: {bool(response.get('next_cursor'))}")
         return success
 
     def test_admin_generate_discount_invalid(self):
@@ -289,6 +405,193 @@ class EcommerceAPITester:
         )
         return success
 
+    def test_concurrent_cart_adds(self, count=100):
+        """Test parallel adds to one cart lose no increments"""
+        if len(self.product_ids) < 2:
+            print("❌ Insufficient product IDs available for concurrent cart test")
+            return False
+
+        self.tests_run += 1
+        print(f"\n🔍 Testing Concurrent Cart Adds ({count} requests)...")
+
+        cart_id = requests.post(f"{self.api_url}/cart/add", json={
+            "product_id": self.product_ids[0],
+            "quantity": 1
+        }).json()["cart_id"]
+
+        def add_item(i):
+            return requests.post(f"{self.api_url}/cart/add", json={
+                "cart_id": cart_id,
+                "product_id": self.product_ids[i % 2],
+                "quantity": 1
+            }).status_code
+
+        with ThreadPoolExecutor(max_workers=50) as executor:
+            statuses = list(executor.map(add_item, range(count)))
+
+        cart = requests.get(f"{self.api_url}/cart/{cart_id}").json()
+        quantities = {item["product_id"]: item["quantity"] for item in cart["items"]}
+        expected = {
+            self.product_ids[0]: 1 + (count + 1) // 2,
+            self.product_ids[1]: count // 2
+        }
+        if any(status != 200 for status in statuses) or quantities != expected:
+            print(f"❌ Failed - Expected {expected}, got {quantities}")
+            return False
+
+        self.tests_passed += 1
+        print(f"✅ Passed - Cart quantities: {quantities}")
+        return True
+
+    def test_idempotent_checkout(self, retries=5):
+        """Test retried checkouts with one Idempotency-Key place a single order"""
+        if not self.product_ids:
+            print("❌ No product IDs available for idempotent checkout test")
+            return False
+
+        self.tests_run += 1
+        print(f"\n🔍 Testing Idempotent Checkout ({retries} retries)...")
+
+        cart_id = requests.post(f"{self.api_url}/cart/add", json={
+            "product_id": self.product_ids[0],
+            "quantity": 1
+        }).json()["cart_id"]
+        headers = {"Idempotency-Key": str(uuid.uuid4())}
+        data = {
+            "cart_id": cart_id,
+            "customer_name": "Retry Customer",
+            "customer_email": "retry@example.com"
+        }
+
+        responses = [requests.post(f"{self.api_url}/checkout", json=data, headers=headers) for _ in range(retries)]
+        order_ids = {response.json().get("id") for response in responses if response.status_code == 200}
+        if len(order_ids) != 1 or any(response.status_code != 200 for response in responses):
+            print(f"❌ Failed - Expected one order, got {order_ids}")
+            return False
+        if not all(response.headers.get("Idempotent-Replayed") for response in responses[1:]):
+            print("❌ Failed - Retries were not marked as replayed")
+            return False
+
+        self.tests_passed += 1
+        print(f"✅ Passed - {retries} requests, one order {order_ids.pop()}")
+        return True
+
+    def test_concurrent_same_cart_checkout(self, attempts=10):
+        """Test parallel checkouts of one cart without an Idempotency-Key place a single order"""
+        if not self.product_ids:
+            print("❌ No product IDs available for same cart checkout test")
+            return False
+
+        self.tests_run += 1
+        print(f"\n🔍 Testing Concurrent Checkouts of One Cart ({attempts} attempts)...")
+
+        cart_id = requests.post(f"{self.api_url}/cart/add", json={
+            "product_id": self.product_ids[0],
+            "quantity": 1
+        }).json()["cart_id"]
+        data = {
+            "cart_id": cart_id,
+            "customer_name": "Double Click Customer",
+            "customer_email": "doubleclick@example.com"
+        }
+
+        with ThreadPoolExecutor(max_workers=attempts) as executor:
+            statuses = list(executor.map(
+                lambda _: requests.post(f"{self.api_url}/checkout", json=data).status_code, range(attempts)
+            ))
+        placed = statuses.count(200)
+        if placed != 1 or any(status not in (200, 404, 409) for status in statuses):
+            print(f"❌ Failed - Expected one order, got statuses {statuses}")
+            return False
+
+        self.tests_passed += 1
+        print(f"✅ Passed - {attempts} attempts, one order")
+        return True
+
+    def test_concurrent_checkouts(self, count=200):
+        """Test parallel checkouts get unique order numbers and one code per nth order"""
+        if not self.product_ids:
+            print("❌ No product IDs available for concurrent checkout test")
+            return False
+
+        self.tests_run += 1
+        print(f"\n🔍 Testing Concurrent Checkouts ({count} orders)...")
+
+        def place_order(i):
+            cart = requests.post(f"{self.api_url}/cart/add", json={
+                "product_id": self.product_ids[i % len(self.product_ids)],
+                "quantity": 1
+            }).json()
+            response = requests.post(f"{self.api_url}/checkout", json={
+                "cart_id": cart["cart_id"],
+                "customer_name": f"Concurrent Customer {i}",
+                "customer_email": f"concurrent{i}@example.com"
+            })
+            return response.json() if response.status_code == 200 else None
+
+        with ThreadPoolExecutor(max_workers=50) as executor:
+            orders = list(executor.map(place_order, range(count)))
+
+        if any(order is None for order in orders):
+            print("❌ Failed - Some checkouts did not succeed")
+            return False
+
+        order_numbers = [order["order_number"] for order in orders]
+        if len(set(order_numbers)) != count:
+            print("❌ Failed - Duplicate order numbers were allocated")
+            return False
+        if max(order_numbers) - min(order_numbers) + 1 != count:
+            print("❌ Failed - Order numbers skipped values")
+            return False
+
+        for order in orders:
+            expects_code = order["order_number"] % NTH_ORDER_FOR_DISCOUNT == 0
+            if expects_code != bool(order.get("generated_discount_code")):
+                print(f"❌ Failed - Order #{order['order_number']} discount code mismatch")
+                return False
+
+        self.tests_passed += 1
+        codes = [order["generated_discount_code"] for order in orders if order.get("generated_discount_code")]
+        self.race_discount_code = codes[0] if codes else None
+        print(f"✅ Passed - {count} orders, {len(codes)} discount codes generated")
+        return True
+
+    def test_concurrent_discount_redemption(self, count=50):
+        """Test racing checkouts on one discount code redeem it exactly once"""
+        if not self.race_discount_code or not self.product_ids:
+            print("❌ No unused discount code available for redemption race test")
+            return False
+
+        self.tests_run += 1
+        print(f"\n🔍 Testing Concurrent Discount Redemption ({count} checkouts)...")
+
+        cart_ids = [
+            requests.post(f"{self.api_url}/cart/add", json={
+                "product_id": self.product_ids[0],
+                "quantity": 1
+            }).json()["cart_id"]
+            for _ in range(count)
+        ]
+
+        def redeem(cart_id):
+            return requests.post(f"{self.api_url}/checkout", json={
+                "cart_id": cart_id,
+                "customer_name": "Race Customer",
+                "customer_email": "race@example.com",
+                "discount_code": self.race_discount_code
+            }).status_code
+
+        with ThreadPoolExecutor(max_workers=count) as executor:
+            statuses = list(executor.map(redeem, cart_ids))
+
+        if statuses.count(200) != 1 or statuses.count(400) != count - 1:
+            print(f"❌ Failed - Expected exactly one redemption, got {statuses.count(200)}")
+            return False
+
+        self.tests_passed += 1
+        print(f"✅ Passed - Code {self.race_discount_code} redeemed exactly once")
+        return True
+
 def main():
     print("🚀 Starting Ecommerce API Tests...")
     tester = EcommerceAPITester()
@@ -297,16 +600,26 @@ def main():
     tests = [
         tester.test_get_products,
         tester.test_get_single_product,
+        tester.test_search_products,
+        tester.test_conditional_get_product,
         tester.test_add_to_cart,
         tester.test_add_more_to_cart,
         tester.test_get_cart,
         tester.test_update_cart_quantity,
         tester.test_remove_from_cart,
+        tester.test_batch_cart_operations,
         tester.test_checkout_without_discount,
         tester.test_checkout_with_invalid_discount,
         tester.test_checkout_with_valid_discount,
+        tester.test_customer_order_history,
         tester.test_admin_stats,
-        tester.test_admin_generate_discount_invalid
+        tester.test_list_discount_codes,
+        tester.test_admin_generate_discount_invalid,
+        tester.test_concurrent_cart_adds,
+        tester.test_idempotent_checkout,
+        tester.test_concurrent_same_cart_checkout,
+        tester.test_concurrent_checkouts,
+        tester.test_concurrent_discount_redemption
     ]
     
     for test in tests:
@@ -0,0 +1,192 @@
+"""Concurrent load test for the /api surface.
+
+Workers loop over a weighted mix of scenarios (browse, cart, checkout, admin)
+for a fixed duration and report throughput and p50/p95/p99 latency per
+endpoint as JSON. By default the FastAPI app is driven in-process over the
+httpx ASGI transport against a throwaway database; pass ``--base-url`` to load
+a running server instead (e.g. a local uvicorn).
+
+Requests shed by admission control (``503`` with ``Retry-After``) are counted
+per endpoint instead of timed, and the worker backs off for the advertised
+time as a client would.
+
+    python benchmarks/api_load.py --concurrency 50 --duration 30 --output run.json
+    python benchmarks/api_load.py --mix browse=90,checkout=10 --compare run.json
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+
+import httpx
+
+from common import server, summarize, setup_database, drop_database
+
+DEFAULT_MIX = "browse=70,cart=20,checkout=8,admin=2"
+
+
+class LoadRecorder:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.shed = defaultdict(int)
+
+    async def call(self, http, name, method, url, **kwargs):
+        start = time.perf_counter()
+        response = await http.request(method, url, **kwargs)
+        if response.status_code == 503 and "retry-after" in response.headers:
+            self.shed[name] += 1
+            await asyncio.sleep(float(response.headers["retry-after"]))
+            return response
+        self.latencies[name].append((time.perf_counter() - start) * 1000)
+        if response.status_code >= 400:
+            self.errors[name] += 1
+        return response
+
+
+async def browse(http, recorder, product_ids):
+    await recorder.call(http, "GET /api/products", "GET", "/api/products")
+    await recorder.call(
+        http, "GET /api/products/{product_id}", "GET", f"/api/products/{random.choice(product_ids)}"
+    )
+
+
+async def cart(http, recorder, product_ids):
+    response = await recorder.call(
+        http, "POST /api/cart/add", "POST", "/api/cart/add",
+        json={"product_id": random.choice(product_ids), "quantity": 1}
+    )
+    if response.status_code >= 400:
+        return None
+    cart_id = response.json()["cart_id"]
+    await recorder.call(http, "GET /api/cart/{cart_id}", "GET", f"/api/cart/{cart_id}")
+    return cart_id
+
+
+async def checkout(http, recorder, product_ids):
+    cart_id = await cart(http, recorder, product_ids)
+    if cart_id is None:
+        return
+    await recorder.call(
+        http, "POST /api/checkout", "POST", "/api/checkout",
+        json={
+            "cart_id": cart_id,
+            "customer_name": "Load Customer",
+            "customer_email": "load@example.com"
+        }
+    )
+
+
+async def admin(http, recorder, product_ids):
+    await recorder.call(http, "GET /api/admin/stats", "GET", "/api/admin/stats")
+
+
+SCENARIOS = {"browse": browse, "cart": cart, "checkout": checkout, "admin": admin}
+
+
+def parse_mix(mix):
+    weights = {}
+    for part in mix.split(","):
+        name, weight = part.split("=")
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown scenario '{name}', expected one of {sorted(SCENARIOS)}")
+        weights[name] = float(weight)
+    return weights
+
+
+async def run_load(http, weights, concurrency, duration):
+    products = (await http.get("/api/products", params={"limit": 200})).json()["products"]
+    product_ids = [product["id"] for product in products]
+    recorder = LoadRecorder()
+    names, scenario_weights = list(weights), list(weights.values())
+    deadline = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < deadline:
+            scenario = SCENARIOS[random.choices(names, scenario_weights)[0]]
+            await scenario(http, recorder, product_ids)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    endpoints = {
+        name: {
+            **summarize(recorder.latencies[name], elapsed),
+            "errors": recorder.errors[name],
+            "shed": recorder.shed[name]
+        }
+        for name in sorted(set(recorder.latencies) | set(recorder.shed))
+    }
+    all_latencies = [sample for latencies in recorder.latencies.values() for sample in latencies]
+    return {
+        "total": {
+            **summarize(all_latencies, elapsed),
+            "errors": sum(recorder.errors.values()),
+            "shed": sum(recorder.shed.values())
+        },
+        "endpoints": endpoints
+    }
+
+
+def compare(results, baseline):
+    """Percent change of throughput and p95/p99 per endpoint against a previous run."""
+    changes = {}
+    for name, current in results["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if not previous or not previous.get("count"):
+            continue
+        changes[name] = {
+            metric: round((current[metric] - previous[metric]) / previous[metric] * 100, 1)
+            for metric in ("throughput_per_s", "p95_ms", "p99_ms")
+            if previous.get(metric) and metric in current
+        }
+    return changes
+
+
+async def main(args):
+    weights = parse_mix(args.mix)
+    if args.base_url:
+        async with httpx.AsyncClient(base_url=args.base_url, timeout=args.timeout) as http:
+            results = await run_load(http, weights, args.concurrency, args.duration)
+    else:
+        await setup_database()
+        # Checkouts should measure the write path, not run out of stock
+        await server.storage.products.set_stock(10 ** 9)
+        transport = httpx.ASGITransport(app=server.app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=args.timeout) as http:
+                results = await run_load(http, weights, args.concurrency, args.duration)
+        finally:
+            await drop_database()
+
+    report = {
+        "config": {
+            "target": args.base_url or "in-process",
+            "mix": weights,
+            "concurrency": args.concurrency,
+            "duration_s": args.duration
+        },
+        **results
+    }
+    if args.compare:
+        with open(args.compare) as f:
+            report["change_pct"] = compare(results, json.load(f))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--base-url", help="load a running server instead of the in-process app")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"scenario weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    parser.add_argument("--compare", help="previous JSON report to diff against")
+    asyncio.run(main(parser.parse_args()))
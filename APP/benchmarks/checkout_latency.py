@@ -0,0 +1,114 @@
+"""Checkout latency benchmark: legacy sequential path vs. transactional checkout.
+
+Both paths run against the MongoDB configured in backend/.env, using a
+throwaway database, and per-path latency percentiles are printed as JSON.
+The transactional checkout leaves cart cleanup and stats to the outbox
+worker, which is not running here; the time to drain those events
+afterwards is reported as ``outbox_drain``.
+
+    python benchmarks/checkout_latency.py --orders 500 --concurrency 20
+"""
+import argparse
+import asyncio
+import json
+import secrets
+import time
+import uuid
+from datetime import datetime, timezone
+
+from common import server, summarize, setup_database, drop_database, new_cart
+from server import CheckoutRequest
+
+
+async def legacy_checkout(request):
+    """The pre-transaction checkout: one sequential await per step."""
+    db = server.db
+    cart = await db.carts.find_one({"id": request.cart_id}, {"_id": 0})
+    subtotal = sum(item["price"] * item["quantity"] for item in cart["items"])
+    discount_amount = 0.0
+    if request.discount_code:
+        discount_code = await db.discount_codes.find_one(
+            {"code": request.discount_code, "is_used": False}, {"_id": 0}
+        )
+        discount_amount = subtotal * (discount_code["percentage"] / 100)
+        await db.discount_codes.update_one(
+            {"code": request.discount_code},
+            {"$set": {"is_used": True, "used_at": datetime.now(timezone.utc).isoformat()}}
+        )
+    order = {
+        "id": str(uuid.uuid4()),
+        "items": cart["items"],
+        "subtotal": subtotal,
+        "discount_code": request.discount_code,
+        "discount_amount": discount_amount,
+        "total": subtotal - discount_amount,
+        "customer_name": request.customer_name,
+        "customer_email": request.customer_email,
+        "created_at": datetime.now(timezone.utc).isoformat()
+    }
+    await db.orders.insert_one(order)
+    await db.carts.delete_one({"id": request.cart_id})
+    total_orders = await db.orders.count_documents({})
+    if total_orders % server.NTH_ORDER_FOR_DISCOUNT == 0:
+        await db.discount_codes.insert_one({
+            "code": f"DISCOUNT{secrets.token_hex(4).upper()}",
+            "percentage": server.DISCOUNT_PERCENTAGE,
+            "is_used": False,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "used_at": None
+        })
+    return order
+
+
+async def prepare_requests(count, product_ids):
+    requests = []
+    for i in range(count):
+        requests.append(CheckoutRequest(
+            cart_id=await new_cart(product_ids[i % len(product_ids)]),
+            customer_name=f"Bench Customer {i}",
+            customer_email=f"bench{i}@example.com"
+        ))
+    return requests
+
+
+async def run_path(checkout, requests, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def timed(request):
+        async with semaphore:
+            start = time.perf_counter()
+            await checkout(request)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[timed(request) for request in requests])
+    return summarize(latencies, time.perf_counter() - start)
+
+
+async def main(args):
+    if server.STORAGE_BACKEND != "mongo":
+        raise SystemExit("checkout_latency compares MongoDB write paths; unset STORAGE_BACKEND=memory")
+    await setup_database()
+    products = await server.db.products.find({}, {"_id": 0, "id": 1}).to_list(None)
+    product_ids = [product["id"] for product in products]
+
+    results = {"transactions": server.transactions_supported}
+    try:
+        for name, checkout in (("legacy", legacy_checkout), ("transactional", server.checkout)):
+            requests = await prepare_requests(args.orders, product_ids)
+            results[name] = await run_path(checkout, requests, args.concurrency)
+        start = time.perf_counter()
+        events = await server.drain_outbox()
+        elapsed = time.perf_counter() - start
+        results["outbox_drain"] = {"events": events, "seconds": round(elapsed, 3), "per_s": round(events / elapsed, 1)}
+    finally:
+        await drop_database()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
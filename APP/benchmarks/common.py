@@ -0,0 +1,62 @@
+"""Shared setup for the benchmarks in this directory.
+
+Importing this module points the backend at a throwaway database
+(``BENCH_DB_NAME``, default ``shopzen_bench``) on the MongoDB configured in
+backend/.env, so it must be imported before ``server``. Set
+``STORAGE_BACKEND=memory`` to run without MongoDB and measure handler and
+framework cost alone.
+"""
+import json
+import os
+import sys
+from pathlib import Path
+
+os.environ["DB_NAME"] = os.environ.get("BENCH_DB_NAME", "shopzen_bench")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+
+async def new_cart(product_id):
+    """Id of a new cart holding one ``product_id``, read from the handler's response."""
+    added = await server.add_to_cart(server.AddToCartRequest(product_id=product_id))
+    # With FAST_JSON_RESPONSES the handler returns an already rendered response
+    if isinstance(added, server.Response):
+        added = json.loads(added.body)
+    return added["cart_id"]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed):
+    """Throughput and latency percentiles (ms) for one series of samples."""
+    if not latencies:
+        return {"count": 0}
+    return {
+        "count": len(latencies),
+        "throughput_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3)
+    }
+
+
+async def setup_database():
+    """Prepare the benchmark database the way application startup would."""
+    server.connect_storage()
+    if server.STORAGE_BACKEND == "mongo":
+        await server.init_indexes()
+        server.transactions_supported = await server.detect_transaction_support()
+    await server.init_sample_products()
+    await server.init_order_sequence()
+    await server.init_order_stats()
+
+
+async def drop_database():
+    if server.client:
+        await server.client.drop_database(os.environ["DB_NAME"])
+    server.disconnect_storage()
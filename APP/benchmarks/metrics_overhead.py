@@ -0,0 +1,56 @@
+"""Instrumentation overhead on the hot GET /api/products path.
+
+Serves the same cached listing in-process with the metrics middleware
+disabled and enabled, interleaving rounds to cancel drift, and reports
+per-request latency for both plus the relative overhead.
+
+    python benchmarks/metrics_overhead.py --requests 20000
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from common import server, summarize, setup_database, drop_database
+
+
+async def measure(http, requests):
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(requests):
+        request_start = time.perf_counter()
+        await http.get("/api/products")
+        latencies.append((time.perf_counter() - request_start) * 1000)
+    return latencies, time.perf_counter() - start
+
+
+async def main(args):
+    await setup_database()
+    samples = {False: ([], 0.0), True: ([], 0.0)}
+    try:
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+            await http.get("/api/products")  # warm the catalog cache
+            for _ in range(args.rounds):
+                for enabled in (False, True):
+                    server.METRICS_ENABLED = enabled
+                    latencies, elapsed = await measure(http, args.requests // args.rounds)
+                    samples[enabled] = (samples[enabled][0] + latencies, samples[enabled][1] + elapsed)
+    finally:
+        await drop_database()
+
+    disabled, enabled = summarize(*samples[False]), summarize(*samples[True])
+    print(json.dumps({
+        "metrics_disabled": disabled,
+        "metrics_enabled": enabled,
+        "p50_overhead_pct": round((enabled["p50_ms"] - disabled["p50_ms"]) / disabled["p50_ms"] * 100, 1)
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=10)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,108 @@
+"""Latency of paging through one customer's order history.
+
+Seeds ``--orders`` orders for one customer among ``--other-orders`` placed by
+others, then walks the customer's whole history with keyset cursors, newest
+first, with and without line items. Keyset pagination keeps the last page
+as cheap as the first, so ``first_page`` and ``last_page`` should match. On
+MongoDB the report includes the documents examined for the last page, which
+should equal the page size when the ``(customer_email, created_at, id)``
+index is used.
+
+    python benchmarks/order_history.py --orders 5000 --page-size 20
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from common import server, summarize, setup_database, drop_database
+
+CUSTOMER_EMAIL = "history@example.com"
+
+
+def make_order(customer_email, created_at):
+    items = [
+        {"product_id": str(uuid.uuid4()), "quantity": 1 + i, "name": f"Item {i}", "price": 9.99, "image": ""}
+        for i in range(3)
+    ]
+    subtotal = sum(item["price"] * item["quantity"] for item in items)
+    return {
+        "id": str(uuid.uuid4()),
+        "items": items,
+        "subtotal": subtotal,
+        "discount_code": None,
+        "discount_amount": 0.0,
+        "total": subtotal,
+        "customer_name": "History Customer",
+        "customer_email": customer_email,
+        "created_at": created_at.isoformat(),
+        "order_number": None,
+        "generated_discount_code": None
+    }
+
+
+async def seed_orders(count, other_count):
+    start = datetime.now(timezone.utc) - timedelta(days=365)
+    orders = [make_order(CUSTOMER_EMAIL, start + timedelta(minutes=i)) for i in range(count)]
+    orders += [make_order(f"other{i}@example.com", start + timedelta(minutes=i)) for i in range(other_count)]
+    for offset in range(0, len(orders), 500):
+        await asyncio.gather(*(server.storage.orders.insert(order) for order in orders[offset:offset + 500]))
+
+
+async def walk_history(page_size, include_items):
+    """Time every page of the customer's history; returns per-page latencies and the last cursor used."""
+    latencies, cursor, last_cursor, seen = [], None, None, 0
+    start = time.perf_counter()
+    while True:
+        page_start = time.perf_counter()
+        orders = await server.storage.orders.list_by_customer(
+            CUSTOMER_EMAIL, server.decode_cursor(cursor) if cursor else None, page_size + 1, include_items
+        )
+        latencies.append((time.perf_counter() - page_start) * 1000)
+        seen += min(len(orders), page_size)
+        if len(orders) <= page_size:
+            return latencies, last_cursor, seen, time.perf_counter() - start
+        last_cursor = cursor
+        cursor = server.encode_cursor(orders[page_size - 1]["created_at"], orders[page_size - 1]["id"])
+
+
+async def docs_examined(cursor, page_size):
+    query = {"customer_email": CUSTOMER_EMAIL}
+    if cursor:
+        created_at, order_id = server.decode_cursor(cursor)
+        query["$or"] = [{"created_at": {"$lt": created_at}}, {"created_at": created_at, "id": {"$lt": order_id}}]
+    plan = await server.db.orders.find(query, {"_id": 0, "items": 0}).sort(
+        [("created_at", -1), ("id", -1)]
+    ).limit(page_size + 1).explain()
+    return plan["executionStats"]["totalDocsExamined"]
+
+
+async def main(args):
+    await setup_database()
+    results = {"storage": server.STORAGE_BACKEND, "orders": args.orders, "page_size": args.page_size}
+    try:
+        await seed_orders(args.orders, args.other_orders)
+        for include_items in (False, True):
+            latencies, last_cursor, seen, elapsed = await walk_history(args.page_size, include_items)
+            report = {
+                "pages": summarize(latencies, elapsed),
+                "first_page_ms": round(latencies[0], 3),
+                "last_page_ms": round(latencies[-1], 3),
+                "orders_seen": seen
+            }
+            if server.STORAGE_BACKEND == "mongo" and not include_items:
+                report["last_page_docs_examined"] = await docs_examined(last_cursor, args.page_size)
+            results["with_items" if include_items else "summaries"] = report
+    finally:
+        await drop_database()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=5000, help="orders placed by the measured customer")
+    parser.add_argument("--other-orders", type=int, default=20000, help="orders placed by other customers")
+    parser.add_argument("--page-size", type=int, default=20)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,87 @@
+"""Per-request CPU to serve a 1,000-product listing under each response path.
+
+No database is involved: the same in-memory products are served by
+  * ``response_model``: raw dicts re-validated through ``List[Product]`` (the old path)
+  * ``fast``: dicts validated once up front, serialized with ``FastJSONResponse``
+  * ``cached``: the body serialized once and sent as-is, as the catalog cache does
+  * ``not_modified``: a revalidation whose ``If-None-Match`` matches the cached ETag
+
+    python benchmarks/response_cpu.py --products 1000 --requests 500
+"""
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from typing import List
+
+import httpx
+from fastapi import FastAPI, Response, Header
+
+from common import server, percentile
+from server import Product, FastJSONResponse, conditional_response, make_etag
+
+
+def build_app(products):
+    validated = [Product.model_validate(product).model_dump() for product in products]
+    body = json.dumps(validated).encode()
+    etag = make_etag(body)
+    bench_app = FastAPI()
+
+    @bench_app.get("/response_model", response_model=List[Product])
+    async def response_model_path():
+        return products
+
+    @bench_app.get("/fast")
+    async def fast_path():
+        return FastJSONResponse(validated)
+
+    @bench_app.get("/cached")
+    async def cached_path():
+        return Response(content=body, media_type="application/json")
+
+    @bench_app.get("/not_modified")
+    async def not_modified_path(if_none_match: str = Header(None)):
+        return conditional_response(body, etag, if_none_match, "no-cache")
+
+    return bench_app
+
+
+async def main(args):
+    products = [
+        {
+            "id": str(uuid.uuid4()),
+            "name": f"Product {i}",
+            "description": "Benchmark product with a moderately long description " * 2,
+            "price": round(10 + i * 0.37, 2),
+            "image": f"https://example.com/images/{i}.jpg",
+            "category": "Electronics" if i % 2 else "Accessories",
+            "stock": 100
+        }
+        for i in range(args.products)
+    ]
+    transport = httpx.ASGITransport(app=build_app(products))
+    results = {"orjson": server.orjson is not None}
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as http:
+        for path in ("response_model", "fast", "cached", "not_modified"):
+            response = await http.get(f"/{path}")
+            headers = {"If-None-Match": response.headers["etag"]} if path == "not_modified" else {}
+            cpu_ms = []
+            for _ in range(args.requests):
+                start = time.process_time()
+                response = await http.get(f"/{path}", headers=headers)
+                cpu_ms.append((time.process_time() - start) * 1000)
+            results[path] = {
+                "mean_cpu_ms": round(sum(cpu_ms) / len(cpu_ms), 3),
+                "p50_cpu_ms": round(percentile(cpu_ms, 50), 3),
+                "p99_cpu_ms": round(percentile(cpu_ms, 99), 3),
+                "body_bytes": len(response.content)
+            }
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=500)
+    asyncio.run(main(parser.parse_args()))
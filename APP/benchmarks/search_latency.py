@@ -0,0 +1,122 @@
+"""Query latency of the product search index on a synthetic catalog.
+
+Builds ``ProductSearchIndex`` over generated products (names from a small
+vocabulary, descriptions drawn with a Zipf-like skew so some words match most
+of the catalog) and reports build time and p50/p95/p99/max latency per query
+shape:
+  * ``typeahead``: every prefix of a product name as it is typed
+  * ``word``: one complete word from a name
+  * ``words``: two complete words from the same name
+  * ``category``: a typeahead prefix restricted to one category
+  * ``update``: re-indexing one product, as a change stream event does
+
+No database is involved.
+
+    python benchmarks/search_latency.py --products 100000 --queries 2000
+"""
+import argparse
+import gc
+import json
+import random
+import time
+
+from common import percentile
+from search import ProductSearchIndex
+
+ADJECTIVES = [
+    "wireless", "portable", "smart", "ergonomic", "compact", "premium", "rugged", "slim", "classic", "ultra",
+    "magnetic", "foldable", "adjustable", "waterproof", "vintage", "modular", "silent", "heated", "digital", "solar"
+]
+NOUNS = [
+    "headphones", "keyboard", "mouse", "charger", "speaker", "watch", "lamp", "backpack", "stand", "hub",
+    "camera", "tripod", "monitor", "cable", "router", "microphone", "tablet", "case", "bottle", "kettle",
+    "blender", "fan", "heater", "drone", "projector", "scanner", "printer", "earbuds", "controller", "dock"
+]
+CATEGORIES = [
+    "Electronics", "Accessories", "Audio", "Home", "Kitchen", "Outdoor",
+    "Office", "Gaming", "Photography", "Fitness", "Travel", "Lighting"
+]
+
+
+def build_products(count, vocabulary_size, rng):
+    vocabulary = [f"w{i}" for i in range(vocabulary_size)]
+    weights = [1 / (rank + 1) for rank in range(vocabulary_size)]
+    products = []
+    for i in range(count):
+        name = f"{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {rng.choice(ADJECTIVES)} {i:x}"
+        products.append({
+            "id": f"p{i}",
+            "name": name.title(),
+            "description": " ".join(rng.choices(vocabulary, weights, k=rng.randint(12, 30))),
+            "category": rng.choice(CATEGORIES)
+        })
+    return products
+
+
+def build_queries(products, count, rng):
+    queries = {"typeahead": [], "word": [], "words": [], "category": []}
+    for product in rng.sample(products, count):
+        words = product["name"].lower().split()
+        typed = " ".join(words[:2])
+        queries["typeahead"].extend(typed[:end] for end in range(1, len(typed) + 1))
+        queries["word"].append((rng.choice(words[:3]), None))
+        queries["words"].append((f"{words[0]} {words[1]} ", None))
+        queries["category"].append((typed[:rng.randint(1, len(typed))], product["category"]))
+    queries["typeahead"] = [(query, None) for query in queries["typeahead"]]
+    return queries
+
+
+def summarize_us(samples):
+    return {
+        "count": len(samples),
+        "p50_us": round(percentile(samples, 50), 1),
+        "p95_us": round(percentile(samples, 95), 1),
+        "p99_us": round(percentile(samples, 99), 1),
+        "max_us": round(max(samples), 1)
+    }
+
+
+def main(args):
+    rng = random.Random(args.seed)
+    products = build_products(args.products, args.vocabulary, rng)
+    index = ProductSearchIndex()
+    start = time.perf_counter()
+    index.add_many(products)
+    results = {"products": args.products, "build_s": round(time.perf_counter() - start, 2), **index.stats()}
+    # The server freezes its startup heap the same way, so full collections skip the index
+    gc.collect()
+    gc.freeze()
+
+    queries = build_queries(products, args.queries, rng)
+    # Per-term rankings are sorted on first use; report steady state after a warm-up pass
+    start = time.perf_counter()
+    for shape in queries.values():
+        for query, category in shape:
+            index.search(query, args.limit, category)
+    results["warmup_s"] = round(time.perf_counter() - start, 2)
+
+    for name, shape in queries.items():
+        samples = []
+        for query, category in shape:
+            start = time.perf_counter()
+            index.search(query, args.limit, category)
+            samples.append((time.perf_counter() - start) * 1e6)
+        results[name] = summarize_us(samples)
+
+    samples = []
+    for product in rng.sample(products, args.queries):
+        start = time.perf_counter()
+        index.add({**product, "name": product["name"] + " Refurbished"})
+        samples.append((time.perf_counter() - start) * 1e6)
+    results["update"] = summarize_us(samples)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--products", type=int, default=100000)
+    parser.add_argument("--queries", type=int, default=2000, help="products sampled for queries")
+    parser.add_argument("--vocabulary", type=int, default=5000, help="distinct description words")
+    parser.add_argument("--limit", type=int, default=10, help="results per query")
+    parser.add_argument("--seed", type=int, default=1)
+    main(parser.parse_args())
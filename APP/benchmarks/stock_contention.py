@@ -0,0 +1,77 @@
+"""Stock contention load test: many concurrent checkouts against a few hot SKUs.
+
+Each hot product starts with ``--stock`` units, and ``--orders`` checkouts
+race for them. The run fails unless exactly the available units are sold and
+no product's stock ever goes negative. Uses the MongoDB configured in
+backend/.env with a throwaway database, or STORAGE_BACKEND=memory.
+
+    python benchmarks/stock_contention.py --orders 5000 --hot-skus 3 --stock 200
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+
+from fastapi import HTTPException
+
+from common import server, setup_database, drop_database, new_cart
+from server import CheckoutRequest
+
+
+async def main(args):
+    await setup_database()
+
+    products = await server.storage.products.list_page(None, None, None, "id", False, None, args.hot_skus)
+    hot_ids = [product["id"] for product in products]
+    await server.storage.products.set_stock(args.stock, hot_ids)
+
+    requests = []
+    for i in range(args.orders):
+        requests.append(CheckoutRequest(
+            cart_id=await new_cart(hot_ids[i % len(hot_ids)]),
+            customer_name=f"Load Customer {i}",
+            customer_email=f"load{i}@example.com"
+        ))
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    outcomes = {"sold": 0, "out_of_stock": 0, "errors": 0}
+
+    async def attempt(request):
+        async with semaphore:
+            try:
+                await server.checkout(request)
+                outcomes["sold"] += 1
+            except HTTPException as e:
+                outcomes["out_of_stock" if e.status_code == 409 else "errors"] += 1
+
+    try:
+        start = time.perf_counter()
+        await asyncio.gather(*[attempt(request) for request in requests])
+        elapsed = time.perf_counter() - start
+
+        remaining = await server.storage.products.get_many(hot_ids)
+    finally:
+        await drop_database()
+
+    expected_sold = min(args.orders, args.stock * len(hot_ids))
+    results = {
+        "transactions": server.transactions_supported,
+        "orders": args.orders,
+        "hot_skus": len(hot_ids),
+        **outcomes,
+        "expected_sold": expected_sold,
+        "min_stock": min(product["stock"] for product in remaining),
+        "throughput_per_s": round(args.orders / elapsed, 1)
+    }
+    print(json.dumps(results, indent=2))
+    return results["sold"] == expected_sold and results["min_stock"] >= 0 and not outcomes["errors"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=5000)
+    parser.add_argument("--hot-skus", type=int, default=3)
+    parser.add_argument("--stock", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=500)
+    sys.exit(0 if asyncio.run(main(parser.parse_args())) else 1)
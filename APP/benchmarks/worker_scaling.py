@@ -0,0 +1,153 @@
+"""Throughput scaling of the API server from 1 to N worker processes.
+
+For each worker count the benchmark starts ``backend/serve.py`` on a free port
+against the throwaway benchmark database, waits until every worker has
+reported in through ``/api/metrics``, and loads it with several
+``api_load.py --base-url`` client processes at once so the load generator is
+not the bottleneck. It reports combined throughput, the worst client p95 and
+the speedup over the first worker count as JSON.
+
+    python benchmarks/worker_scaling.py --workers 1,2,4 --clients 4 --duration 20
+
+The memory storage backend only runs with one worker and its stock cannot be
+topped up from outside the server, so use a mix without checkouts there.
+"""
+import argparse
+import asyncio
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+from api_load import DEFAULT_MIX, parse_mix
+from common import server, setup_database, drop_database
+
+BENCH_DIR = Path(__file__).resolve().parent
+SERVE = BENCH_DIR.parent / "backend" / "serve.py"
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_for_workers(base_url, workers, timeout):
+    """Poll until the metrics of ``workers`` processes are visible."""
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as http:
+        while time.monotonic() < deadline:
+            try:
+                response = await http.get("/api/metrics")
+                match = re.search(r"^app_workers (\d+)$", response.text, re.MULTILINE)
+                if match and int(match.group(1)) >= workers:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.25)
+    raise RuntimeError(f"Server did not start {workers} workers within {timeout}s")
+
+
+async def run_clients(base_url, args, tmp_dir):
+    outputs = [Path(tmp_dir) / f"client-{i}.json" for i in range(args.clients)]
+    logs = [output.with_suffix(".log") for output in outputs]
+    processes = []
+    for output, log_path in zip(outputs, logs):
+        with open(log_path, "w") as log:
+            processes.append(await asyncio.create_subprocess_exec(
+                sys.executable, str(BENCH_DIR / "api_load.py"),
+                "--base-url", base_url,
+                "--mix", args.mix,
+                "--concurrency", str(args.concurrency),
+                "--duration", str(args.duration),
+                "--output", str(output),
+                stdout=subprocess.DEVNULL, stderr=log
+            ))
+    for process, log_path in zip(processes, logs):
+        if await process.wait():
+            print(log_path.read_text(), file=sys.stderr)
+            raise RuntimeError(f"Load client exited with status {process.returncode}")
+    reports = [json.loads(output.read_text()) for output in outputs]
+    return {
+        "requests": sum(report["total"]["count"] for report in reports),
+        "throughput_per_s": round(sum(report["total"]["throughput_per_s"] for report in reports), 1),
+        "p95_ms": max(report["total"]["p95_ms"] for report in reports),
+        "errors": sum(report["total"]["errors"] for report in reports)
+    }
+
+
+async def run_workers(workers, args, tmp_dir):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    log_path = Path(tmp_dir) / f"server-{workers}.log"
+    with open(log_path, "w") as log:
+        process = subprocess.Popen(
+            [sys.executable, str(SERVE), "--host", "127.0.0.1", "--port", str(port),
+             "--workers", str(workers), "--log-level", "warning"],
+            stdout=log, stderr=subprocess.STDOUT
+        )
+    try:
+        try:
+            await wait_for_workers(base_url, workers, args.startup_timeout)
+        except RuntimeError:
+            print(log_path.read_text(), file=sys.stderr)
+            raise
+        if server.STORAGE_BACKEND == "mongo":
+            # Checkouts should measure the write path, not run out of stock
+            await server.storage.products.set_stock(10 ** 9)
+        return {"workers": workers, **await run_clients(base_url, args, tmp_dir)}
+    finally:
+        process.terminate()
+        process.wait()
+
+
+async def main(args):
+    parse_mix(args.mix)
+    worker_counts = [int(count) for count in args.workers.split(",")]
+    # Seeds the catalog and indexes once so workers start against a ready database
+    await setup_database()
+    runs = []
+    try:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for workers in worker_counts:
+                runs.append(await run_workers(workers, args, tmp_dir))
+    finally:
+        await drop_database()
+
+    baseline = runs[0]["throughput_per_s"]
+    for run in runs:
+        run["speedup"] = round(run["throughput_per_s"] / baseline, 2) if baseline else None
+    report = {
+        "config": {
+            "storage": server.STORAGE_BACKEND,
+            "cpus": os.cpu_count(),
+            "mix": args.mix,
+            "clients": args.clients,
+            "concurrency_per_client": args.concurrency,
+            "duration_s": args.duration
+        },
+        "runs": runs
+    }
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts (default: 1,2,4)")
+    parser.add_argument("--clients", type=int, default=4, help="load generator processes per run")
+    parser.add_argument("--concurrency", type=int, default=20, help="concurrent requests per client")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per run")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help=f"scenario weights (default: {DEFAULT_MIX})")
+    parser.add_argument("--startup-timeout", type=float, default=30.0, help="seconds to wait for workers")
+    parser.add_argument("--output", help="write the JSON report to this file")
+    asyncio.run(main(parser.parse_args()))
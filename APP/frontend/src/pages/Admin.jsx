@@ -9,13 +9,24 @@ import { toast } from "sonner";
 
 const Admin = () => {
   const [stats, setStats] = useState(null);
+  const [sales, setSales] = useState([]);
+  const [topProducts, setTopProducts] = useState([]);
+  const [discountCodes, setDiscountCodes] = useState([]);
+  const [codeStatus, setCodeStatus] = useState("all");
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [loading, setLoading] = useState(true);
   const navigate = useNavigate();
 
   useEffect(() => {
     fetchStats();
+    fetchAnalytics();
   }, []);
 
+  useEffect(() => {
+    fetchDiscountCodes();
+  }, [codeStatus]);
+
   const fetchStats = async () => {
     try {
       const response = await axios.get(`${API}/admin/stats`);
@@ -28,11 +39,50 @@ const Admin = () => {
     }
   };
 
+  const fetchDiscountCodes = async (cursor = null) => {
+    try {
+      const params = { status: codeStatus };
+      if (cursor) params.cursor = cursor;
+      const response = await axios.get(`${API}/admin/discount-codes`, { params });
+      setDiscountCodes((prev) => (cursor ? [...prev, ...response.data.codes] : response.data.codes));
+      setNextCursor(response.data.next_cursor);
+    } catch (error) {
+      console.error("Error fetching discount codes:", error);
+      toast.error("Failed to load discount codes");
+    }
+  };
+
+  const loadMoreCodes = async () => {
+    setLoadingMore(true);
+    await fetchDiscountCodes(nextCursor);
+    setLoadingMore(false);
+  };
+
+  const fetchAnalytics = async () => {
+    try {
+      const start = new Date();
+      start.setFullYear(start.getFullYear() - 1);
+      const [salesResponse, topProductsResponse] = await Promise.all([
+        axios.get(`${API}/admin/analytics/sales`, {
+          params: { interval: "day", start: start.toISOString() }
+        }),
+        axios.get(`${API}/admin/analytics/top-products`, { params: { limit: 5 } })
+      ]);
+      setSales(salesResponse.data);
+      setTopProducts(topProductsResponse.data);
+    } catch (error) {
+      console.error("Error fetching analytics:", error);
+    }
+  };
+
+  const maxDailyRevenue = Math.max(1, ...sales.map((bucket) => bucket.revenue));
+
   const generateDiscount = async () => {
     try {
       const response = await axios.post(`${API}/admin/generate-discount`);
       toast.success(`Discount code generated: ${response.data.code}`);
       fetchStats();
+      fetchDiscountCodes();
     } catch (error) {
       console.error("Error generating discount:", error);
       if (error.response?.data?.detail) {
@@ -118,25 +168,86 @@ const Admin = () => {
           </Card>
         </div>
 
+        {/* Sales Analytics */}
+        <div className="grid grid-cols-1 lg:grid-cols-3 gap-6 mb-8">
+          <Card className="bg-white/90 backdrop-blur shadow-lg lg:col-span-2" data-testid="sales-chart-card">
+            <CardHeader>
+              <CardTitle className="text-xl">Daily Revenue</CardTitle>
+              <CardDescription>Last 12 months</CardDescription>
+            </CardHeader>
+            <CardContent>
+              {sales.length === 0 ? (
+                <div className="text-center py-12 text-gray-500" data-testid="no-sales-message">No sales data yet</div>
+              ) : (
+                <div className="flex items-end h-48 gap-px" data-testid="sales-chart">
+                  {sales.map((bucket) => (
+                    <div
+                      key={bucket.bucket}
+                      className="flex-1 bg-gradient-to-t from-orange-500 to-pink-500 rounded-t-sm min-w-[2px]"
+                      style={{ height: `${(bucket.revenue / maxDailyRevenue) * 100}%` }}
+                      title={`${new Date(bucket.bucket).toLocaleDateString()}: $${bucket.revenue.toFixed(2)} (${bucket.orders} orders)`}
+                    />
+                  ))}
+                </div>
+              )}
+            </CardContent>
+          </Card>
+
+          <Card className="bg-white/90 backdrop-blur shadow-lg" data-testid="top-products-card">
+            <CardHeader>
+              <CardTitle className="text-xl">Top Products</CardTitle>
+              <CardDescription>By revenue</CardDescription>
+            </CardHeader>
+            <CardContent>
+              {topProducts.length === 0 ? (
+                <div className="text-center py-12 text-gray-500">No sales data yet</div>
+              ) : (
+                <ul className="space-y-3">
+                  {topProducts.map((product, index) => (
+                    <li key={product.product_id} className="flex justify-between text-sm" data-testid={`top-product-${index}`}>
+                      <span className="text-gray-700">{product.name}</span>
+                      <span className="font-semibold text-gray-800">${product.revenue.toFixed(2)} · {product.units} sold</span>
+                    </li>
+                  ))}
+                </ul>
+              )}
+            </CardContent>
+          </Card>
+        </div>
+
         {/* Discount Codes Section */}
         <Card className="bg-white/90 backdrop-blur shadow-xl" data-testid="discount-codes-card">
           <CardHeader>
             <div className="flex items-center justify-between">
               <div>
                 <CardTitle className="text-2xl">Discount Codes</CardTitle>
-                <CardDescription className="mt-1">Manage and generate discount codes</CardDescription>
+                <CardDescription className="mt-1" data-testid="discount-code-counts">
+                  {stats.discount_codes_issued} issued · {stats.discount_codes_used} used · {stats.discount_codes_unused} active
+                </CardDescription>
+              </div>
+              <div className="flex items-center gap-3">
+                <select
+                  value={codeStatus}
+                  onChange={(e) => setCodeStatus(e.target.value)}
+                  className="border border-gray-300 rounded-full px-4 py-2 text-sm text-gray-700 bg-white"
+                  data-testid="discount-status-filter"
+                >
+                  <option value="all">All</option>
+                  <option value="unused">Active</option>
+                  <option value="used">Used</option>
+                </select>
+                <Button 
+                  onClick={generateDiscount}
+                  className="bg-gradient-to-r from-orange-500 to-pink-500 hover:from-orange-600 hover:to-pink-600 text-white rounded-full"
+                  data-testid="generate-discount-btn"
+                >
+                  Generate Code
+                </Button>
               </div>
-              <Button 
-                onClick={generateDiscount}
-                className="bg-gradient-to-r from-orange-500 to-pink-500 hover:from-orange-600 hover:to-pink-600 text-white rounded-full"
-                data-testid="generate-discount-btn"
-              >
-                Generate Code
-              </Button>
             </div>
           </CardHeader>
           <CardContent>
-            {stats.discount_codes.length === 0 ? (
+            {discountCodes.length === 0 ? (
               <div className="text-center py-12 text-gray-500" data-testid="no-discount-codes-message">
                 <Tag className="w-16 h-16 mx-auto mb-4 text-gray-300" />
                 <p>No discount codes generated yet</p>
@@ -154,8 +265,8 @@ const Admin = () => {
                     </tr>
                   </thead>
                   <tbody>
-                    {stats.discount_codes.map((code, index) => (
-                      <tr key={index} className="border-b hover:bg-gray-50" data-testid={`discount-code-row-${index}`}>
+                    {discountCodes.map((code, index) => (
+                      <tr key={code.code} className="border-b hover:bg-gray-50" data-testid={`discount-code-row-${index}`}>
                         <td className="py-3 px-4 font-mono font-semibold text-orange-600" data-testid={`discount-code-${index}`}>{code.code}</td>
                         <td className="py-3 px-4" data-testid={`discount-percentage-${index}`}>{code.percentage}%</td>
                         <td className="py-3 px-4">
@@ -177,6 +288,19 @@ const Admin = () => {
                     ))}
                   </tbody>
                 </table>
+                {nextCursor && (
+                  <div className="text-center mt-6">
+                    <Button
+                      onClick={loadMoreCodes}
+                      disabled={loadingMore}
+                      variant="outline"
+                      className="rounded-full px-8 border-2 border-orange-300 text-orange-600 hover:bg-orange-50"
+                      data-testid="load-more-codes-btn"
+                    >
+                      {loadingMore ? "Loading..." : "Load More"}
+                    </Button>
+                  </div>
+                )}
               </div>
             )}
           </CardContent>
@@ -1,4 +1,4 @@
-import { useState, useEffect } from "react";
+import { useState, useEffect, useRef } from "react";
 import axios from "axios";
 import { API } from "../App";
 import { Button } from "../components/ui/button";
@@ -20,6 +20,8 @@ const Checkout = ({ cartId, updateCartId }) => {
     customer_email: "",
     discount_code: ""
   });
+  // Reused across resubmits so a retried checkout cannot place a second order
+  const idempotencyKey = useRef(crypto.randomUUID());
   const navigate = useNavigate();
 
   useEffect(() => {
@@ -63,6 +65,8 @@ const Checkout = ({ cartId, updateCartId }) => {
         customer_name: formData.customer_name,
         customer_email: formData.customer_email,
         discount_code: formData.discount_code || null
+      }, {
+        headers: { "Idempotency-Key": idempotencyKey.current }
       });
       
       setOrderDetails(response.data);
@@ -2,33 +2,72 @@ import { useState, useEffect } from "react";
 import axios from "axios";
 import { API } from "../App";
 import { Button } from "../components/ui/button";
+import { Input } from "../components/ui/input";
 import { Card, CardContent, CardDescription, CardFooter, CardHeader, CardTitle } from "../components/ui/card";
-import { ShoppingCart, Menu, X } from "lucide-react";
+import { ShoppingCart, Menu, X, Search } from "lucide-react";
 import { useNavigate } from "react-router-dom";
 import { toast } from "sonner";
 
 const Home = ({ cartId, updateCartId, cartItemsCount, fetchCartCount }) => {
   const [products, setProducts] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [loading, setLoading] = useState(true);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [mobileMenuOpen, setMobileMenuOpen] = useState(false);
+  const [searchQuery, setSearchQuery] = useState("");
+  const [searchResults, setSearchResults] = useState(null);
   const navigate = useNavigate();
 
   useEffect(() => {
     fetchProducts();
   }, []);
 
-  const fetchProducts = async () => {
+  useEffect(() => {
+    if (!searchQuery.trim()) {
+      setSearchResults(null);
+      return;
+    }
+    // Wait for a pause in typing and ignore answers to superseded queries
+    let cancelled = false;
+    const timer = setTimeout(async () => {
+      try {
+        const response = await axios.get(`${API}/products/search`, {
+          params: { q: searchQuery, limit: 50 }
+        });
+        if (!cancelled) setSearchResults(response.data);
+      } catch (error) {
+        console.error("Error searching products:", error);
+      }
+    }, 150);
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [searchQuery]);
+
+  const visibleProducts = searchResults ?? products;
+
+  const fetchProducts = async (cursor = null) => {
     try {
-      const response = await axios.get(`${API}/products`);
-      setProducts(response.data);
-      setLoading(false);
+      const response = await axios.get(`${API}/products`, {
+        params: cursor ? { cursor } : {}
+      });
+      setProducts((current) => cursor ? [...current, ...response.data.products] : response.data.products);
+      setNextCursor(response.data.next_cursor);
     } catch (error) {
       console.error("Error fetching products:", error);
       toast.error("Failed to load products");
+    } finally {
       setLoading(false);
+      setLoadingMore(false);
     }
   };
 
+  const loadMoreProducts = () => {
+    setLoadingMore(true);
+    fetchProducts(nextCursor);
+  };
+
   const addToCart = async (productId) => {
     try {
       const response = await axios.post(`${API}/cart/add`, {
@@ -142,6 +181,17 @@ const Home = ({ cartId, updateCartId, cartItemsCount, fetchCartCount }) => {
           <p className="text-lg md:text-xl text-gray-600 max-w-2xl mx-auto" data-testid="hero-subtitle">
             Shop the latest electronics and accessories with exclusive discounts on every 10th order!
           </p>
+          <div className="relative max-w-xl mx-auto mt-8">
+            <Search className="absolute left-4 top-1/2 -translate-y-1/2 w-5 h-5 text-gray-400" />
+            <Input
+              type="search"
+              placeholder="Search products..."
+              value={searchQuery}
+              onChange={(e) => setSearchQuery(e.target.value)}
+              className="pl-12 h-12 rounded-full bg-white/90"
+              data-testid="product-search-input"
+            />
+          </div>
         </div>
 
         {/* Products Grid */}
@@ -149,9 +199,13 @@ const Home = ({ cartId, updateCartId, cartItemsCount, fetchCartCount }) => {
           <div className="flex justify-center items-center h-64" data-testid="loading-spinner">
             <div className="animate-spin rounded-full h-16 w-16 border-t-4 border-orange-500"></div>
           </div>
+        ) : searchResults && searchResults.length === 0 ? (
+          <p className="text-center text-gray-600 py-16" data-testid="search-no-results">
+            No products match "{searchQuery}"
+          </p>
         ) : (
           <div className="grid grid-cols-1 sm:grid-cols-2 lg:grid-cols-3 xl:grid-cols-4 gap-6">
-            {products.map((product) => (
+            {visibleProducts.map((product) => (
               <Card 
                 key={product.id} 
                 className="group hover:shadow-2xl transition-all duration-300 hover:-translate-y-2 border-2 border-transparent hover:border-orange-200 bg-white/90 backdrop-blur"
@@ -190,6 +244,20 @@ const Home = ({ cartId, updateCartId, cartItemsCount, fetchCartCount }) => {
             ))}
           </div>
         )}
+
+        {!loading && !searchResults && nextCursor && (
+          <div className="flex justify-center mt-10">
+            <Button
+              onClick={loadMoreProducts}
+              disabled={loadingMore}
+              variant="outline"
+              className="rounded-full px-8 border-2 border-orange-300 text-orange-600 hover:bg-orange-50"
+              data-testid="load-more-btn"
+            >
+              {loadingMore ? "Loading..." : "Load More"}
+            </Button>
+          </div>
+        )}
       </section>
 
       {/* Footer */}